@@ -1,24 +1,43 @@
 import os
-import json
+import time
+import logging
+import importlib
+import threading
+from functools import partial
 import pandas as pd
-import plotly
-import plotly.express as px
-import plotly.graph_objects as go
 from datetime import datetime, timedelta
-from flask import Flask, render_template, request, redirect, url_for, flash
+from flask import Flask, current_app, render_template, request, redirect, url_for, flash, jsonify, abort, Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
-from sqlalchemy import text, create_engine
+from sqlalchemy import text, create_engine, event, bindparam
+from query_cache import QueryCache
+from rollups import RollupStore
+from query_executor import QueryExecutor
+from recommender import Recommender, carregar_compras
+from jobs import JobRunner
+from busca_clientes import IndiceClientes
+from recebiveis import CarteiraRecebiveis, FAIXAS, NOMES_FAIXAS
+import metrics
+from pagination import ler_pedido, sql_pagina, sql_totais, sql_ordenado, pagina_df, resposta_pagina
+import export
+import graficos as grafico
+from config import Config, INSTANCE_DIR
 
-app = Flask(__name__)
-app.config['SECRET_KEY'] = 'varejao-farma-bi-2025-v-final'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///varejaofarma.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-db = SQLAlchemy(app)
-login_manager = LoginManager(app)
+db = SQLAlchemy()
+login_manager = LoginManager()
 login_manager.login_view = 'login'
 
+# serviços do processo (cache de consultas, bancos locais, executores): montados por create_app com a configuração do app
+query_cache = rollups = query_executor = recommender = indice_clientes = recebiveis = jobs = None
+_rotas = []
+
+def rota(regra, **opcoes):
+    """Como app.route, mas a view só é registrada no app por create_app (o endpoint continua o nome da função)."""
+    def registrar(f):
+        _rotas.append((regra, f, opcoes))
+        return f
+    return registrar
+
 class DatabaseConfig(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     server = db.Column(db.String(200))
@@ -38,24 +57,121 @@ class User(UserMixin, db.Model):
 def load_user(user_id):
     return db.session.get(User, int(user_id))
 
-def get_sql_engine():
-    config = DatabaseConfig.query.first()
-    if not config or not config.is_configured: return None
+_erp_engine = None
+_erp_engine_lock = threading.Lock()
+_erp_conferido = 0.0
+_erp_connect_stats = {'conexoes': 0, 'falhas': 0, 'connect_ms_ultimo': 0.0, 'connect_ms_total': 0.0}
+
+def _instrument_pool(engine):
+    @event.listens_for(engine, 'do_connect')
+    def _inicio_connect(dialect, conn_rec, cargs, cparams):
+        conn_rec.info['connect_t0'] = time.perf_counter()
+
+    @event.listens_for(engine, 'connect')
+    def _fim_connect(dbapi_conn, conn_rec):
+        ms = (time.perf_counter() - conn_rec.info.pop('connect_t0', time.perf_counter())) * 1000
+        _erp_connect_stats['conexoes'] += 1
+        _erp_connect_stats['connect_ms_ultimo'] = ms
+        _erp_connect_stats['connect_ms_total'] += ms
+
+    @event.listens_for(engine, 'handle_error')
+    def _falha(ctx):
+        if ctx.is_disconnect or ctx.connection is None: _erp_connect_stats['falhas'] += 1
+
+def _build_sql_engine(config):
+    params = (f"DRIVER={{{config.driver}}};SERVER={config.server};DATABASE={config.database};"
+              f"UID={config.username};PWD={config.password};Connection Timeout=15;")
+    engine = create_engine(f"mssql+pyodbc:///?odbc_connect={params}",
+                           pool_size=current_app.config['ERP_POOL_SIZE'], max_overflow=current_app.config['ERP_MAX_OVERFLOW'],
+                           pool_timeout=current_app.config['ERP_POOL_TIMEOUT'], pool_recycle=current_app.config['ERP_POOL_RECYCLE'],
+                           pool_pre_ping=current_app.config['ERP_POOL_PRE_PING'])
+    _instrument_pool(engine)
+    metrics.instrumentar(engine, 'erp')
+    return engine
+
+def _versao_config_erp():
     try:
-        params = (f"DRIVER={{{config.driver}}};SERVER={config.server};DATABASE={config.database};"
-                  f"UID={config.username};PWD={config.password};Connection Timeout=15;")
-        return create_engine(f"mssql+pyodbc:///?odbc_connect={params}")
-    except: return None
+        with open(current_app.config['ERP_CONFIG_MARCA']) as f: return f.read().strip() or None
+    except OSError: return None
+
+_erp_versao = None
+
+def _conferir_versao_erp():
+    """Descarta o engine deste processo quando outro processo salvou uma configuração nova do ERP."""
+    global _erp_engine, _erp_versao, _erp_conferido
+    if time.monotonic() - _erp_conferido < current_app.config['ERP_CONFIG_CHECK']: return
+    with _erp_engine_lock:
+        _erp_conferido = time.monotonic()
+        versao = _versao_config_erp()
+        if versao == _erp_versao: return
+        if _erp_engine is not None: _erp_engine.dispose()
+        _erp_engine, _erp_versao = None, versao
+        query_cache.versao = versao or ''
+
+def get_sql_engine():
+    global _erp_engine
+    _conferir_versao_erp()
+    if _erp_engine is not None: return _erp_engine
+    with _erp_engine_lock:
+        if _erp_engine is None:
+            config = DatabaseConfig.query.first()
+            if not config or not config.is_configured: return None
+            try: _erp_engine = _build_sql_engine(config)
+            except Exception as e:
+                current_app.logger.error(f'Falha ao criar engine do ERP: {e}')
+                return None
+        return _erp_engine
+
+def reset_sql_engine():
+    """Grava uma nova versão da configuração do ERP e descarta o engine atual (e o pool); os outros
+    processos veem a versão em até ERP_CONFIG_CHECK segundos e o cache passa a usar chaves novas."""
+    global _erp_engine, _erp_versao, _erp_conferido
+    versao, marca = str(time.time_ns()), current_app.config['ERP_CONFIG_MARCA']
+    os.makedirs(os.path.dirname(marca), exist_ok=True)
+    with open(f'{marca}.{os.getpid()}.tmp', 'w') as f: f.write(versao)
+    os.replace(f'{marca}.{os.getpid()}.tmp', marca)
+    with _erp_engine_lock:
+        if _erp_engine is not None: _erp_engine.dispose()
+        _erp_engine, _erp_versao, _erp_conferido = None, versao, time.monotonic()
+        query_cache.versao = versao
+    query_cache.invalidate()
+
+def pool_stats():
+    stats = dict(_erp_connect_stats, configurado=_erp_engine is not None)
+    stats['connect_ms_medio'] = stats['connect_ms_total'] / stats['conexoes'] if stats['conexoes'] else 0.0
+    if _erp_engine is not None:
+        pool = _erp_engine.pool
+        stats.update({'tamanho': pool.size(), 'em_uso': pool.checkedout(), 'ociosas': pool.checkedin(), 'overflow': pool.overflow()})
+    return stats
+
+SQL_VENDEDORES = text("SELECT Codigo, Nome_Guerra FROM VENDE WHERE bloqueado = 0 ORDER BY Nome_Guerra")
+
+def _usa_rollups(d1, d2):
+    """Rollups cobrem [d1, d2]; se o período chega a hoje, o dia corrente é relido do ERP para o dia aberto."""
+    if not current_app.config['ROLLUPS_ENABLED'] or not rollups.cobre(d1, d2, com_aberto=True): return False
+    return pd.Timestamp(d2).date() < datetime.now().date() or _dia_aberto() is not None
+
+def _dia_aberto():
+    """Momento da leitura do dia corrente em uso nos rollups (relida após ROLLUPS_ABERTO_TTL s); None se o ERP falhou."""
+    engine = get_sql_engine()
+    if engine is None: return None
+    try: return rollups.atualizar_aberto(engine, current_app.config['ROLLUPS_ABERTO_TTL'])
+    except Exception as e:
+        current_app.logger.warning(f'Falha ao ler o dia corrente para os rollups: {e}')
+        return None
+
+def _usa_ciclo(ate):
+    return current_app.config['ROLLUPS_ENABLED'] and rollups.ciclo_cobre(ate)
 
 def _is_int_string(s: str) -> bool:
     if s is None: return False
     s = str(s).strip()
     return s.isdigit()
 
-@app.route('/')
+@rota('/')
 def index(): return redirect(url_for('login'))
 
-@app.route('/login', methods=['GET', 'POST'])
+@rota('/login', methods=['GET', 'POST'])
 def login():
     # BUSQUE A CONFIGURAÇÃO NO BANCO DE DADOS
     db_config = DatabaseConfig.query.first()
@@ -74,7 +190,7 @@ def login():
     # PASSE O OBJETO db_config PARA O TEMPLATE COM O NOME 'config'
     return render_template('login.html', config=db_config)
 
-@app.route('/config-db', methods=['GET', 'POST'])
+@rota('/config-db', methods=['GET', 'POST'])
 def config_db():
     if request.method == 'POST':
         c = DatabaseConfig.query.first() or DatabaseConfig()
@@ -82,55 +198,142 @@ def config_db():
         c.username, c.password = request.form.get('username'), request.form.get('password')
         c.driver, c.is_configured = request.form.get('driver'), True
         db.session.add(c); db.session.commit()
+        reset_sql_engine()
         flash('Banco configurado com sucesso!', 'success')
         return redirect(url_for('login'))
     return render_template('config_db.html')
 
-@app.route('/logout')
+@rota('/pool-stats')
+@login_required
+def pool_stats_view():
+    return jsonify(pool_stats())
+
+@rota('/cache-stats')
+@login_required
+def cache_stats_view():
+    return jsonify(dict(query_cache.stats(), graficos=grafico.stats()))
+
+@rota('/query-stats')
+@login_required
+def query_stats_view():
+    return jsonify(metrics.consultas_resumo(min(max(request.args.get('limite', 50, type=int), 1), 500)))
+
+@rota('/metrics')
+def metrics_view():
+    return Response(metrics.exportar(), mimetype='text/plain; version=0.0.4')
+
+@rota('/jobs-stats')
+@login_required
+def jobs_stats_view():
+    return jsonify(jobs.stats())
+
+@rota('/jobs/<job_id>')
+@login_required
+def job_estado(job_id):
+    job = jobs.estado(job_id)
+    if job is None: abort(404)
+    return jsonify(job)
+
+@rota('/logout')
 def logout():
     logout_user()
     return redirect(url_for('login'))
 
-@app.route('/dashboard')
+def _dados_dashboard(engine):
+    """KPIs do mês, evolução e top 5 vendedores (também usado pelo aquecimento)."""
+    kpis = {'faturamento_mes': 0, 'crescimento_vs_anterior': 0, 'ticket_medio': 0, 'pedidos_totais': 0, 'clientes_ativos': 0}
+    top_v, graficos, atualizado_em = [], {}, None
+    if engine is None: return kpis, top_v, graficos, atualizado_em
+    hoje = datetime.now()
+    inicio_mes = hoje.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    # mês anterior + mês corrente nos rollups (dia aberto incluído): nenhuma consulta no ERP além da leitura de hoje
+    usa_rollups = _usa_rollups((inicio_mes - timedelta(days=1)).replace(day=1), hoje)
+    sql_faturamento = text("""
+        SELECT 
+            SUM(CASE WHEN Dat_Emissao >= DATEADD(month, DATEDIFF(month, 0, GETDATE()), 0) THEN Vlr_TotalNota ELSE 0 END) as atual,
+            SUM(CASE WHEN Dat_Emissao >= DATEADD(month, DATEDIFF(month, 0, GETDATE()) - 1, 0) 
+                     AND Dat_Emissao < DATEADD(month, DATEDIFF(month, 0, GETDATE()), 0) THEN Vlr_TotalNota ELSE 0 END) as anterior,
+            COUNT(CASE WHEN Dat_Emissao >= DATEADD(month, DATEDIFF(month, 0, GETDATE()), 0) THEN Num_Nota END) as qtd_pedidos,
+            COUNT(DISTINCT CASE WHEN Dat_Emissao >= DATEADD(month, DATEDIFF(month, 0, GETDATE()), 0) THEN Cod_Cliente END) as clientes_ativos
+        FROM NFSCB WHERE Status = 'F' AND Cod_Estabe = 0
+    """)
+    if usa_rollups: df_fat, atualizado_em = rollups.kpis_mes(hoje), _dia_aberto()
+    else:
+        df_fat = query_cache.read_sql(sql_faturamento, engine, classe='kpi')
+        atualizado_em = df_fat.attrs.get('as_of')
+    res = df_fat.fillna(0).iloc[0] if not df_fat.empty else None
+    if res is not None:
+        kpis.update({'faturamento_mes': res.atual or 0, 'pedidos_totais': res.qtd_pedidos or 0, 'clientes_ativos': res.clientes_ativos or 0})
+        kpis['ticket_medio'] = kpis['faturamento_mes'] / kpis['pedidos_totais'] if kpis['pedidos_totais'] > 0 else 0
+        if res.anterior and res.anterior > 0:
+            kpis['crescimento_vs_anterior'] = ((res.atual - res.anterior) / res.anterior) * 100
+
+    sql_evolucao = text("SELECT TOP 12 CAST(YEAR(Dat_Emissao) AS VARCHAR) + '/' + RIGHT('0' + CAST(MONTH(Dat_Emissao) AS VARCHAR), 2) as Periodo, SUM(Vlr_TotalNota) as Total FROM NFSCB WHERE Status = 'F' AND Cod_Estabe = 0 GROUP BY YEAR(Dat_Emissao), MONTH(Dat_Emissao) ORDER BY 1 DESC")
+    if _usa_rollups((hoje.replace(day=1) - pd.DateOffset(months=11)).to_pydatetime(), hoje): df_ev = rollups.evolucao_faturamento(12)
+    else: df_ev = query_cache.read_sql(sql_evolucao, engine, classe='evolucao').sort_values('Periodo')
+    graficos['evolucao_vendas'] = grafico.linha(df_ev, 'Periodo', 'Total', 'Evolução de Faturamento')
+
+    sql_top = text("SELECT TOP 5 ve.Nome_Guerra, SUM(cb.Vlr_TotalNota) as Total FROM NFSCB cb INNER JOIN VENDE ve ON cb.Cod_Vendedor = ve.Codigo WHERE cb.Status = 'F' AND cb.Dat_Emissao >= DATEADD(month, DATEDIFF(month, 0, GETDATE()), 0) GROUP BY ve.Nome_Guerra ORDER BY Total DESC")
+    df_top = rollups.top_vendedores(inicio_mes) if usa_rollups else query_cache.read_sql(sql_top, engine, classe='kpi')
+    top_v = df_top.to_dict('records')
+    graficos['market_share'] = grafico.pizza(df_top, 'Total', 'Nome_Guerra', 'Distribuição de Vendas (Top 5)', buraco=0.4)
+    return kpis, top_v, graficos, atualizado_em
+
+@rota('/dashboard')
 @login_required
 def dashboard():
-    engine = get_sql_engine()
-    kpis = {'faturamento_mes': 0, 'crescimento_vs_anterior': 0, 'ticket_medio': 0, 'pedidos_totais': 0, 'clientes_ativos': 0}
-    top_v, graficos = [], {}
-    if engine:
-        with engine.connect() as conn:
-            sql_faturamento = text("""
-                SELECT 
-                    SUM(CASE WHEN Dat_Emissao >= DATEADD(month, DATEDIFF(month, 0, GETDATE()), 0) THEN Vlr_TotalNota ELSE 0 END) as atual,
-                    SUM(CASE WHEN Dat_Emissao >= DATEADD(month, DATEDIFF(month, 0, GETDATE()) - 1, 0) 
-                             AND Dat_Emissao < DATEADD(month, DATEDIFF(month, 0, GETDATE()), 0) THEN Vlr_TotalNota ELSE 0 END) as anterior,
-                    COUNT(CASE WHEN Dat_Emissao >= DATEADD(month, DATEDIFF(month, 0, GETDATE()), 0) THEN Num_Nota END) as qtd_pedidos,
-                    COUNT(DISTINCT CASE WHEN Dat_Emissao >= DATEADD(month, DATEDIFF(month, 0, GETDATE()), 0) THEN Cod_Cliente END) as clientes_ativos
-                FROM NFSCB WHERE Status = 'F' AND Cod_Estabe = 0
-            """)
-            res = conn.execute(sql_faturamento).fetchone()
-            if res:
-                kpis.update({'faturamento_mes': res.atual or 0, 'pedidos_totais': res.qtd_pedidos or 0, 'clientes_ativos': res.clientes_ativos or 0})
-                kpis['ticket_medio'] = kpis['faturamento_mes'] / kpis['pedidos_totais'] if kpis['pedidos_totais'] > 0 else 0
-                if res.anterior and res.anterior > 0:
-                    kpis['crescimento_vs_anterior'] = ((res.atual - res.anterior) / res.anterior) * 100
-
-            sql_evolucao = text("SELECT TOP 12 CAST(YEAR(Dat_Emissao) AS VARCHAR) + '/' + RIGHT('0' + CAST(MONTH(Dat_Emissao) AS VARCHAR), 2) as Periodo, SUM(Vlr_TotalNota) as Total FROM NFSCB WHERE Status = 'F' AND Cod_Estabe = 0 GROUP BY YEAR(Dat_Emissao), MONTH(Dat_Emissao) ORDER BY 1 DESC")
-            df_ev = pd.read_sql(sql_evolucao, conn).sort_values('Periodo')
-            graficos['evolucao_vendas'] = json.dumps(px.line(df_ev, x='Periodo', y='Total', title='Evolução de Faturamento', markers=True, template='plotly_white'), cls=plotly.utils.PlotlyJSONEncoder)
-
-            sql_top = text("SELECT TOP 5 ve.Nome_Guerra, SUM(cb.Vlr_TotalNota) as Total FROM NFSCB cb INNER JOIN VENDE ve ON cb.Cod_Vendedor = ve.Codigo WHERE cb.Status = 'F' AND cb.Dat_Emissao >= DATEADD(month, DATEDIFF(month, 0, GETDATE()), 0) GROUP BY ve.Nome_Guerra ORDER BY Total DESC")
-            df_top = pd.read_sql(sql_top, conn)
-            top_v = df_top.to_dict('records')
-            graficos['market_share'] = json.dumps(px.pie(df_top, values='Total', names='Nome_Guerra', title='Distribuição de Vendas (Top 5)', hole=0.4), cls=plotly.utils.PlotlyJSONEncoder)
-    return render_template('dashboard.html', kpis=kpis, top_vendedores=top_v, graficos_data=graficos)
-
-@app.route('/analise_cliente')
+    kpis, top_v, graficos, atualizado_em = _dados_dashboard(get_sql_engine())
+    return render_template('dashboard.html', kpis=kpis, top_vendedores=top_v, graficos_data=graficos, atualizado_em=atualizado_em)
+
+def _sql_busca_clientes(cliente_busca, v_id, dt_ini, dt_fim, top=50):
+    p = {"ini": dt_ini, "fim": dt_fim}
+    where_clauses = ["1=1"]
+    if v_id and _is_int_string(v_id): where_clauses.append("ve.Codigo = :vid"); p["vid"] = int(v_id)
+    if cliente_busca: where_clauses.append("(cl.Codigo LIKE :b OR cl.Razao_Social LIKE :b)"); p["b"] = f"%{cliente_busca}%"
+    sql = f"SELECT {f'TOP {int(top)} ' if top else ''}cl.Codigo, cl.Razao_Social AS [Razao Social], ve.Nome_guerra AS [Vendedor], SUM(ISNULL(cb.Vlr_TotalNota,0)) as [Valor_Total_NF_R$] FROM clien cl LEFT JOIN enxes en ON cl.Cgc_Cpf = en.Num_CgcCpf LEFT JOIN vende ve ON en.Cod_Vendedor = ve.codigo LEFT JOIN NFSCB cb ON cb.Cod_Cliente = cl.Codigo AND cb.Status = 'F' AND cb.Dat_Emissao BETWEEN :ini AND :fim WHERE {' AND '.join(where_clauses)} GROUP BY cl.Codigo, cl.Razao_Social, ve.Nome_guerra ORDER BY 4 DESC"
+    return sql, p
+
+def _indice_clientes_pronto():
+    """Agenda a sincronização do índice quando vencido; False enquanto ele não existe (a busca cai no ERP)."""
+    idade, idade_completa = indice_clientes.idade(), indice_clientes.idade('completo_em')
+    if idade is None or idade > current_app.config['BUSCA_CLIENTES_TTL']:
+        completo = idade_completa is None or idade_completa > current_app.config['BUSCA_CLIENTES_COMPLETA']
+        try: jobs.submeter('indice_clientes', {'completo': completo})
+        except Exception as e: current_app.logger.warning(f'Falha ao enfileirar índice de clientes: {e}')
+    return idade is not None
+
+def _recebiveis_pronto():
+    """Agenda o recálculo da carteira quando ela não é de hoje; False enquanto não existe (o cartão consulta o ERP)."""
+    if recebiveis.vencida():
+        try: jobs.submeter('recebiveis', {'referencia': datetime.now().strftime('%Y-%m-%d')})
+        except Exception as e: current_app.logger.warning(f'Falha ao enfileirar carteira a receber: {e}')
+    return recebiveis.pronto()
+
+def _buscar_clientes(conn, cliente_busca, v_id, dt_ini, dt_fim, top=50):
+    """Busca pelo índice local e soma o faturamento só dos clientes encontrados; None sem índice."""
+    if not _indice_clientes_pronto(): return None
+    # todos os achados entram na soma: o corte em `top` só vem depois da ordenação por faturamento
+    hits = indice_clientes.buscar(cliente_busca, int(v_id) if v_id and _is_int_string(v_id) else None, limite=-1)
+    codigos = hits['codigo'].unique().tolist()
+    if _usa_rollups(dt_ini, dt_fim): totais = rollups.total_clientes(codigos, dt_ini, dt_fim)
+    else:
+        sql = text("SELECT Cod_Cliente AS codigo, SUM(ISNULL(Vlr_TotalNota,0)) AS total FROM NFSCB WHERE Status = 'F' AND Dat_Emissao BETWEEN :ini AND :fim AND Cod_Cliente IN :cods GROUP BY Cod_Cliente")
+        sql = sql.bindparams(bindparam('cods', expanding=True))
+        # SQL Server aceita ~2100 parâmetros por comando
+        partes = [pd.read_sql(sql, conn, params={"ini": dt_ini, "fim": dt_fim, "cods": codigos[i:i + 1000]}) for i in range(0, len(codigos), 1000)]
+        totais = pd.concat(partes, ignore_index=True) if partes else pd.DataFrame(columns=['codigo', 'total'])
+    df = hits.merge(totais, on='codigo', how='left').fillna({'total': 0}).sort_values('total', ascending=False, kind='stable')
+    if top: df = df.head(top)
+    return df.rename(columns={'codigo': 'Codigo', 'razao_social': 'Razao Social', 'vendedor': 'Vendedor', 'total': 'Valor_Total_NF_R$'})[['Codigo', 'Razao Social', 'Vendedor', 'Valor_Total_NF_R$']]
+
+@rota('/analise_cliente')
 @login_required
 def analise_cliente():
     engine = get_sql_engine()
     vendedores, ranking_mais, ranking_menos, dados_busca = [], [], [], []
     cliente_detalhe, stats_detalhe, graficos, faturas_3m = None, {}, {}, []
+    segmentos, ciclo_cliente, ciclo_ate = [], None, None
+    carteira, ranking_inadimplentes = {}, []
     recomendacoes = {'comprados': [], 'sugeridos': [], 'total_notas': 0, 'valor_total': 0, 'dias_inatividade': 0}
     fin_status = {'status': 'Sem Pendências', 'total_aberto': 0, 'total_vencido': 0, 'saldo_disponivel': 0}
     visao_geral = {'total_clientes_ativos': 0, 'novos_clientes': 0, 'clientes_inativos': 0, 'ticket_medio_geral': 0, 'inadimplencia': 0}
@@ -139,97 +342,158 @@ def analise_cliente():
     cliente_id = request.args.get('cliente_id', '').strip()
     cliente_busca = request.args.get('cliente_busca', '').strip()
     hoje = datetime.now()
+    ontem = hoje - timedelta(days=1)
     data_ini_str = request.args.get('data_inicio', hoje.replace(day=1).strftime('%Y-%m-%d'))
     data_fim_str = request.args.get('data_fim', hoje.strftime('%Y-%m-%d'))
 
     if engine:
         with engine.connect() as conn:
-            vendedores = pd.read_sql(text("SELECT Codigo, Nome_Guerra FROM VENDE WHERE bloqueado = 0 ORDER BY Nome_Guerra"), conn).to_dict('records')
+            vendedores = query_cache.read_sql(SQL_VENDEDORES, conn, classe='vendedores').to_dict('records')
             dt_ini, dt_fim = datetime.strptime(data_ini_str, '%Y-%m-%d'), datetime.strptime(data_fim_str, '%Y-%m-%d').replace(hour=23, minute=59)
 
             if not cliente_id and not cliente_busca and not v_id:
-                df_ativos = pd.read_sql(text("SELECT COUNT(DISTINCT Cod_Cliente) as total FROM NFSCB WHERE Status='F' AND Cod_Estabe=0 AND Dat_Emissao BETWEEN :i AND :f"), conn, params={"i":dt_ini, "f":dt_fim})
+                p = {"i": dt_ini, "f": dt_fim}
+                ini_ev = (dt_ini - pd.DateOffset(months=12)).to_pydatetime()
+                if _usa_rollups(ini_ev, dt_fim): consulta_ev = lambda: rollups.evolucao_clientes(ini_ev, dt_fim)
+                else: consulta_ev = (text("SELECT CAST(YEAR(Dat_Emissao) AS VARCHAR) + '/' + RIGHT('0' + CAST(MONTH(Dat_Emissao) AS VARCHAR), 2) as Periodo, COUNT(DISTINCT Cod_Cliente) as Total_Clientes FROM NFSCB WHERE Status = 'F' AND Dat_Emissao BETWEEN DATEADD(MONTH, -12, :ini) AND :fim GROUP BY YEAR(Dat_Emissao), MONTH(Dat_Emissao) ORDER BY 1"), {"ini": dt_ini, "fim": dt_fim})
+                consultas = {
+                    'ativos': (text("SELECT COUNT(DISTINCT Cod_Cliente) as total FROM NFSCB WHERE Status='F' AND Cod_Estabe=0 AND Dat_Emissao BETWEEN :i AND :f"), p),
+                    'novos': (text("SELECT COUNT(*) as novos FROM (SELECT Cod_Cliente, MIN(Dat_Emissao) as p FROM NFSCB WHERE Status='F' AND Cod_Estabe=0 GROUP BY Cod_Cliente HAVING MIN(Dat_Emissao) BETWEEN :i AND :f) as N"), p),
+                    'inativos': text("SELECT COUNT(*) as inat FROM (SELECT Cod_Cliente, MAX(Dat_Emissao) as u FROM NFSCB WHERE Status='F' AND Cod_Estabe=0 GROUP BY Cod_Cliente HAVING DATEDIFF(DAY, MAX(Dat_Emissao), GETDATE()) > 90) as I"),
+                    'ticket': (text("SELECT AVG(Vlr_TotalNota) as t FROM NFSCB WHERE Status='F' AND Cod_Estabe=0 AND Dat_Emissao BETWEEN :i AND :f"), p),
+                    'evolucao': consulta_ev,
+                    'ranking': (text("SELECT cl.Codigo, cl.Razao_Social as [Razao Social], SUM(cb.Vlr_TotalNota) as Total FROM clien cl INNER JOIN NFSCB cb ON cb.Cod_Cliente = cl.Codigo WHERE cb.Status = 'F' AND cb.Dat_Emissao BETWEEN :ini AND :fim GROUP BY cl.Codigo, cl.Razao_Social HAVING SUM(cb.Vlr_TotalNota) > 0"), {"ini": dt_ini, "fim": dt_fim}),
+                }
+                # com os rollups em dia os indicadores saem do SQLite local; novos/inativos deixam de varrer o histórico do ERP
+                if _usa_rollups(dt_ini, dt_fim):
+                    consultas['ativos'] = lambda: rollups.clientes_ativos(dt_ini, dt_fim)
+                    consultas['ticket'] = lambda: rollups.ticket_medio(dt_ini, dt_fim)
+                # novos: ciclo de vida até ontem + primeiras compras de hoje no dia aberto
+                if _usa_ciclo(min(dt_fim, ontem)) and (dt_fim.date() < hoje.date() or _dia_aberto() is not None):
+                    consultas['novos'] = lambda: rollups.novos_clientes(dt_ini, dt_fim)
+                # inativos, segmentos e coortes: ciclo de vida na posição do último dia fechado (data mostrada na página)
+                if _usa_ciclo(ontem):
+                    ciclo_ate = ontem
+                    consultas['inativos'] = lambda: rollups.clientes_inativos(ontem)
+                    consultas['segmentos'] = rollups.segmentos
+                    consultas['coortes'] = lambda: rollups.coortes((hoje.replace(day=1) - pd.DateOffset(months=11)).to_pydatetime())
+                res, faltando = query_executor.run(engine, consultas)
+                if faltando: flash('Parte dos indicadores não carregou a tempo; atualize a página para tentar novamente.', 'warning')
+
+                df_ativos = res.get('ativos', pd.DataFrame())
                 if not df_ativos.empty: visao_geral['total_clientes_ativos'] = df_ativos.iloc[0]['total']
                 
-                df_novos = pd.read_sql(text("SELECT COUNT(*) as novos FROM (SELECT Cod_Cliente, MIN(Dat_Emissao) as p FROM NFSCB WHERE Status='F' AND Cod_Estabe=0 GROUP BY Cod_Cliente HAVING MIN(Dat_Emissao) BETWEEN :i AND :f) as N"), conn, params={"i":dt_ini, "f":dt_fim})
+                df_novos = res.get('novos', pd.DataFrame())
                 if not df_novos.empty: visao_geral['novos_clientes'] = df_novos.iloc[0]['novos']
                 
-                df_inativos = pd.read_sql(text("SELECT COUNT(*) as inat FROM (SELECT Cod_Cliente, MAX(Dat_Emissao) as u FROM NFSCB WHERE Status='F' AND Cod_Estabe=0 GROUP BY Cod_Cliente HAVING DATEDIFF(DAY, MAX(Dat_Emissao), GETDATE()) > 90) as I"), conn)
+                df_inativos = res.get('inativos', pd.DataFrame())
                 if not df_inativos.empty: visao_geral['clientes_inativos'] = df_inativos.iloc[0]['inat']
                 
-                df_ticket = pd.read_sql(text("SELECT AVG(Vlr_TotalNota) as t FROM NFSCB WHERE Status='F' AND Cod_Estabe=0 AND Dat_Emissao BETWEEN :i AND :f"), conn, params={"i":dt_ini, "f":dt_fim})
+                df_ticket = res.get('ticket', pd.DataFrame())
                 if not df_ticket.empty: visao_geral['ticket_medio_geral'] = df_ticket.iloc[0]['t'] or 0
 
-                df_ev_cli = pd.read_sql(text("SELECT CAST(YEAR(Dat_Emissao) AS VARCHAR) + '/' + RIGHT('0' + CAST(MONTH(Dat_Emissao) AS VARCHAR), 2) as Periodo, COUNT(DISTINCT Cod_Cliente) as Total_Clientes FROM NFSCB WHERE Status = 'F' AND Dat_Emissao BETWEEN DATEADD(MONTH, -12, :ini) AND :fim GROUP BY YEAR(Dat_Emissao), MONTH(Dat_Emissao) ORDER BY 1"), conn, params={"ini": dt_ini, "fim": dt_fim})
+                df_ev_cli = res.get('evolucao', pd.DataFrame())
                 if not df_ev_cli.empty:
-                    graficos['evolucao_clientes'] = json.dumps(px.line(df_ev_cli, x='Periodo', y='Total_Clientes', title='Evolução de Clientes Ativos', markers=True), cls=plotly.utils.PlotlyJSONEncoder)
+                    graficos['evolucao_clientes'] = grafico.linha(df_ev_cli, 'Periodo', 'Total_Clientes', 'Evolução de Clientes Ativos')
 
-                sql_ranking = text("SELECT cl.Codigo, cl.Razao_Social as [Razao Social], SUM(cb.Vlr_TotalNota) as Total FROM clien cl INNER JOIN NFSCB cb ON cb.Cod_Cliente = cl.Codigo WHERE cb.Status = 'F' AND cb.Dat_Emissao BETWEEN :ini AND :fim GROUP BY cl.Codigo, cl.Razao_Social HAVING SUM(cb.Vlr_TotalNota) > 0")
-                df_all = pd.read_sql(sql_ranking, conn, params={"ini": dt_ini, "fim": dt_fim})
+                segmentos = res.get('segmentos', pd.DataFrame()).to_dict('records')
+                df_coortes = res.get('coortes', pd.DataFrame())
+                if not df_coortes.empty:
+                    graficos['coortes'] = grafico.mapa_calor(df_coortes, 'Mes', 'Coorte', 'Retencao', 'Retenção por Coorte de Primeira Compra (%)', texto='%{z:.0f}')
+
+                if _recebiveis_pronto():
+                    carteira = recebiveis.resumo()
+                    visao_geral['inadimplencia'] = carteira['inadimplencia']
+                    ranking_inadimplentes = recebiveis.ranking('total_vencido', 10)
+                    graficos['aging'] = grafico.barras(recebiveis.faixas(), 'Faixa', 'Valor', 'Carteira a Receber por Atraso (R$)', cor='#dc3545', texto='R$ %{y:,.2f}')
+
+                df_all = res.get('ranking', pd.DataFrame())
                 if not df_all.empty:
                     ranking_mais = df_all.sort_values(by='Total', ascending=False).head(10).to_dict('records')
                     ranking_menos = df_all.sort_values(by='Total', ascending=True).head(10).to_dict('records')
 
             if cliente_id:
-                df_cli = pd.read_sql(text("SELECT Codigo, Razao_Social, Limite_Credito FROM clien WHERE Codigo = :cid"), conn, params={"cid": cliente_id})
+                # sugestões só do índice (o último salvo); sem nenhum, a página diz que está em preparo e o build
+                # fica em andamento (um só para todos) em vez de rodar o self-join de co-compra no ERP
+                usa_indice = recommender.pronto()
+                if not usa_indice:
+                    recomendacoes['preparando'] = True
+                    try: jobs.submeter('recomendacao', {'meses': current_app.config['RECOMENDACAO_MESES'], 'ate': datetime.now().strftime('%Y-%m-%d')})
+                    except Exception as e: current_app.logger.warning(f'Falha ao enfileirar índice de recomendação: {e}')
+                sql_rec = text("""
+                    WITH ClienteProdutos AS (
+                        SELECT cb.Cod_Cliente, it.Cod_Produto, p.Descricao as Produto, p.Cod_Fabricante,
+                               SUM(it.Qtd_Produto) AS QtdTotal, COUNT(DISTINCT cb.Num_Nota) AS QtdCompras
+                        FROM NFSIT it INNER JOIN NFSCB cb ON it.Num_Nota = cb.Num_Nota INNER JOIN PRODU p ON it.Cod_Produto = p.Codigo
+                        WHERE cb.Cod_Cliente = :cid AND cb.Dat_Emissao BETWEEN :ini AND :fim AND cb.Status = 'F' GROUP BY cb.Cod_Cliente, it.Cod_Produto, p.Descricao, p.Cod_Fabricante
+                    )
+                    SELECT (SELECT TOP 5 cp.Produto + ' (' + CAST(CAST(cp.QtdTotal AS INT) AS VARCHAR) + ' un);' FROM ClienteProdutos cp WHERE cp.Cod_Cliente = :cid ORDER BY cp.QtdTotal DESC FOR XML PATH('')) as TopComprados,
+                           COUNT(DISTINCT Num_Nota) as Notas, SUM(Vlr_TotalNota) as Total, DATEDIFF(DAY, MAX(Dat_Emissao), GETDATE()) as Dias
+                    FROM NFSCB WHERE Cod_Cliente = :cid AND Status = 'F' AND Dat_Emissao BETWEEN :ini AND :fim
+                """)
+                pc, pp = {"cid": cliente_id}, {"cid": cliente_id, "ini": dt_ini, "fim": dt_fim}
+                consultas = {
+                    'cliente': (text("SELECT Codigo, Razao_Social, Limite_Credito FROM clien WHERE Codigo = :cid"), pc),
+                    'faturas': (text("SELECT TOP 3 MONTH(Dat_Emissao) as Mes, YEAR(Dat_Emissao) as Ano, SUM(Vlr_TotalNota) as Total FROM NFSCB WHERE Cod_Cliente = :cid AND Status = 'F' AND Dat_Emissao >= DATEADD(MONTH, -3, GETDATE()) GROUP BY YEAR(Dat_Emissao), MONTH(Dat_Emissao) ORDER BY Ano DESC, Mes DESC"), pc),
+                    'recomendacao': (sql_rec, pp),
+                    'evolucao': (text("SELECT CAST(YEAR(Dat_Emissao) AS VARCHAR) + '/' + RIGHT('0' + CAST(MONTH(Dat_Emissao) AS VARCHAR), 2) as Periodo, SUM(Vlr_TotalNota) as Total FROM NFSCB WHERE Cod_Cliente = :cid AND Status = 'F' AND Dat_Emissao BETWEEN :ini AND :fim GROUP BY YEAR(Dat_Emissao), MONTH(Dat_Emissao) ORDER BY 1"), pp),
+                    'itens': (text("SELECT pr.Descricao AS Produto, SUM(it.Qtd_Produto) AS Qtd FROM NFSCB cb INNER JOIN NFSIT it ON cb.Num_Nota = it.Num_Nota INNER JOIN PRODU pr ON it.Cod_Produto = pr.Codigo WHERE cb.Cod_Cliente = :cid AND cb.Status = 'F' AND cb.Dat_Emissao BETWEEN :ini AND :fim GROUP BY pr.Descricao"), pp),
+                }
+                # com a carteira do dia o financeiro sai dela; sem ela, os títulos do cliente vêm do ERP
+                usa_carteira = _recebiveis_pronto()
+                if not usa_carteira: consultas['financeiro'] = (text("SELECT Vlr_Saldo, DATEDIFF(Day, GETDATE(), Dat_Vencimento) as Dias FROM CTREC WHERE Cod_Cliente = :cid AND Status IN ('A','P') AND Vlr_Saldo > 0"), pc)
+                res, faltando = query_executor.run(engine, consultas)
+                if faltando and 'cliente' not in faltando: flash('Parte da análise do cliente não carregou a tempo; atualize a página para tentar novamente.', 'warning')
+
+                df_cli = res.get('cliente', pd.DataFrame())
                 if not df_cli.empty:
                     c = df_cli.iloc[0]
                     cliente_detalhe = {'codigo': c['Codigo'], 'nome': c['Razao_Social'], 'limite': c['Limite_Credito']}
-                    faturas_3m = pd.read_sql(text("SELECT TOP 3 MONTH(Dat_Emissao) as Mes, YEAR(Dat_Emissao) as Ano, SUM(Vlr_TotalNota) as Total FROM NFSCB WHERE Cod_Cliente = :cid AND Status = 'F' AND Dat_Emissao >= DATEADD(MONTH, -3, GETDATE()) GROUP BY YEAR(Dat_Emissao), MONTH(Dat_Emissao) ORDER BY Ano DESC, Mes DESC"), conn, params={"cid": cliente_id}).to_dict('records')
+                    if _usa_ciclo(ontem): ciclo_cliente = rollups.ciclo_cliente(int(c['Codigo']))
+                    faturas_3m = res.get('faturas', pd.DataFrame()).to_dict('records')
                     
-                    df_fin = pd.read_sql(text("SELECT Vlr_Saldo, DATEDIFF(Day, GETDATE(), Dat_Vencimento) as Dias FROM CTREC WHERE Cod_Cliente = :cid AND Status IN ('A','P') AND Vlr_Saldo > 0"), conn, params={"cid": cliente_id})
-                    fin_status['total_aberto'] = df_fin['Vlr_Saldo'].sum() if not df_fin.empty else 0
+                    if usa_carteira:
+                        rec = recebiveis.cliente(c['Codigo'])
+                        if rec:
+                            fin_status.update({'status': 'Inadimplente' if rec['total_vencido'] > 0 else 'Em dia', 'total_aberto': rec['total_aberto'],
+                                               'total_vencido': rec['total_vencido'], 'maior_atraso': rec['maior_atraso'],
+                                               'faixas': {NOMES_FAIXAS[f]: rec[f] for f in FAIXAS}})
+                    else:
+                        df_fin = res.get('financeiro', pd.DataFrame(columns=['Vlr_Saldo', 'Dias']))
+                        fin_status['total_aberto'] = df_fin['Vlr_Saldo'].sum() if not df_fin.empty else 0
+                        if not df_fin.empty:
+                            venc = df_fin[df_fin['Dias'] < 0]
+                            if not venc.empty: fin_status['status'], fin_status['total_vencido'] = 'Inadimplente', venc['Vlr_Saldo'].sum()
+                            else: fin_status['status'] = 'Em dia'
                     fin_status['saldo_disponivel'] = (cliente_detalhe['limite'] or 0) - fin_status['total_aberto']
-                    if not df_fin.empty:
-                        venc = df_fin[df_fin['Dias'] < 0]
-                        if not venc.empty: fin_status['status'], fin_status['total_vencido'] = 'Inadimplente', venc['Vlr_Saldo'].sum()
-                        else: fin_status['status'] = 'Em dia'
-
-                    sql_rec = text("""
-                        WITH ClienteProdutos AS (
-                            SELECT cb.Cod_Cliente, it.Cod_Produto, p.Descricao as Produto, p.Cod_Fabricante,
-                                   SUM(it.Qtd_Produto) AS QtdTotal, COUNT(DISTINCT cb.Num_Nota) AS QtdCompras
-                            FROM NFSIT it INNER JOIN NFSCB cb ON it.Num_Nota = cb.Num_Nota INNER JOIN PRODU p ON it.Cod_Produto = p.Codigo
-                            WHERE cb.Dat_Emissao BETWEEN :ini AND :fim AND cb.Status = 'F' GROUP BY cb.Cod_Cliente, it.Cod_Produto, p.Descricao, p.Cod_Fabricante
-                        ),
-                        ProdutosRelacionados AS (
-                            SELECT cp1.Cod_Cliente, cp2.Produto as Relacionado, cp1.Produto as Base, COUNT(DISTINCT cp2.Cod_Cliente) as Popularidade
-                            FROM ClienteProdutos cp1 JOIN ClienteProdutos cp2 ON cp2.Cod_Cliente <> cp1.Cod_Cliente AND cp2.Cod_Fabricante = cp1.Cod_Fabricante
-                            WHERE cp1.Cod_Cliente = :cid GROUP BY cp1.Cod_Cliente, cp2.Produto, cp1.Produto
-                        )
-                        SELECT (SELECT TOP 5 cp.Produto + ' (' + CAST(CAST(cp.QtdTotal AS INT) AS VARCHAR) + ' un);' FROM ClienteProdutos cp WHERE cp.Cod_Cliente = :cid ORDER BY cp.QtdTotal DESC FOR XML PATH('')) as TopComprados,
-                               (SELECT TOP 5 pr.Relacionado + ' (Base: ' + pr.Base + ');' FROM ProdutosRelacionados pr WHERE pr.Cod_Cliente = :cid ORDER BY pr.Popularidade DESC FOR XML PATH('')) as TopSugeridos,
-                               COUNT(DISTINCT Num_Nota) as Notas, SUM(Vlr_TotalNota) as Total, DATEDIFF(DAY, MAX(Dat_Emissao), GETDATE()) as Dias
-                        FROM NFSCB WHERE Cod_Cliente = :cid AND Status = 'F' AND Dat_Emissao BETWEEN :ini AND :fim
-                    """)
-                    res_rec = conn.execute(sql_rec, {"cid": cliente_id, "ini": dt_ini, "fim": dt_fim}).fetchone()
-                    if res_rec:
-                        recomendacoes = {
+                    if cliente_detalhe['limite']: fin_status['uso_limite'] = fin_status['total_aberto'] / cliente_detalhe['limite'] * 100
+
+                    df_rec = res.get('recomendacao', pd.DataFrame())
+                    if not df_rec.empty:
+                        res_rec = [None if pd.isna(v) else v for v in df_rec.iloc[0].tolist()]
+                        recomendacoes.update({
                             'comprados': [x.strip() for x in (res_rec[0].split(';') if res_rec[0] else []) if x.strip()],
-                            'sugeridos': [x.strip() for x in (res_rec[1].split(';') if res_rec[1] else []) if x.strip()],
-                            'total_notas': res_rec[2] or 0, 'valor_total': res_rec[3] or 0, 'dias_inatividade': res_rec[4] or 0
-                        }
+                            'total_notas': res_rec[1] or 0, 'valor_total': res_rec[2] or 0, 'dias_inatividade': res_rec[3] or 0
+                        })
+                    if usa_indice: recomendacoes['sugeridos'] = recommender.sugeridos(cliente_id)
 
-                    df_evolucao = pd.read_sql(text("SELECT CAST(YEAR(Dat_Emissao) AS VARCHAR) + '/' + RIGHT('0' + CAST(MONTH(Dat_Emissao) AS VARCHAR), 2) as Periodo, SUM(Vlr_TotalNota) as Total FROM NFSCB WHERE Cod_Cliente = :cid AND Status = 'F' AND Dat_Emissao BETWEEN :ini AND :fim GROUP BY YEAR(Dat_Emissao), MONTH(Dat_Emissao) ORDER BY 1"), conn, params={"cid": cliente_id, "ini": dt_ini, "fim": dt_fim})
+                    df_evolucao = res.get('evolucao', pd.DataFrame())
                     if not df_evolucao.empty:
-                        fig = px.bar(df_evolucao, x='Periodo', y='Total', text='Total', title='Faturamento Mensal (R$)', color_discrete_sequence=['#28a745'])
-                        fig.update_traces(texttemplate='R$ %{text:,.2f}', textposition='inside')
-                        graficos['evolucao_compras'] = json.dumps(fig, cls=plotly.utils.PlotlyJSONEncoder)
+                        graficos['evolucao_compras'] = grafico.barras(df_evolucao, 'Periodo', 'Total', 'Faturamento Mensal (R$)', cor='#28a745', texto='R$ %{y:,.2f}')
 
-                    df_res = pd.read_sql(text("SELECT pr.Descricao AS Produto, SUM(it.Qtd_Produto) AS Qtd FROM NFSCB cb INNER JOIN NFSIT it ON cb.Num_Nota = it.Num_Nota INNER JOIN PRODU pr ON it.Cod_Produto = pr.Codigo WHERE cb.Cod_Cliente = :cid AND cb.Status = 'F' AND cb.Dat_Emissao BETWEEN :ini AND :fim GROUP BY pr.Descricao"), conn, params={"cid": cliente_id, "ini": dt_ini, "fim": dt_fim})
+                    df_res = res.get('itens', pd.DataFrame())
                     if not df_res.empty: stats_detalhe['top_10_mais'] = df_res.sort_values(by='Qtd', ascending=False).head(10).to_dict('records')
 
             elif cliente_busca or v_id:
-                p = {"ini": dt_ini, "fim": dt_fim}
-                where_clauses = ["1=1"]
-                if v_id and _is_int_string(v_id): where_clauses.append("ve.Codigo = :vid"); p["vid"] = int(v_id)
-                if cliente_busca: where_clauses.append("(cl.Codigo LIKE :b OR cl.Razao_Social LIKE :b)"); p["b"] = f"%{cliente_busca}%"
-                sql_b = text(f"SELECT TOP 50 cl.Codigo, cl.Razao_Social AS [Razao Social], ve.Nome_guerra AS [Vendedor], SUM(ISNULL(cb.Vlr_TotalNota,0)) as [Valor_Total_NF_R$] FROM clien cl LEFT JOIN enxes en ON cl.Cgc_Cpf = en.Num_CgcCpf LEFT JOIN vende ve ON en.Cod_Vendedor = ve.codigo LEFT JOIN NFSCB cb ON cb.Cod_Cliente = cl.Codigo AND cb.Status = 'F' AND cb.Dat_Emissao BETWEEN :ini AND :fim WHERE {' AND '.join(where_clauses)} GROUP BY cl.Codigo, cl.Razao_Social, ve.Nome_guerra ORDER BY 4 DESC")
-                dados_busca = pd.read_sql(sql_b, conn, params=p).to_dict('records')
+                df_busca = _buscar_clientes(conn, cliente_busca, v_id, dt_ini, dt_fim)
+                if df_busca is None:
+                    sql_b, p = _sql_busca_clientes(cliente_busca, v_id, dt_ini, dt_fim)
+                    df_busca = pd.read_sql(text(sql_b), conn, params=p)
+                dados_busca = df_busca.to_dict('records')
 
-    return render_template('analise_cliente.html', vendedores=vendedores, ranking_mais=ranking_mais, ranking_menos=ranking_menos, dados=dados_busca, cliente_detalhe=cliente_detalhe, stats_detalhe=stats_detalhe, graficos=graficos, data_inicio=data_ini_str, data_fim=data_fim_str, vendedor_sel=v_id, cliente_busca=cliente_busca, financeiro=fin_status, faturas_3m=faturas_3m, recomendacoes=recomendacoes, visao_geral=visao_geral)
+    return render_template('analise_cliente.html', vendedores=vendedores, ranking_mais=ranking_mais, ranking_menos=ranking_menos, dados=dados_busca, cliente_detalhe=cliente_detalhe, stats_detalhe=stats_detalhe, graficos=graficos, data_inicio=data_ini_str, data_fim=data_fim_str, vendedor_sel=v_id, cliente_busca=cliente_busca, financeiro=fin_status, faturas_3m=faturas_3m, recomendacoes=recomendacoes, visao_geral=visao_geral, segmentos=segmentos, ciclo_cliente=ciclo_cliente, ciclo_ate=ciclo_ate, carteira=carteira, ranking_inadimplentes=ranking_inadimplentes)
 
-@app.route('/pedidos_eletronicos')
+@rota('/pedidos_eletronicos')
 @login_required
 def pedidos_eletronicos():
     engine = get_sql_engine()
@@ -241,106 +505,431 @@ def pedidos_eletronicos():
                              'anterior': {'Total':{'valor':0,'qtd':0}, 'T':{'valor':0,'qtd':0}, 'M':{'valor':0,'qtd':0}}}
     if engine:
         with engine.connect() as conn:
-            vendedores = pd.read_sql(text("SELECT DISTINCT ve.Codigo, ve.Nome_Guerra FROM VENDE ve INNER JOIN PDVCB cb ON ve.Codigo = cb.Cod_Vendedor"), conn).values.tolist()
+            vendedores = query_cache.read_sql(text("SELECT DISTINCT ve.Codigo, ve.Nome_Guerra FROM VENDE ve INNER JOIN PDVCB cb ON ve.Codigo = cb.Cod_Vendedor"), conn, classe='vendedores').values.tolist()
             d_ini, d_fim = datetime.strptime(data_inicio, '%Y-%m-%d'), datetime.strptime(data_fim, '%Y-%m-%d')
             d_ini_prev, d_fim_prev = d_ini - pd.DateOffset(months=1), d_fim - pd.DateOffset(months=1)
-            def get_stats(start, end):
+            def sql_stats(start, end):
                 where = "cb.Cod_Estabe = 0 AND cb.Tip_Pedido <> 'C' AND cb.Status1 IN ('P','D') AND cb.Dat_Pedido BETWEEN :s AND :e"
                 p = {"s": start, "e": end}
                 if vendedor_id != 'todos': where += " AND cb.Cod_Vendedor = :vid"; p["vid"] = int(vendedor_id)
-                sql = f"SELECT SUBSTRING(ISNULL(Cod_OrigemPdv, ''), 1, 1) as Orig, SUM(C_VlrPedido) as Vlr, COUNT(*) as Qtd FROM PDVCB cb WHERE {where} GROUP BY SUBSTRING(ISNULL(Cod_OrigemPdv, ''), 1, 1)"
-                df = pd.read_sql(text(sql), conn, params=p)
+                return text(f"SELECT SUBSTRING(ISNULL(Cod_OrigemPdv, ''), 1, 1) as Orig, SUM(C_VlrPedido) as Vlr, COUNT(*) as Qtd FROM PDVCB cb WHERE {where} GROUP BY SUBSTRING(ISNULL(Cod_OrigemPdv, ''), 1, 1)"), p
+            def get_stats(df):
                 res = {'Total':{'valor':0,'qtd':0}, 'T':{'valor':0,'qtd':0}, 'M':{'valor':0,'qtd':0}}
                 for _, r in df.iterrows():
                     o = str(r['Orig']).upper()
                     if o in res: res[o] = {'valor': float(r['Vlr']), 'qtd': int(r['Qtd'])}
                     res['Total']['valor'] += float(r['Vlr']); res['Total']['qtd'] += int(r['Qtd'])
                 return res
-            stats['atual'], stats['anterior'] = get_stats(d_ini, d_fim), get_stats(d_ini_prev, d_fim_prev)
+            res, faltando = query_executor.run(engine, {'atual': sql_stats(d_ini, d_fim), 'anterior': sql_stats(d_ini_prev, d_fim_prev)})
+            if faltando: flash('Parte dos indicadores não carregou a tempo; atualize a página para tentar novamente.', 'warning')
+            stats['atual'], stats['anterior'] = get_stats(res.get('atual', pd.DataFrame())), get_stats(res.get('anterior', pd.DataFrame()))
     return render_template('pedidos_eletronicos.html', vendedores=vendedores, vendedor_id=vendedor_id, data_inicio=data_inicio, data_fim=data_fim, stats=stats)
 
-@app.route('/vendas_produto')
+def _vendas_produto_rollup(conn, d1, d2, cod_vendedor=None):
+    # Mesmo resultado da consulta de vendas_produto: vendas dos rollups, só as cotas (VECPR) vêm do ERP
+    sql = ("SELECT ve.Nome_Guerra, c.Cod_Vendedor, c.Cod_Produt as Cod_Produto, pr.Descricao as produto, c.Qtd_Cota as Qtd_Cota_Mensal "
+           "FROM VECPR c INNER JOIN VENDE ve ON c.Cod_Vendedor = ve.Codigo INNER JOIN PRODU pr ON c.Cod_Produt = pr.Codigo "
+           "WHERE c.Ano_Ref = :a AND c.Mes_Ref = :m AND c.Qtd_Cota > 0")
+    p = {"a": d1.year, "m": d1.month}
+    if cod_vendedor is not None: sql += " AND c.Cod_Vendedor = :cv"; p["cv"] = cod_vendedor
+    df = pd.read_sql(text(sql), conn, params=p).merge(rollups.vendas_vendedor_produto(d1, d2, cod_vendedor), on=['Cod_Vendedor', 'Cod_Produto'])
+    df['Faltam'] = (df['Qtd_Cota_Mensal'] - df['Unidades_Vendidas']).clip(lower=0)
+    df['Status'] = (df['Unidades_Vendidas'] >= df['Qtd_Cota_Mensal']).map({True: 'META BATIDA', False: 'PENDENTE'})
+    df = df[['Nome_Guerra', 'Cod_Vendedor', 'Cod_Produto', 'produto', 'Qtd_Cota_Mensal', 'Unidades_Vendidas', 'Faltam', 'Status', 'VlrLiq']]
+    return df.sort_values(['Nome_Guerra', 'VlrLiq'], ascending=[True, False]).reset_index(drop=True)
+
+def _vendas_fabricante_rollup(conn, d1, d2, cod_vendedor=None):
+    # Mesmo resultado da consulta de vendas_fabricante: vendas dos rollups, só as cotas (VECOT) vêm do ERP
+    sql = ("SELECT Cod_Vendedor AS CodVen, Cod_Fabricante, Ano_Ref AS Ano, Mes_Ref AS Mes, Qtd_Cota AS Qtd_Cota_Mensal FROM VECOT "
+           "WHERE Qtd_Cota > 0 AND Ano_Ref * 100 + Mes_Ref BETWEEN :p1 AND :p2")
+    p = {"p1": d1.year * 100 + d1.month, "p2": d2.year * 100 + d2.month}
+    if cod_vendedor is not None: sql += " AND Cod_Vendedor = :cv"; p["cv"] = cod_vendedor
+    df = rollups.vendas_vendedor_fabricante(d1, d2, cod_vendedor).merge(pd.read_sql(text(sql), conn, params=p), on=['CodVen', 'Cod_Fabricante', 'Ano', 'Mes'])
+    df['Faltam'] = (df['Qtd_Cota_Mensal'] - df['Unidades_Vendidas']).clip(lower=0)
+    df['Status'] = (df['Unidades_Vendidas'] >= df['Qtd_Cota_Mensal']).map({True: 'META BATIDA', False: 'PENDENTE'})
+    return df
+
+def _filtros_relatorio():
+    hoje = datetime.now()
+    data_inicio = request.args.get('data_inicio', hoje.replace(day=1).strftime('%Y-%m-%d'))
+    data_fim = request.args.get('data_fim', hoje.strftime('%Y-%m-%d'))
+    return data_inicio, data_fim, request.args.get('vendedor_id', '').strip()
+
+def _dia_seguinte(data):
+    """'YYYY-MM-DD' -> 'YYYYMMDD' do dia seguinte, limite exclusivo dos filtros por Dat_Emissao."""
+    return (datetime.strptime(data, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y%m%d')
+
+def _sql_vendas_produto(data_inicio, data_fim, vendedor_sel):
+    dt_ini_obj = datetime.strptime(data_inicio, '%Y-%m-%d')
+    # CONSULTA OTIMIZADA: Join direto com VECPR para filtrar as vendas na leitura inicial
+    sql = """
+        SELECT 
+            ve.Nome_Guerra, 
+            c.Cod_Vendedor, 
+            c.Cod_Produt as Cod_Produto, 
+            pr.Descricao as produto, 
+            c.Qtd_Cota as Qtd_Cota_Mensal, 
+            SUM(ISNULL(it.Qtd_Produto, 0) + ISNULL(it.Qtd_Bonificacao, 0)) as Unidades_Vendidas, 
+            Faltam = CASE WHEN c.Qtd_Cota > SUM(ISNULL(it.Qtd_Produto, 0) + ISNULL(it.Qtd_Bonificacao, 0)) THEN c.Qtd_Cota - SUM(ISNULL(it.Qtd_Produto, 0) + ISNULL(it.Qtd_Bonificacao, 0)) ELSE 0 END,
+            Status = CASE WHEN SUM(ISNULL(it.Qtd_Produto, 0) + ISNULL(it.Qtd_Bonificacao, 0)) >= c.Qtd_Cota THEN 'META BATIDA' ELSE 'PENDENTE' END,
+            SUM(ISNULL(it.Vlr_LiqItem, 0) - ISNULL(it.Vlr_SubsTrib, 0) - ISNULL(it.Vlr_SbtRes, 0)) as VlrLiq
+        FROM VECPR c
+        INNER JOIN VENDE ve ON c.Cod_Vendedor = ve.Codigo
+        INNER JOIN PRODU pr ON c.Cod_Produt = pr.Codigo
+        INNER JOIN NFSCB cb ON cb.Cod_Vendedor = c.Cod_Vendedor
+        INNER JOIN NFSIT it ON cb.Num_Nota = it.Num_Nota AND cb.Ser_Nota = it.Ser_Nota AND cb.Cod_Estabe = it.Cod_Estabe AND it.Cod_Produto = c.Cod_Produt
+        WHERE c.Ano_Ref = :a AND c.Mes_Ref = :m AND c.Qtd_Cota > 0
+          AND cb.Dat_Emissao >= :d1 AND cb.Dat_Emissao < :d2
+          AND cb.Status = 'F'
+    """
+    # intervalo semiaberto até o dia seguinte ao fim: notas com hora no último dia entram
+    p = {"d1": dt_ini_obj.strftime('%Y%m%d'), "d2": _dia_seguinte(data_fim), "a": dt_ini_obj.year, "m": dt_ini_obj.month}
+    if vendedor_sel and _is_int_string(vendedor_sel): p["cv"] = int(vendedor_sel); sql += " AND c.Cod_Vendedor = :cv"
+    return sql + " GROUP BY ve.Nome_Guerra, c.Cod_Vendedor, c.Cod_Produt, pr.Descricao, c.Qtd_Cota", p
+
+def _sql_vendas_fabricante(data_inicio, data_fim, vendedor_sel):
+    dt_ini_str, dt_fim_str = datetime.strptime(data_inicio, '%Y-%m-%d').strftime('%Y%m%d'), _dia_seguinte(data_fim)
+    # CORREÇÃO: Nomeação correta de Unidades para Unidades_Vendidas para evitar erro no Template
+    sql = """
+        SELECT x.*, ISNULL(v.Qtd_Cota, 0) AS Qtd_Cota_Mensal, Faltam = CASE WHEN ISNULL(v.Qtd_Cota, 0) - x.Unidades_Vendidas > 0 THEN ISNULL(v.Qtd_Cota, 0) - x.Unidades_Vendidas ELSE 0 END,
+               Status = CASE WHEN x.Unidades_Vendidas >= ISNULL(v.Qtd_Cota, 0) THEN 'META BATIDA' ELSE 'PENDENTE' END
+        FROM (
+            SELECT YEAR(cb.Dat_Emissao) AS Ano, MONTH(cb.Dat_Emissao) AS Mes, pr.Cod_Fabricante, fb.Fantasia, ve.Codigo AS CodVen, ve.Nome_Guerra, SUM(it.Qtd_Produto + it.Qtd_Bonificacao) as Unidades_Vendidas
+            FROM NFSCB cb INNER JOIN NFSIT it ON cb.Num_Nota = it.Num_Nota INNER JOIN PRODU pr ON it.Cod_Produto = pr.Codigo INNER JOIN FABRI fb ON pr.Cod_Fabricante = fb.Codigo INNER JOIN VENDE ve ON cb.Cod_Vendedor = ve.Codigo
+            WHERE cb.Dat_Emissao >= :dt_ini AND cb.Dat_Emissao < :dt_fim AND cb.Status = 'F' GROUP BY YEAR(cb.Dat_Emissao), MONTH(cb.Dat_Emissao), pr.Cod_Fabricante, fb.Fantasia, ve.Codigo, ve.Nome_Guerra
+        ) x LEFT JOIN VECOT v ON x.CodVen = v.Cod_Vendedor AND x.Cod_Fabricante = v.Cod_Fabricante AND x.Ano = v.Ano_Ref AND x.Mes = v.Mes_Ref WHERE ISNULL(v.Qtd_Cota, 0) > 0
+    """
+    params = {"dt_ini": dt_ini_str, "dt_fim": dt_fim_str}
+    if vendedor_sel and _is_int_string(vendedor_sel): params["codven"] = int(vendedor_sel); sql += " AND x.CodVen = :codven"
+    return sql, params
+
+# Relatórios tabulares paginados no servidor (/api/<relatorio>); 'totais' = {stat: (coluna somada, tipo)}
+RELATORIOS = {
+    'vendas_produto': {
+        'sql': _sql_vendas_produto, 'rollup': _vendas_produto_rollup,
+        'chave': ['Cod_Vendedor', 'Cod_Produto'], 'ordem_padrao': 'Nome_Guerra', 'filtro': ['Nome_Guerra', 'produto'],
+        'colunas': ['Nome_Guerra', 'produto', 'Qtd_Cota_Mensal', 'Unidades_Vendidas', 'Faltam', 'Status', 'VlrLiq'],
+        'totais': {'atual_total': ('VlrLiq', float), 'meta_total': ('Qtd_Cota_Mensal', int), 'qtd_atual': ('Unidades_Vendidas', int)},
+    },
+    'vendas_fabricante': {
+        'sql': _sql_vendas_fabricante, 'rollup': _vendas_fabricante_rollup,
+        'chave': ['Ano', 'Mes', 'Cod_Fabricante', 'CodVen'], 'ordem_padrao': 'Nome_Guerra', 'filtro': ['Nome_Guerra', 'Fantasia'],
+        'colunas': ['Nome_Guerra', 'Fantasia', 'Qtd_Cota_Mensal', 'Unidades_Vendidas', 'Faltam', 'Status'],
+        'totais': {'total_vendido': ('Unidades_Vendidas', int), 'total_meta': ('Qtd_Cota_Mensal', int)},
+    },
+}
+
+def _periodo_relatorio(data_inicio, data_fim, vendedor_sel):
+    d1, d2 = datetime.strptime(data_inicio, '%Y-%m-%d'), datetime.strptime(data_fim, '%Y-%m-%d')
+    return d1, d2, int(vendedor_sel) if vendedor_sel and _is_int_string(vendedor_sel) else None
+
+def _totais_df(rel, df):
+    return {k: tipo(df[col].sum()) for k, (col, tipo) in rel['totais'].items()}
+
+def _totais_relatorio(nome, conn, data_inicio, data_fim, vendedor_sel, job=None):
+    rel = RELATORIOS[nome]
+    if job is not None:
+        df = jobs.resultado(job['id']) if job['status'] == 'concluido' else None
+        return _totais_df(rel, df) if df is not None else {k: tipo(0) for k, (_, tipo) in rel['totais'].items()}
+    d1, d2, cv = _periodo_relatorio(data_inicio, data_fim, vendedor_sel)
+    if _usa_rollups(d1, d2): return _totais_df(rel, rel['rollup'](conn, d1, d2, cv))
+    sql, p = rel['sql'](data_inicio, data_fim, vendedor_sel)
+    df = query_cache.read_sql(text(sql_totais(sql, {k: f'ISNULL(SUM(r.[{col}]), 0)' for k, (col, _) in rel['totais'].items()})), conn, params=p, classe='relatorio')
+    return {k: tipo(df.iloc[0][k]) for k, (_, tipo) in rel['totais'].items()}
+
+def _periodo_longo(d1, d2):
+    """Período que roda como job: longo e fora dos rollups."""
+    return not _usa_rollups(d1, d2) and (d2 - d1).days > current_app.config['JOB_DIAS_SINCRONO']
+
+def _job_relatorio(nome, data_inicio, data_fim, vendedor_sel, enfileirar=True):
+    """Job do relatório quando o período é longo e não está nos rollups (None = roda na própria requisição).
+    Com enfileirar=False só devolve o job já existente, sem criar um."""
+    d1, d2, cv = _periodo_relatorio(data_inicio, data_fim, vendedor_sel)
+    if not _periodo_longo(d1, d2): return None
+    params = {'data_inicio': data_inicio, 'data_fim': data_fim, 'vendedor_id': '' if cv is None else str(cv)}
+    return jobs.submeter(nome, params) if enfileirar else jobs.procurar(nome, params)
+
+def _meses_periodo(data_inicio, data_fim):
+    d1, d2 = datetime.strptime(data_inicio, '%Y-%m-%d'), datetime.strptime(data_fim, '%Y-%m-%d')
+    fatias, ini = [], d1
+    while ini <= d2:
+        prox = (ini.replace(day=1) + timedelta(days=32)).replace(day=1)
+        fatias.append((ini.strftime('%Y-%m-%d'), min(prox - timedelta(days=1), d2).strftime('%Y-%m-%d')))
+        ini = prox
+    return fatias
+
+def _executar_relatorio(app, nome):
+    def executar(params, progresso):
+        with app.app_context(): engine = get_sql_engine()
+        if engine is None: raise RuntimeError('Banco do ERP não configurado.')
+        # vendas_fabricante já agrupa por mês: rodar mês a mês dá o mesmo resultado e um progresso real
+        fatias = _meses_periodo(params['data_inicio'], params['data_fim']) if nome == 'vendas_fabricante' else [(params['data_inicio'], params['data_fim'])]
+        partes = []
+        with engine.connect() as conn:
+            for i, (ini, fim) in enumerate(fatias):
+                progresso(i / len(fatias), f'Consultando {ini} a {fim}')
+                sql, p = RELATORIOS[nome]['sql'](ini, fim, params['vendedor_id'])
+                partes.append(pd.read_sql(text(sql), conn, params=p))
+        return pd.concat(partes, ignore_index=True)
+    return executar
+
+def _executar_indice_clientes(app, params, progresso):
+    with app.app_context(): erp = get_sql_engine()
+    if erp is None: raise RuntimeError('Banco do ERP não configurado.')
+    indice_clientes.atualizar(erp, completo=params.get('completo', False), log=app.logger.info)
+
+def _executar_recebiveis(app, params, progresso):
+    with app.app_context(): erp = get_sql_engine()
+    if erp is None: raise RuntimeError('Banco do ERP não configurado.')
+    # instância separada: as requisições seguem com a carteira anterior até a nova ser gravada
+    carteira = CarteiraRecebiveis(app.config['RECEBIVEIS_PATH'])
+    carteira.construir(erp, datetime.strptime(params['referencia'], '%Y-%m-%d').date(), app.config['RECEBIVEIS_CHUNK_ROWS'], progresso)
+    carteira.salvar()
+
+def _executar_recomendacao(app, params, progresso):
+    with app.app_context(): erp = get_sql_engine()
+    if erp is None: raise RuntimeError('Banco do ERP não configurado.')
+    hoje = datetime.strptime(params['ate'], '%Y-%m-%d')
+    inicio = (hoje - pd.DateOffset(months=params['meses'])).to_pydatetime()
+    progresso(0.05, 'Lendo compras')
+    df, nomes = carregar_compras(erp, inicio, hoje, rollups)
+    progresso(0.5, 'Calculando produtos relacionados')
+    # instância separada: as requisições seguem com o índice atual até o arquivo novo ser gravado
+    indice = Recommender(app.config['RECOMENDACAO_PATH'])
+    indice.construir(df, nomes, inicio, hoje)
+    indice.salvar()
+
+def _pagina_relatorio(nome, conn, pedido, data_inicio, data_fim, vendedor_sel):
+    rel = RELATORIOS[nome]
+    d1, d2, cv = _periodo_relatorio(data_inicio, data_fim, vendedor_sel)
+    if _usa_rollups(d1, d2): return pagina_df(rel['rollup'](conn, d1, d2, cv), pedido, rel['chave'], rel['filtro'])
+    sql, p = sql_pagina(*rel['sql'](data_inicio, data_fim, vendedor_sel), pedido, rel['chave'], rel['filtro'])
+    return pd.read_sql(text(sql), conn, params=p)
+
+@rota('/api/clientes/busca')
+@login_required
+def api_busca_clientes():
+    """Autocompletar da busca de clientes: só o índice local, sem faturamento."""
+    termo, v_id = request.args.get('q', '').strip(), request.args.get('vendedor_id', '').strip()
+    limite = min(max(request.args.get('limite', 10, type=int), 1), 50)
+    if len(termo) < 2 or not _indice_clientes_pronto(): return jsonify({'clientes': [], 'indice': indice_clientes.pronto()})
+    return jsonify({'clientes': indice_clientes.autocompletar(termo, int(v_id) if _is_int_string(v_id) else None, limite), 'indice': True})
+
+@rota('/api/<relatorio>')
+@login_required
+def api_relatorio(relatorio):
+    if relatorio not in RELATORIOS: abort(404)
+    rel = RELATORIOS[relatorio]
+    pedido = ler_pedido(request.args, rel['colunas'] + rel['chave'], rel['ordem_padrao'])
+    engine = get_sql_engine()
+    if not engine: return jsonify(resposta_pagina(pd.DataFrame(), pedido, rel['chave']))
+    try:
+        job = _job_relatorio(relatorio, *_filtros_relatorio())
+        if job is not None and job['status'] == 'erro': return jsonify({'erro': job['erro'], 'job': job}), 500
+        if job is not None and job['status'] != 'concluido': return jsonify({'job': job, 'linhas': [], 'proximo': None}), 202
+        if job is not None: df = pagina_df(jobs.resultado(job['id']), pedido, rel['chave'], rel['filtro'])
+        else:
+            with engine.connect() as conn: df = _pagina_relatorio(relatorio, conn, pedido, *_filtros_relatorio())
+    except Exception as e: return jsonify({'erro': str(e)}), 500
+    return jsonify(resposta_pagina(df, pedido, rel['chave']))
+
+@rota('/vendas_produto')
 @login_required
 def vendas_produto():
     engine = get_sql_engine()
-    hoje = datetime.now()
-    dt_ini_str = request.args.get('data_inicio', hoje.replace(day=1).strftime('%Y-%m-%d'))
-    dt_fim_str = request.args.get('data_fim', hoje.strftime('%Y-%m-%d'))
-    vendedor_sel = request.args.get('vendedor_id', '').strip()
-    vendedores, vendas, stats = [], [], {'atual_total': 0, 'meta_total': 0, 'qtd_atual': 0}
+    dt_ini_str, dt_fim_str, vendedor_sel = _filtros_relatorio()
+    vendedores, stats, job = [], {'atual_total': 0, 'meta_total': 0, 'qtd_atual': 0}, None
     if engine:
         with engine.connect() as conn:
             try:
-                vendedores = pd.read_sql(text("SELECT Codigo, Nome_Guerra FROM VENDE WHERE bloqueado=0 ORDER BY Nome_Guerra"), conn).to_dict('records')
-                dt_ini_obj = datetime.strptime(dt_ini_str, '%Y-%m-%d')
-                
-                # CONSULTA OTIMIZADA: Join direto com VECPR para filtrar as vendas na leitura inicial
-                sql = """
-                    SELECT 
-                        ve.Nome_Guerra, 
-                        c.Cod_Vendedor, 
-                        c.Cod_Produt as Cod_Produto, 
-                        pr.Descricao as produto, 
-                        c.Qtd_Cota as Qtd_Cota_Mensal, 
-                        SUM(ISNULL(it.Qtd_Produto, 0) + ISNULL(it.Qtd_Bonificacao, 0)) as Unidades_Vendidas, 
-                        Faltam = CASE WHEN c.Qtd_Cota > SUM(ISNULL(it.Qtd_Produto, 0) + ISNULL(it.Qtd_Bonificacao, 0)) THEN c.Qtd_Cota - SUM(ISNULL(it.Qtd_Produto, 0) + ISNULL(it.Qtd_Bonificacao, 0)) ELSE 0 END,
-                        Status = CASE WHEN SUM(ISNULL(it.Qtd_Produto, 0) + ISNULL(it.Qtd_Bonificacao, 0)) >= c.Qtd_Cota THEN 'META BATIDA' ELSE 'PENDENTE' END,
-                        SUM(ISNULL(it.Vlr_LiqItem, 0) - ISNULL(it.Vlr_SubsTrib, 0) - ISNULL(it.Vlr_SbtRes, 0)) as VlrLiq
-                    FROM VECPR c
-                    INNER JOIN VENDE ve ON c.Cod_Vendedor = ve.Codigo
-                    INNER JOIN PRODU pr ON c.Cod_Produt = pr.Codigo
-                    INNER JOIN NFSCB cb ON cb.Cod_Vendedor = c.Cod_Vendedor
-                    INNER JOIN NFSIT it ON cb.Num_Nota = it.Num_Nota AND cb.Ser_Nota = it.Ser_Nota AND cb.Cod_Estabe = it.Cod_Estabe AND it.Cod_Produto = c.Cod_Produt
-                    WHERE c.Ano_Ref = :a AND c.Mes_Ref = :m AND c.Qtd_Cota > 0
-                      AND cb.Dat_Emissao BETWEEN :d1 AND :d2 
-                      AND cb.Status = 'F'
-                """
-                p = {"d1": dt_ini_str.replace('-',''), "d2": dt_fim_str.replace('-',''), "a": dt_ini_obj.year, "m": dt_ini_obj.month}
-                if vendedor_sel and _is_int_string(vendedor_sel): p["cv"] = int(vendedor_sel); sql += " AND c.Cod_Vendedor = :cv"
-                
-                sql += " GROUP BY ve.Nome_Guerra, c.Cod_Vendedor, c.Cod_Produt, pr.Descricao, c.Qtd_Cota ORDER BY ve.Nome_Guerra, VlrLiq DESC"
-                
-                df = pd.read_sql(text(sql), conn, params=p)
-                if not df.empty:
-                    vendas = df.to_dict('records')
-                    stats = {'atual_total': df['VlrLiq'].sum(), 'meta_total': int(df['Qtd_Cota_Mensal'].sum()), 'qtd_atual': int(df['Unidades_Vendidas'].sum())}
+                vendedores = query_cache.read_sql(SQL_VENDEDORES, conn, classe='vendedores').to_dict('records')
+                job = _job_relatorio('vendas_produto', dt_ini_str, dt_fim_str, vendedor_sel)
+                stats = _totais_relatorio('vendas_produto', conn, dt_ini_str, dt_fim_str, vendedor_sel, job)
             except Exception as e: flash(f'Erro em Vendas Produto: {str(e)}', 'danger')
-    return render_template('vendas_produto.html', vendedores=vendedores, vendas=vendas, stats=stats, data_inicio=dt_ini_str, data_fim=dt_fim_str, vendedor_sel=vendedor_sel)
+    return render_template('vendas_produto.html', vendedores=vendedores, stats=stats, job=job, data_inicio=dt_ini_str, data_fim=dt_fim_str, vendedor_sel=vendedor_sel)
 
-@app.route('/vendas_fabricante')
+@rota('/vendas_fabricante')
 @login_required
 def vendas_fabricante():
     engine = get_sql_engine()
-    hoje = datetime.now()
-    data_inicio = request.args.get('data_inicio', hoje.replace(day=1).strftime('%Y-%m-%d'))
-    data_fim = request.args.get('data_fim', hoje.strftime('%Y-%m-%d'))
-    vendedor_sel = request.args.get('vendedor_id', '').strip()
-    vendedores, vendas, stats = [], [], {'total_vendido': 0, 'total_meta': 0}
+    data_inicio, data_fim, vendedor_sel = _filtros_relatorio()
+    vendedores, stats, job = [], {'total_vendido': 0, 'total_meta': 0}, None
     if engine:
         with engine.connect() as conn:
             try:
-                vendedores = pd.read_sql(text("SELECT Codigo, Nome_Guerra FROM VENDE WHERE bloqueado = 0 ORDER BY Nome_Guerra"), conn).to_dict('records')
-                dt_ini_str, dt_fim_str = datetime.strptime(data_inicio, '%Y-%m-%d').strftime('%Y%m%d'), datetime.strptime(data_fim, '%Y-%m-%d').strftime('%Y%m%d')
-                
-                # CORREÇÃO: Nomeação correta de Unidades para Unidades_Vendidas para evitar erro no Template
-                sql = """
-                    SELECT x.*, ISNULL(v.Qtd_Cota, 0) AS Qtd_Cota_Mensal, Faltam = CASE WHEN ISNULL(v.Qtd_Cota, 0) - x.Unidades_Vendidas > 0 THEN ISNULL(v.Qtd_Cota, 0) - x.Unidades_Vendidas ELSE 0 END,
-                           Status = CASE WHEN x.Unidades_Vendidas >= ISNULL(v.Qtd_Cota, 0) THEN 'META BATIDA' ELSE 'PENDENTE' END
-                    FROM (
-                        SELECT YEAR(cb.Dat_Emissao) AS Ano, MONTH(cb.Dat_Emissao) AS Mes, pr.Cod_Fabricante, fb.Fantasia, ve.Codigo AS CodVen, ve.Nome_Guerra, SUM(it.Qtd_Produto + it.Qtd_Bonificacao) as Unidades_Vendidas
-                        FROM NFSCB cb INNER JOIN NFSIT it ON cb.Num_Nota = it.Num_Nota INNER JOIN PRODU pr ON it.Cod_Produto = pr.Codigo INNER JOIN FABRI fb ON pr.Cod_Fabricante = fb.Codigo INNER JOIN VENDE ve ON cb.Cod_Vendedor = ve.Codigo
-                        WHERE cb.Dat_Emissao >= :dt_ini AND cb.Dat_Emissao <= :dt_fim AND cb.Status = 'F' GROUP BY YEAR(cb.Dat_Emissao), MONTH(cb.Dat_Emissao), pr.Cod_Fabricante, fb.Fantasia, ve.Codigo, ve.Nome_Guerra
-                    ) x LEFT JOIN VECOT v ON x.CodVen = v.Cod_Vendedor AND x.Cod_Fabricante = v.Cod_Fabricante AND x.Ano = v.Ano_Ref AND x.Mes = v.Mes_Ref WHERE ISNULL(v.Qtd_Cota, 0) > 0
-                """
-                params = {"dt_ini": dt_ini_str, "dt_fim": dt_fim_str}
-                if vendedor_sel and _is_int_string(vendedor_sel): params["codven"] = int(vendedor_sel); sql += " AND x.CodVen = :codven"
-                df = pd.read_sql(text(sql), conn, params=params)
-                if not df.empty:
-                    vendas = df.to_dict('records')
-                    stats = {'total_vendido': int(df['Unidades_Vendidas'].sum()), 'total_meta': int(df['Qtd_Cota_Mensal'].sum())}
+                vendedores = query_cache.read_sql(SQL_VENDEDORES, conn, classe='vendedores').to_dict('records')
+                job = _job_relatorio('vendas_fabricante', data_inicio, data_fim, vendedor_sel)
+                stats = _totais_relatorio('vendas_fabricante', conn, data_inicio, data_fim, vendedor_sel, job)
             except Exception as e: flash(f'Erro em Vendas Fabricante: {str(e)}', 'danger')
-    return render_template('vendas_fabricante.html', vendedores=vendedores, vendas=vendas, stats=stats, data_inicio=data_inicio, data_fim=data_fim, vendedor_sel=vendedor_sel)
+    return render_template('vendas_fabricante.html', vendedores=vendedores, stats=stats, job=job, data_inicio=data_inicio, data_fim=data_fim, vendedor_sel=vendedor_sel)
+
+def _export_busca_clientes():
+    hoje = datetime.now()
+    dt_ini = datetime.strptime(request.args.get('data_inicio', hoje.replace(day=1).strftime('%Y-%m-%d')), '%Y-%m-%d')
+    dt_fim = datetime.strptime(request.args.get('data_fim', hoje.strftime('%Y-%m-%d')), '%Y-%m-%d').replace(hour=23, minute=59)
+    cliente_busca, v_id = request.args.get('cliente_busca', '').strip(), request.args.get('vendedor_id', '').strip()
+    if indice_clientes.pronto(): return (lambda conn: _buscar_clientes(conn, cliente_busca, v_id, dt_ini, dt_fim, top=None)), None, None
+    sql, p = _sql_busca_clientes(cliente_busca, v_id, dt_ini, dt_fim, top=None)
+    return None, sql, p
+
+def _export_relatorio(nome):
+    rel = RELATORIOS[nome]
+    data_inicio, data_fim, vendedor_sel = _filtros_relatorio()
+    d1, d2, cv = _periodo_relatorio(data_inicio, data_fim, vendedor_sel)
+    if _usa_rollups(d1, d2): return (lambda conn: rel['rollup'](conn, d1, d2, cv)), None, None
+    if _periodo_longo(d1, d2):
+        # período longo só sai do resultado do job; a exportação não enfileira nem roda a consulta
+        job = _job_relatorio(nome, data_inicio, data_fim, vendedor_sel, enfileirar=False)
+        if job is not None and job['status'] == 'concluido':
+            return (lambda conn: jobs.blocos(job['id'], current_app.config['EXPORT_CHUNK_ROWS'])), None, None
+        flash('Este período é processado em segundo plano. Aguarde o relatório ficar pronto e exporte de novo.', 'info')
+        abort(redirect(url_for(nome, data_inicio=data_inicio, data_fim=data_fim, vendedor_id=vendedor_sel)))
+    sql, p = rel['sql'](data_inicio, data_fim, vendedor_sel)
+    return None, sql_ordenado(sql, [rel['ordem_padrao']] + rel['chave']), p
+
+# Relatórios exportáveis: função (lida dentro da requisição) -> (rollup(conn) | None, sql, params);
+# rollup(conn) devolve um DataFrame ou, para resultado de job, os blocos lidos do Parquet
+EXPORTACOES = {
+    'vendas_produto': lambda: _export_relatorio('vendas_produto'),
+    'vendas_fabricante': lambda: _export_relatorio('vendas_fabricante'),
+    'busca_clientes': _export_busca_clientes,
+}
+
+@rota('/exportar/<relatorio>')
+@login_required
+def exportar(relatorio):
+    formato, comprimir = request.args.get('formato', 'csv'), request.args.get('gzip') == '1'
+    if relatorio not in EXPORTACOES or formato not in export.FORMATOS: abort(404)
+    engine = get_sql_engine()
+    if not engine: abort(503)
+    rollup, sql, p = EXPORTACOES[relatorio]()
+    bloco = current_app.config['EXPORT_CHUNK_ROWS']
+
+    def blocos():
+        with engine.connect() as conn:
+            if rollup:
+                df = rollup(conn)
+                if not isinstance(df, pd.DataFrame): yield from df
+                else:
+                    for i in range(0, max(len(df), 1), bloco): yield df.iloc[i:i + bloco]
+            else:
+                yield from pd.read_sql(text(sql), conn, params=p, chunksize=bloco)
+
+    mimetype, headers = export.cabecalhos(f"{relatorio}_{datetime.now():%Y%m%d_%H%M}", formato, comprimir)
+    return Response(stream_with_context(export.gerar(blocos(), formato, comprimir, titulo=relatorio)), mimetype=mimetype, headers=headers)
+
+# ---------- produção: inicialização, aquecimento e fork ----------
+def init_db():
+    """Cria as tabelas do banco do app e dos bancos locais (rollups, jobs, índice de clientes)."""
+    os.makedirs(current_app.instance_path, exist_ok=True)
+    db.create_all()
+    rollups.criar_tabelas()
+    jobs.criar_tabelas()
+    indice_clientes.criar_tabelas()
+
+def aquecer():
+    """Carrega antes do primeiro acesso o que as páginas usam: templates, módulos de exportação, índice de
+    recomendação, carteira a receber, engine do ERP, lista de vendedores, dashboard e totais do mês corrente dos relatórios.
+    Também apaga os jobs antigos (JOB_RETENCAO_DIAS).
+
+    Com preload, roda no processo mestre antes do fork: os workers herdam tudo (copy-on-write). Precisa do contexto do app."""
+    t0 = time.perf_counter()
+    for nome in current_app.jinja_env.list_templates(): current_app.jinja_env.get_template(nome)
+    for modulo in ('pyarrow.parquet', 'openpyxl'):
+        try: importlib.import_module(modulo)
+        except ImportError: pass
+    recommender.pronto()
+    recebiveis.pronto()
+    try: current_app.logger.info(f'Aquecimento: {jobs.limpar()} jobs antigos apagados')
+    except Exception as e: current_app.logger.warning(f'Aquecimento: limpeza de jobs falhou: {e}')
+    with current_app.test_request_context('/aquecimento'):
+        engine = get_sql_engine()
+        if engine is None:
+            current_app.logger.warning('Aquecimento: banco do ERP não configurado; só templates e módulos carregados.')
+            return
+        data_inicio, data_fim, vendedor_sel = _filtros_relatorio()
+        etapas = {
+            'vendedores': lambda conn: query_cache.read_sql(SQL_VENDEDORES, conn, classe='vendedores'),
+            'dashboard': lambda conn: _dados_dashboard(engine),
+            'vendas_produto': lambda conn: _totais_relatorio('vendas_produto', conn, data_inicio, data_fim, vendedor_sel),
+            'vendas_fabricante': lambda conn: _totais_relatorio('vendas_fabricante', conn, data_inicio, data_fim, vendedor_sel),
+        }
+        with engine.connect() as conn:
+            for nome, etapa in etapas.items():
+                # ERP fora do ar não impede o servidor de subir: a página consulta na primeira requisição
+                try: etapa(conn)
+                except Exception as e: current_app.logger.warning(f'Aquecimento: {nome} falhou: {e}')
+    current_app.logger.info(f'Aquecimento concluído em {(time.perf_counter() - t0) * 1000:.0f} ms')
+
+def apos_fork(app):
+    """No worker recém-criado (gunicorn post_fork): conexões herdadas do mestre são abandonadas sem fechar
+    (o mestre ainda as referencia), pools de threads recriados e métricas zeradas."""
+    if _erp_engine is not None: _erp_engine.dispose(close=False)
+    with app.app_context(): db.engine.dispose(close=False)
+    rollups.engine.dispose(close=False)
+    indice_clientes.engine.dispose(close=False)
+    query_executor.apos_fork()
+    jobs.apos_fork()
+    metrics.zerar()
+
+def create_app(config_obj=None):
+    """Fábrica do app: configuração de config.Config (lida do ambiente) ou de `config_obj`, extensões,
+    serviços do processo, rotas, jobs e comandos (flask --app app init-db | aquecer).
+
+    Os serviços (cache, rollups, jobs...) ficam no módulo, um por processo: chamar de novo os recria
+    com a configuração do app novo."""
+    global query_cache, rollups, query_executor, recommender, indice_clientes, recebiveis, jobs, _erp_versao
+    app = Flask(__name__, instance_path=INSTANCE_DIR)
+    app.config.from_object(config_obj or Config)
+    os.makedirs(app.instance_path, exist_ok=True)
+    db.init_app(app)
+    login_manager.init_app(app)
+    query_cache = QueryCache.from_config(app.config)
+    rollups = RollupStore(app.config['ROLLUPS_PATH'])
+    query_executor = QueryExecutor(app.config['QUERY_WORKERS'], app.config['PAGE_DEADLINE'])
+    recommender = Recommender(app.config['RECOMENDACAO_PATH'])
+    indice_clientes = IndiceClientes(app.config['BUSCA_CLIENTES_PATH'])
+    recebiveis = CarteiraRecebiveis(app.config['RECEBIVEIS_PATH'])
+    jobs = JobRunner(app.config['JOBS_PATH'], app.config['JOBS_DIR'], app.config['JOB_WORKERS'], app.config['JOB_TTL'],
+                     retencao=app.config['JOB_RETENCAO_DIAS'])
+
+    # log da aplicação (tempos do executor de consultas, jobs, aquecimento) no stderr; no gunicorn vai junto do log de erros
+    logging.basicConfig(level=app.config['LOG_LEVEL'], format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    metrics.config['lenta_ms'] = app.config['SLOW_QUERY_MS']
+    if app.config['SLOW_QUERY_LOG'] and not metrics.log_lentas.handlers:
+        os.makedirs(os.path.dirname(app.config['SLOW_QUERY_LOG']) or '.', exist_ok=True)
+        handler = logging.FileHandler(app.config['SLOW_QUERY_LOG'], encoding='utf-8')
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+        metrics.log_lentas.addHandler(handler)
+    metrics.instrumentar_app(app)
+    metrics.instrumentar(rollups.engine, 'rollups')
+    metrics.instrumentar(indice_clientes.engine, 'busca')
+
+    for regra, view, opcoes in _rotas: app.add_url_rule(regra, view_func=view, **opcoes)
+    jobs.registrar('vendas_produto', _executar_relatorio(app, 'vendas_produto'))
+    jobs.registrar('vendas_fabricante', _executar_relatorio(app, 'vendas_fabricante'))
+    jobs.registrar('recomendacao', partial(_executar_recomendacao, app))
+    jobs.registrar('indice_clientes', partial(_executar_indice_clientes, app))
+    jobs.registrar('recebiveis', partial(_executar_recebiveis, app))
+
+    with app.app_context(): _erp_versao = _versao_config_erp()
+    query_cache.versao = _erp_versao or ''
+
+    @app.cli.command('init-db')
+    def init_db_command():
+        """Cria as tabelas do app e dos bancos locais."""
+        init_db()
+        print(f'Tabelas criadas em {app.instance_path}')
+
+    @app.cli.command('aquecer')
+    def aquecer_command():
+        """Executa o aquecimento de caches (diagnóstico: tempo e falhas vão para o log)."""
+        aquecer()
+
+    return app
 
 if __name__ == '__main__':
-    with app.app_context(): db.create_all()
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    # servidor de desenvolvimento; produção: gunicorn -c gunicorn.conf.py wsgi:app
+    app = create_app()
+    with app.app_context(): init_db()
+    app.run(debug=current_app.config['DEBUG'], host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,432 @@
+# benchmark.py
+"""Benchmark offline das páginas, com um ERP sintético num SQLite local.
+
+`gerar` cria as tabelas do ERP (NFSCB, NFSIT, PRODU, VENDE, clien, CTREC, PDVCB,
+VECPR, VECOT, FABRI, enxes) com dados aleatórios na escala pedida. `rodar` aponta o
+app para esse banco e passa por todas as páginas com o test client do Flask,
+medindo p50/p95 da latência, quantidade de consultas e pico de memória por página.
+O relatório vai para JSON e pode ser comparado com uma rodada anterior. Uso:
+
+    python benchmark.py gerar --notas 100000 [--meses 24] [--erp instance/benchmark/erp.db]
+    python benchmark.py rodar [--repeticoes 5] [--rollups] [--indice] [--saida atual.json] [--comparar base.json]
+
+O SQL das rotas é T-SQL: as funções de data/texto do SQL Server são registradas no
+SQLite e as construções sem equivalente direto (TOP, FOR XML PATH, alias = CASE,
+OFFSET/FETCH, '+' de strings) são reescritas antes de cada execução. Os tempos
+servem para comparar versões entre si, não para prever o SQL Server.
+"""
+import os
+import re
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import tempfile
+import calendar
+import subprocess
+import tracemalloc
+from datetime import datetime, date, timedelta
+
+import numpy as np
+
+DIR_PADRAO = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'benchmark')
+
+DDL = [
+    "CREATE TABLE FABRI (Codigo INTEGER PRIMARY KEY, Fantasia TEXT)",
+    "CREATE TABLE VENDE (Codigo INTEGER PRIMARY KEY, Nome_Guerra TEXT, bloqueado INTEGER)",
+    "CREATE TABLE PRODU (Codigo INTEGER PRIMARY KEY, Descricao TEXT, Cod_Fabricante INTEGER)",
+    """CREATE TABLE clien (Codigo INTEGER PRIMARY KEY, Razao_Social TEXT, Cgc_Cpf TEXT, Limite_Credito REAL,
+        Dat_Cadastro TEXT, Cidade TEXT, Estado TEXT)""",
+    "CREATE TABLE enxes (Num_CgcCpf TEXT, Cod_Vendedor INTEGER)",
+    """CREATE TABLE NFSCB (Num_Nota INTEGER, Ser_Nota TEXT, Cod_Estabe INTEGER, Cod_Cliente INTEGER, Cod_Vendedor INTEGER,
+        Dat_Emissao TEXT, Status TEXT, Vlr_TotalNota REAL)""",
+    """CREATE TABLE NFSIT (Num_Nota INTEGER, Ser_Nota TEXT, Cod_Estabe INTEGER, Cod_Produto INTEGER, Qtd_Produto REAL,
+        Qtd_Bonificacao REAL, Vlr_LiqItem REAL, Vlr_SubsTrib REAL, Vlr_SbtRes REAL)""",
+    """CREATE TABLE CTREC (Num_Titulo INTEGER, Num_Parcela INTEGER, Cod_Cliente INTEGER, Num_Nota INTEGER, Dat_Emissao TEXT,
+        Dat_Vencimento TEXT, Dat_Pagamento TEXT, Vlr_Titulo REAL, Vlr_Saldo REAL, Status TEXT)""",
+    """CREATE TABLE PDVCB (Num_Pedido INTEGER, Cod_Estabe INTEGER, Cod_Vendedor INTEGER, Cod_Cliente INTEGER, Tip_Pedido TEXT,
+        Status1 TEXT, Dat_Pedido TEXT, Cod_OrigemPdv TEXT, C_VlrPedido REAL)""",
+    "CREATE TABLE VECPR (Cod_Vendedor INTEGER, Cod_Produt INTEGER, Ano_Ref INTEGER, Mes_Ref INTEGER, Qtd_Cota REAL)",
+    "CREATE TABLE VECOT (Cod_Vendedor INTEGER, Cod_Fabricante INTEGER, Ano_Ref INTEGER, Mes_Ref INTEGER, Qtd_Cota REAL)",
+]
+# índices equivalentes aos do ERP, criados depois da carga
+INDICES = [
+    "CREATE INDEX ix_nfscb_emissao ON NFSCB (Dat_Emissao, Status)",
+    "CREATE INDEX ix_nfscb_cliente ON NFSCB (Cod_Cliente, Dat_Emissao)",
+    "CREATE UNIQUE INDEX ix_nfscb_nota ON NFSCB (Num_Nota, Ser_Nota, Cod_Estabe)",
+    "CREATE INDEX ix_nfsit_nota ON NFSIT (Num_Nota, Ser_Nota, Cod_Estabe)",
+    "CREATE INDEX ix_ctrec_cliente ON CTREC (Cod_Cliente, Status)",
+    "CREATE INDEX ix_pdvcb_pedido ON PDVCB (Dat_Pedido, Cod_Vendedor)",
+    "CREATE INDEX ix_enxes_cgc ON enxes (Num_CgcCpf)",
+    "CREATE INDEX ix_vecpr_ref ON VECPR (Ano_Ref, Mes_Ref, Cod_Vendedor)",
+    "CREATE INDEX ix_vecot_ref ON VECOT (Ano_Ref, Mes_Ref, Cod_Vendedor)",
+]
+
+
+# ---------- dados sintéticos ----------
+def _inserir(conn, tabela, colunas):
+    linhas = list(zip(*[c.tolist() if isinstance(c, np.ndarray) else c for c in colunas]))
+    conn.executemany(f"INSERT INTO {tabela} VALUES ({', '.join('?' * len(colunas))})", linhas)
+
+
+def _zipf(rng, n, tamanho, a=1.2):
+    """Índices em [0, n) com poucos muito frequentes (clientes e produtos campeões)."""
+    return (rng.zipf(a, tamanho) - 1) % n
+
+
+def gerar(caminho, notas=10000, meses=24, seed=42, bloco=200000):
+    rng = np.random.default_rng(seed)
+    n_cli, n_prod = max(200, notas // 50), max(300, min(20000, notas // 20))
+    n_vend, n_fab = 30, 60
+    hoje = date.today()
+    inicio = (hoje.replace(day=1) - timedelta(days=31 * (meses - 1))).replace(day=1)
+    dias = (hoje - inicio).days + 1
+
+    if os.path.exists(caminho): os.remove(caminho)
+    os.makedirs(os.path.dirname(caminho) or '.', exist_ok=True)
+    conn = sqlite3.connect(caminho)
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    for ddl in DDL: conn.execute(ddl)
+
+    _inserir(conn, 'FABRI', [np.arange(1, n_fab + 1), [f'FABRICANTE {i:03d}' for i in range(1, n_fab + 1)]])
+    _inserir(conn, 'VENDE', [np.arange(1, n_vend + 1), [f'VENDEDOR {i:02d}' for i in range(1, n_vend + 1)], (rng.random(n_vend) < 0.1).astype(int)])
+    fab_prod = rng.integers(1, n_fab + 1, n_prod)
+    _inserir(conn, 'PRODU', [np.arange(1, n_prod + 1), [f'PRODUTO {i:05d}' for i in range(1, n_prod + 1)], fab_prod])
+    cgc = [f'{i:014d}' for i in range(1, n_cli + 1)]
+    dia0 = np.datetime64(inicio, 'D')
+    cadastro = np.datetime_as_string(dia0 - rng.integers(0, 3 * dias, n_cli))
+    _inserir(conn, 'clien', [np.arange(1, n_cli + 1), [f'FARMACIA CLIENTE {i:06d} LTDA' for i in range(1, n_cli + 1)], cgc,
+                             np.round(rng.uniform(1000, 50000, n_cli), 2), cadastro, ['CIDADE'] * n_cli, ['RJ'] * n_cli])
+    vend_cli = rng.integers(1, n_vend + 1, n_cli)
+    _inserir(conn, 'enxes', [cgc, vend_cli])
+
+    preco = np.round(rng.lognormal(3, 0.8, n_prod), 2)
+    num = 0
+    for ini in range(0, notas, bloco):
+        n = min(bloco, notas - ini)
+        nota = np.arange(num + 1, num + n + 1)
+        num += n
+        cli = _zipf(rng, n_cli, n) + 1
+        emissao = np.datetime_as_string(dia0 + np.sort(rng.integers(0, dias, n)))
+        estabe = (rng.random(n) < 0.1).astype(int)
+        status = np.where(rng.random(n) < 0.95, 'F', 'C')
+        # itens: 1 + Poisson(3) por nota
+        qtd_itens = 1 + rng.poisson(3, n)
+        it_nota = np.repeat(np.arange(n), qtd_itens)
+        it_prod = _zipf(rng, n_prod, len(it_nota), 1.1) + 1
+        it_qtd = rng.integers(1, 24, len(it_nota)).astype(float)
+        it_bonif = np.where(rng.random(len(it_nota)) < 0.05, rng.integers(1, 4, len(it_nota)), 0).astype(float)
+        it_liq = np.round(it_qtd * preco[it_prod - 1], 2)
+        it_st = np.round(it_liq * rng.choice([0, 0.12], len(it_nota)), 2)
+        total = np.bincount(it_nota, weights=it_liq, minlength=n).round(2)
+        _inserir(conn, 'NFSCB', [nota, ['1'] * n, estabe, cli, vend_cli[cli - 1], emissao, status, total])
+        _inserir(conn, 'NFSIT', [nota[it_nota], ['1'] * len(it_nota), estabe[it_nota], it_prod, it_qtd, it_bonif, it_liq, it_st, np.zeros(len(it_nota))])
+
+        # contas a receber: 1 a 3 parcelas por nota faturada, a 30/60/90 dias
+        fat = np.flatnonzero(status == 'F')
+        parcelas = rng.integers(1, 4, len(fat))
+        t_nota = np.repeat(fat, parcelas)
+        t_parc = np.concatenate([np.arange(1, p + 1) for p in parcelas]) if len(fat) else np.array([], dtype=int)
+        t_valor = np.round(total[t_nota] / parcelas.repeat(parcelas), 2)
+        t_emissao = emissao[t_nota]
+        venc = t_emissao.astype('datetime64[D]') + 30 * t_parc
+        pago = (venc < np.datetime64(hoje - timedelta(days=5), 'D')) & (rng.random(len(t_nota)) < 0.93)
+        t_venc = np.datetime_as_string(venc)
+        t_pag = np.where(pago, np.datetime_as_string(venc + rng.integers(-5, 20, len(t_nota))).astype(object), None)
+        t_saldo = np.where(pago, 0.0, t_valor)
+        _inserir(conn, 'CTREC', [nota[t_nota], t_parc, cli[t_nota], nota[t_nota], t_emissao, t_venc, t_pag, t_valor, t_saldo, np.where(pago, 'Q', 'A')])
+
+        # pedidos (PDVCB): ~1,2 por nota, origem T (televendas) / M (mobile) / outros
+        m = int(n * 1.2)
+        p_cli = _zipf(rng, n_cli, m) + 1
+        _inserir(conn, 'PDVCB', [np.arange(ini * 2 + 1, ini * 2 + m + 1), (rng.random(m) < 0.1).astype(int), vend_cli[p_cli - 1], p_cli,
+                                 rng.choice(['N', 'C'], m, p=[0.95, 0.05]), rng.choice(['P', 'D', 'X'], m, p=[0.5, 0.4, 0.1]),
+                                 np.datetime_as_string(dia0 + rng.integers(0, dias, m)),
+                                 rng.choice(['T01', 'M02', 'W03', ''], m, p=[0.4, 0.4, 0.15, 0.05]), np.round(rng.lognormal(6, 1, m), 2)])
+        conn.commit()
+
+    # cotas mensais: ~40 produtos e ~15 fabricantes por vendedor
+    ano, mes = inicio.year, inicio.month
+    while (ano, mes) <= (hoje.year, hoje.month):
+        for v in range(1, n_vend + 1):
+            prods = rng.choice(n_prod, min(40, n_prod), replace=False) + 1
+            _inserir(conn, 'VECPR', [[v] * len(prods), prods, [ano] * len(prods), [mes] * len(prods), rng.integers(10, 300, len(prods)).astype(float)])
+            fabs = rng.choice(n_fab, 15, replace=False) + 1
+            _inserir(conn, 'VECOT', [[v] * len(fabs), fabs, [ano] * len(fabs), [mes] * len(fabs), rng.integers(50, 2000, len(fabs)).astype(float)])
+        ano, mes = (ano + 1, 1) if mes == 12 else (ano, mes + 1)
+
+    for ddl in INDICES: conn.execute(ddl)
+    conn.execute("ANALYZE")
+    conn.commit()
+    conn.close()
+    return {'notas': notas, 'clientes': n_cli, 'produtos': n_prod, 'vendedores': n_vend, 'fabricantes': n_fab, 'inicio': inicio.isoformat()}
+
+
+# ---------- T-SQL -> SQLite ----------
+_BASE_TSQL = datetime(1900, 1, 1)
+
+
+def _data(v):
+    if v is None: return None
+    if isinstance(v, (int, float)): return _BASE_TSQL + timedelta(days=v)
+    s = str(v)
+    if len(s) == 8 and s.isdigit(): return datetime.strptime(s, '%Y%m%d')
+    return datetime.fromisoformat(s)
+
+
+def _texto_data(d):
+    return d.strftime('%Y-%m-%d') if d.time() == datetime.min.time() else d.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _dateadd(parte, n, v):
+    d = _data(v)
+    if d is None: return None
+    parte, n = parte.lower(), int(n)
+    if parte in ('month', 'mm', 'm', 'year', 'yy', 'yyyy'):
+        meses = d.month - 1 + (n * 12 if parte.startswith('y') else n)
+        ano, mes = d.year + meses // 12, meses % 12 + 1
+        d = d.replace(year=ano, month=mes, day=min(d.day, calendar.monthrange(ano, mes)[1]))
+    else: d = d + timedelta(days=n)
+    return _texto_data(d)
+
+
+def _datediff(parte, v1, v2):
+    d1, d2 = _data(v1), _data(v2)
+    if d1 is None or d2 is None: return None
+    parte = parte.lower()
+    if parte in ('month', 'mm', 'm'): return (d2.year - d1.year) * 12 + d2.month - d1.month
+    if parte in ('year', 'yy', 'yyyy'): return d2.year - d1.year
+    return (d2.date() - d1.date()).days
+
+
+def _parte(v, i, j):
+    # datas do banco sintético são texto ISO: YEAR/MONTH sem parse completo
+    if v is None: return None
+    if isinstance(v, str) and len(v) >= 10 and v[4] == '-': return int(v[i:j])
+    d = _data(v)
+    return d.year if i == 0 else d.month
+
+
+def registrar_funcoes(conn):
+    # determinísticas: o SQLite calcula uma vez as expressões constantes (como o SQL Server faz com GETDATE())
+    conn.create_function('GETDATE', 0, lambda: datetime.now().strftime('%Y-%m-%d %H:%M:%S'), deterministic=True)
+    conn.create_function('DATEADD', 3, _dateadd, deterministic=True)
+    conn.create_function('DATEDIFF', 3, _datediff, deterministic=True)
+    conn.create_function('YEAR', 1, lambda v: _parte(v, 0, 4), deterministic=True)
+    conn.create_function('MONTH', 1, lambda v: _parte(v, 5, 7), deterministic=True)
+    conn.create_function('DAY', 1, lambda v: None if v is None else _data(v).day, deterministic=True)
+    conn.create_function('T_RIGHT', 2, lambda s, n: None if s is None else str(s)[-int(n):] if int(n) > 0 else '', deterministic=True)
+    conn.create_function('LEN', 1, lambda s: None if s is None else len(str(s).rstrip()), deterministic=True)
+
+
+_REGRAS = [
+    # (SELECT TOP n expr FROM ... FOR XML PATH('')) -> group_concat ordenado
+    (re.compile(r"\(\s*SELECT\s+TOP\s+(\d+)\s+(.*?)\s+FROM\s+(.*?)\s+FOR\s+XML\s+PATH\(''\)\s*\)", re.I | re.S),
+     r"(SELECT group_concat(_x, '') FROM (SELECT \2 AS _x FROM \3 LIMIT \1))"),
+    (re.compile(r",\s*(\w+)\s*=\s*CASE\b(.*?)\bEND\b", re.I | re.S), r", CASE\2END AS \1"),
+    (re.compile(r"OFFSET\s+(:\w+|\d+)\s+ROWS\s+FETCH\s+NEXT\s+(:\w+|\d+)\s+ROWS\s+ONLY", re.I), r"LIMIT \2 OFFSET \1"),
+    (re.compile(r"CAST\(\s*([\w.]+)\s+AS\s+DATE\s*\)", re.I), r"date(\1)"),
+    (re.compile(r"\b(DATEADD|DATEDIFF)\(\s*(\w+)\s*,", re.I), r"\1('\2',"),
+    (re.compile(r"\bISNULL\s*\(", re.I), "IFNULL("),
+    (re.compile(r"\bRIGHT\s*\(", re.I), "T_RIGHT("),
+    (re.compile(r"\bSUBSTRING\s*\(", re.I), "SUBSTR("),
+    (re.compile(r"'\s*\+(?!\s*\d)|\+\s*(?=')"), lambda m: "' ||" if m.group(0).startswith("'") else "|| "),
+]
+_TOP = re.compile(r"^(\s*SELECT\s+(?:DISTINCT\s+)?)TOP\s+(\d+)\s+", re.I)
+
+
+def traduzir_tsql(sql):
+    for regra, troca in _REGRAS: sql = regra.sub(troca, sql)
+    m = _TOP.match(sql)
+    if m: sql = m.group(1) + sql[m.end():].rstrip().rstrip(';') + f" LIMIT {m.group(2)}"
+    return sql
+
+
+def _param(nome, v):
+    if isinstance(v, datetime): return _texto_data(v)
+    if isinstance(v, date): return v.isoformat()
+    # vendas_produto/fabricante mandam as datas como 'YYYYMMDD' (d1, d2, dt_ini, dt_fim)
+    if isinstance(v, str) and re.fullmatch(r'(d\d|dt_\w+)', nome) and re.fullmatch(r'(19|20)\d{6}', v): return f'{v[:4]}-{v[4:6]}-{v[6:]}'
+    return v
+
+
+def criar_engine(caminho):
+    from sqlalchemy import create_engine, event
+    engine = create_engine(f'sqlite:///{caminho}', paramstyle='named', connect_args={'check_same_thread': False})
+
+    @event.listens_for(engine, 'connect')
+    def _conectar(dbapi_conn, conn_rec):
+        registrar_funcoes(dbapi_conn)
+
+    @event.listens_for(engine, 'before_cursor_execute', retval=True)
+    def _traduzir(conn, cursor, statement, parameters, context, executemany):
+        if isinstance(parameters, dict): parameters = {k: _param(k, v) for k, v in parameters.items()}
+        return traduzir_tsql(statement), parameters
+
+    return engine
+
+
+# ---------- rodada ----------
+def _paginas(cliente, busca):
+    return [
+        ('dashboard', '/dashboard'),
+        ('analise_cliente', '/analise_cliente'),
+        ('analise_cliente_detalhe', f'/analise_cliente?cliente_id={cliente}'),
+        ('analise_cliente_busca', f'/analise_cliente?cliente_busca={busca}'),
+        ('api_busca_clientes', f'/api/clientes/busca?q={busca}'),
+        ('pedidos_eletronicos', '/pedidos_eletronicos'),
+        ('vendas_produto', '/vendas_produto'),
+        ('api_vendas_produto', '/api/vendas_produto?ordem=VlrLiq&dir=desc&limite=100'),
+        ('vendas_fabricante', '/vendas_fabricante'),
+        ('api_vendas_fabricante', '/api/vendas_fabricante?ordem=Nome_Guerra&limite=100'),
+        ('exportar_vendas_produto_csv', '/exportar/vendas_produto?formato=csv'),
+    ]
+
+
+def _percentil(valores, p):
+    return float(np.percentile(valores, p)) if valores else 0.0
+
+
+def rodar(caminho_erp, repeticoes=5, usar_rollups=False, usar_indice=False, cache_quente=False):
+    trabalho = tempfile.mkdtemp(prefix='bi-bench-')
+    # estado local do app (rollups, índice, jobs, cache) isolado da instalação
+    os.environ.update({
+        'ROLLUPS_PATH': os.path.join(trabalho, 'rollups.db'), 'RECOMENDACAO_PATH': os.path.join(trabalho, 'recomendacoes.pkl'),
+        'JOBS_PATH': os.path.join(trabalho, 'jobs.db'), 'JOBS_DIR': os.path.join(trabalho, 'jobs'),
+        'QUERY_CACHE_BACKEND': 'memory', 'LOG_LEVEL': 'WARNING', 'SLOW_QUERY_LOG': os.path.join(trabalho, 'slow_queries.log'),
+        'BUSCA_CLIENTES_PATH': os.path.join(trabalho, 'busca_clientes.db'), 'RECEBIVEIS_PATH': os.path.join(trabalho, 'recebiveis.pkl'),
+    })
+    from flask_login import UserMixin
+    from sqlalchemy import event, text
+    import app as bi
+    import metrics
+    from recommender import carregar_compras
+
+    erp = criar_engine(caminho_erp)
+    metrics.instrumentar(erp, 'erp')
+    aplicacao = bi.create_app()
+    bi._erp_engine = erp  # get_sql_engine() devolve o engine já montado
+
+    class _Usuario(UserMixin):
+        id, nome, username = 1, 'Benchmark', 'benchmark'
+    bi.login_manager.user_loader(lambda user_id: _Usuario())
+    # sem --indice a página de cliente mostra as sugestões "em preparo"; o build em background ficaria concorrendo com a medição
+    bi.jobs.registrar('recomendacao', lambda params, progresso: None)
+
+    hoje = datetime.combine(date.today(), datetime.min.time())
+    if usar_rollups:
+        with erp.connect() as conn: desde = datetime.fromisoformat(conn.execute(text("SELECT MIN(Dat_Emissao) FROM NFSCB")).scalar())
+        bi.rollups.backfill(erp, desde, log=lambda *a: None)
+    bi.indice_clientes.atualizar(erp, completo=True, log=lambda *a: None)
+    bi.recebiveis.construir(erp)
+    bi.recebiveis.salvar()
+    if usar_indice:
+        inicio = (hoje - timedelta(days=365))
+        compras, nomes = carregar_compras(erp, inicio, hoje, bi.rollups if usar_rollups else None)
+        bi.recommender.construir(compras, nomes, inicio, hoje)
+        bi.recommender.salvar()
+
+    with erp.connect() as conn:
+        cliente = conn.execute(text("SELECT Cod_Cliente FROM NFSCB GROUP BY Cod_Cliente ORDER BY COUNT(*) DESC LIMIT 1")).scalar()
+    contagem = {'n': 0}
+    event.listen(erp, 'after_cursor_execute', lambda *a: contagem.__setitem__('n', contagem['n'] + 1))
+
+    client = aplicacao.test_client()
+    with client.session_transaction() as sessao: sessao['_user_id'] = '1'
+
+    def pedir(url):
+        if not cache_quente: bi.query_cache.invalidate()
+        contagem['n'] = 0
+        t0 = time.perf_counter()
+        r = client.get(url)
+        r.get_data()  # consome respostas em streaming (exportação)
+        return (time.perf_counter() - t0) * 1000, r.status_code, contagem['n']
+
+    resultado = {}
+    for nome, url in _paginas(cliente, 'CLIENTE 0001'):
+        pedir(url)  # aquecimento (imports, planos do SQLite)
+        tempos, status, consultas = [], None, 0
+        for _ in range(repeticoes):
+            ms, status, consultas = pedir(url)
+            tempos.append(ms)
+        tracemalloc.start()
+        pedir(url)
+        pico = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        resultado[nome] = {'url': url, 'status': status, 'p50_ms': round(_percentil(tempos, 50), 2), 'p95_ms': round(_percentil(tempos, 95), 2),
+                           'media_ms': round(float(np.mean(tempos)), 2), 'consultas': consultas, 'pico_mb': round(pico / 2 ** 20, 2)}
+        print(f"{nome:32s} {status} p50 {resultado[nome]['p50_ms']:9.1f} ms  p95 {resultado[nome]['p95_ms']:9.1f} ms  "
+              f"{consultas:3d} consultas  {resultado[nome]['pico_mb']:8.1f} MB", flush=True)
+    bi.jobs.shutdown()
+    bi.query_executor.shutdown()
+    return resultado
+
+
+def _meta(caminho_erp, args):
+    try: commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError: commit = ''
+    conn = sqlite3.connect(caminho_erp)
+    notas = conn.execute("SELECT COUNT(*) FROM NFSCB").fetchone()[0]
+    conn.close()
+    return {'commit': commit, 'data': datetime.now().isoformat(timespec='seconds'), 'notas': notas, 'repeticoes': args.repeticoes,
+            'rollups': args.rollups, 'indice': args.indice, 'cache_quente': args.cache_quente, 'python': sys.version.split()[0]}
+
+
+def comparar(base, atual, tolerancia=0.10, piso_ms=5.0):
+    """Tabela de variação por página; regressão = p95 pior que a base além da tolerância e do piso de ruído."""
+    linhas, regressoes = [], []
+    for nome, r in atual['paginas'].items():
+        b = base['paginas'].get(nome)
+        if b is None:
+            linhas.append(f"{nome:32s} {'(nova)':>10s} {r['p95_ms']:10.1f}")
+            continue
+        delta = (r['p95_ms'] - b['p95_ms']) / b['p95_ms'] if b['p95_ms'] else 0.0
+        regrediu = delta > tolerancia and r['p95_ms'] - b['p95_ms'] > piso_ms or r['status'] != b['status']
+        if regrediu: regressoes.append(nome)
+        linhas.append(f"{nome:32s} {b['p95_ms']:10.1f} {r['p95_ms']:10.1f} {delta:+8.1%} {b['consultas']:5d} -> {r['consultas']:<5d}"
+                      f"{b['pico_mb']:8.1f} -> {r['pico_mb']:<8.1f}{'  REGRESSÃO' if regrediu else ''}")
+    cab = f"{'página':32s} {'base p95':>10s} {'atual p95':>10s} {'var':>8s} {'consultas':>14s} {'pico MB':>18s}"
+    return '\n'.join([f"base {base['meta'].get('commit')} ({base['meta'].get('notas')} notas) x atual {atual['meta'].get('commit')} "
+                      f"({atual['meta'].get('notas')} notas)", cab] + linhas), regressoes
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark offline com ERP sintético')
+    sub = parser.add_subparsers(dest='comando', required=True)
+    g = sub.add_parser('gerar', help='Gera o banco sintético do ERP')
+    g.add_argument('--notas', type=int, default=10000, help='Quantidade de notas (NFSCB); 10k a 10M')
+    g.add_argument('--meses', type=int, default=24, help='Meses de histórico até hoje')
+    g.add_argument('--seed', type=int, default=42)
+    g.add_argument('--erp', default=os.path.join(DIR_PADRAO, 'erp.db'))
+    r = sub.add_parser('rodar', help='Mede as páginas contra o banco sintético')
+    r.add_argument('--erp', default=os.path.join(DIR_PADRAO, 'erp.db'))
+    r.add_argument('--repeticoes', type=int, default=5)
+    r.add_argument('--rollups', action='store_true', help='Carrega os rollups antes de medir')
+    r.add_argument('--indice', action='store_true', help='Constrói o índice de recomendação antes de medir')
+    r.add_argument('--cache-quente', action='store_true', help='Não limpa o cache de consultas entre as repetições')
+    r.add_argument('--saida', default=os.path.join(DIR_PADRAO, f'resultado_{datetime.now():%Y%m%d_%H%M%S}.json'))
+    r.add_argument('--comparar', help='Relatório anterior (JSON) para comparar')
+    r.add_argument('--tolerancia', type=float, default=0.10, help='Piora de p95 aceita antes de acusar regressão (0.10 = 10%%)')
+    args = parser.parse_args()
+
+    if args.comando == 'gerar':
+        t0 = time.perf_counter()
+        info = gerar(args.erp, args.notas, args.meses, args.seed)
+        print(f'ERP sintético em {args.erp}: {info} ({time.perf_counter() - t0:.1f} s)')
+        return
+    if not os.path.exists(args.erp): raise SystemExit(f'{args.erp} não existe: rode "python benchmark.py gerar" antes.')
+    relatorio = {'meta': _meta(args.erp, args), 'paginas': rodar(args.erp, args.repeticoes, args.rollups, args.indice, args.cache_quente)}
+    os.makedirs(os.path.dirname(os.path.abspath(args.saida)), exist_ok=True)
+    with open(args.saida, 'w', encoding='utf-8') as f: json.dump(relatorio, f, indent=2, ensure_ascii=False)
+    print(f'Relatório: {args.saida}')
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as f: base = json.load(f)
+        tabela, regressoes = comparar(base, relatorio, args.tolerancia)
+        print(tabela)
+        if regressoes: raise SystemExit(f'Regressão em: {", ".join(regressoes)}')
+
+
+if __name__ == '__main__':
+    main()
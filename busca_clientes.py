@@ -0,0 +1,168 @@
+# busca_clientes.py
+"""Índice local de clientes para a busca e o autocompletar de analise_cliente.
+
+Código, razão social e CNPJ/CPF de clien viram um texto normalizado (maiúsculas,
+sem acento, documento só com dígitos) indexado num FTS5 com tokenizador trigram:
+qualquer trecho de 3+ letras acha o cliente sem o LIKE '%termo%' no ERP. Trechos
+menores caem num LIKE sobre a tabela local. Os vendedores de cada cliente (enxes)
+ficam ao lado, para o filtro por vendedor.
+
+Sincronização: a completa compara cada cliente com o que está no índice e só grava
+o que mudou (e remove o que sumiu); a incremental traz só os códigos acima do
+maior já indexado. Uso:
+
+    python busca_clientes.py atualizar [--completo]
+"""
+import re
+import argparse
+import unicodedata
+from datetime import datetime
+
+import pandas as pd
+from sqlalchemy import text, create_engine
+
+SQL_CLIENTES = "SELECT cl.Codigo AS codigo, cl.Razao_Social AS razao_social, cl.Cgc_Cpf AS cgc_cpf FROM clien cl"
+
+SQL_VENDEDORES = """
+    SELECT DISTINCT cl.Codigo AS codigo, ve.Codigo AS cod_vendedor, ve.Nome_Guerra AS vendedor
+    FROM clien cl
+    INNER JOIN enxes en ON cl.Cgc_Cpf = en.Num_CgcCpf
+    INNER JOIN vende ve ON en.Cod_Vendedor = ve.Codigo
+"""
+
+DDL = [
+    "CREATE TABLE IF NOT EXISTS clientes (codigo PRIMARY KEY, razao_social TEXT, cgc_cpf TEXT, texto TEXT)",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS clientes_fts USING fts5(texto, content='clientes', content_rowid='rowid', tokenize='trigram')",
+    # mantém o FTS (conteúdo externo) em dia com a tabela
+    """CREATE TRIGGER IF NOT EXISTS clientes_ai AFTER INSERT ON clientes BEGIN
+        INSERT INTO clientes_fts (rowid, texto) VALUES (new.rowid, new.texto); END""",
+    """CREATE TRIGGER IF NOT EXISTS clientes_ad AFTER DELETE ON clientes BEGIN
+        INSERT INTO clientes_fts (clientes_fts, rowid, texto) VALUES ('delete', old.rowid, old.texto); END""",
+    """CREATE TRIGGER IF NOT EXISTS clientes_au AFTER UPDATE ON clientes BEGIN
+        INSERT INTO clientes_fts (clientes_fts, rowid, texto) VALUES ('delete', old.rowid, old.texto);
+        INSERT INTO clientes_fts (rowid, texto) VALUES (new.rowid, new.texto); END""",
+    "CREATE TABLE IF NOT EXISTS vendedores_cliente (codigo, cod_vendedor, vendedor TEXT, PRIMARY KEY (codigo, cod_vendedor))",
+    "CREATE INDEX IF NOT EXISTS ix_vendedores_cliente_vendedor ON vendedores_cliente (cod_vendedor)",
+    "CREATE TABLE IF NOT EXISTS busca_estado (chave TEXT PRIMARY KEY, valor TEXT)",
+]
+
+_RE_DOC = re.compile(r'(?<=\d)[./-](?=\d)')
+_RE_SEPARADOR = re.compile(r'[^A-Z0-9]+')
+
+
+def normalizar(s):
+    """Maiúsculas, sem acento; pontuação entre dígitos some (12.345.678/0001-90 -> 12345678000190)."""
+    s = unicodedata.normalize('NFKD', str(s or '')).encode('ascii', 'ignore').decode('ascii').upper()
+    return _RE_SEPARADOR.sub(' ', _RE_DOC.sub('', s)).strip()
+
+
+def _texto(codigo, razao_social, cgc_cpf):
+    return f"{normalizar(codigo)} {normalizar(razao_social)} {re.sub(r'[^0-9]', '', str(cgc_cpf or ''))}".strip()
+
+
+class IndiceClientes:
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self.engine = create_engine(f'sqlite:///{caminho}', connect_args={'timeout': 30})
+
+    def criar_tabelas(self):
+        with self.engine.begin() as conn:
+            for ddl in DDL: conn.execute(text(ddl))
+
+    def estado(self):
+        try:
+            with self.engine.connect() as conn:
+                return dict(conn.execute(text("SELECT chave, valor FROM busca_estado")).fetchall())
+        except Exception: return {}
+
+    def pronto(self):
+        return 'atualizado_em' in self.estado()
+
+    def idade(self, chave='atualizado_em'):
+        """Segundos desde a última sincronização (completa com chave='completo_em'); None se nunca rodou."""
+        valor = self.estado().get(chave)
+        return (datetime.now() - datetime.fromisoformat(valor)).total_seconds() if valor else None
+
+    # ---------- sincronização ----------
+    def atualizar(self, erp, completo=False, log=print):
+        self.criar_tabelas()
+        est = self.estado()
+        completo = completo or 'completo_em' not in est
+        filtro, p = ("", {}) if completo else (" WHERE cl.Codigo > :max", {"max": int(float(est.get('max_codigo') or 0))})
+        with erp.connect() as conn:
+            df = pd.read_sql(text(SQL_CLIENTES + filtro), conn, params=p)
+            df_vend = pd.read_sql(text(SQL_VENDEDORES + filtro), conn, params=p)
+        df['razao_social'] = df['razao_social'].astype(str).str.strip()
+        df['texto'] = [_texto(*r) for r in df[['codigo', 'razao_social', 'cgc_cpf']].itertuples(index=False, name=None)]
+
+        with self.engine.begin() as conn:
+            atual = pd.read_sql(text("SELECT codigo, razao_social, cgc_cpf, texto FROM clientes"), conn)
+            comp = df.merge(atual, on='codigo', how='left', suffixes=('', '_ant'), indicator=True)
+            mudou = (comp['_merge'] == 'left_only') | (comp['texto'] != comp['texto_ant']) | (comp['razao_social'] != comp['razao_social_ant'])
+            gravar = comp.loc[mudou, ['codigo', 'razao_social', 'cgc_cpf', 'texto']].to_dict('records')
+            if gravar:
+                conn.execute(text("INSERT INTO clientes (codigo, razao_social, cgc_cpf, texto) VALUES (:codigo, :razao_social, :cgc_cpf, :texto) "
+                                  "ON CONFLICT (codigo) DO UPDATE SET razao_social = excluded.razao_social, cgc_cpf = excluded.cgc_cpf, texto = excluded.texto"), gravar)
+            removidos = []
+            if completo:
+                removidos = [{"c": c} for c in set(atual['codigo']) - set(df['codigo'])]
+                if removidos: conn.execute(text("DELETE FROM clientes WHERE codigo = :c"), removidos)
+                conn.execute(text("DELETE FROM vendedores_cliente"))
+            df_vend.to_sql('vendedores_cliente', conn, if_exists='append', index=False)
+            agora = datetime.now().isoformat(timespec='seconds')
+            conn.execute(text("INSERT OR REPLACE INTO busca_estado (chave, valor) VALUES ('atualizado_em', :v)"), {"v": agora})
+            if completo: conn.execute(text("INSERT OR REPLACE INTO busca_estado (chave, valor) VALUES ('completo_em', :v)"), {"v": agora})
+            max_codigo = conn.execute(text("SELECT MAX(codigo) FROM clientes")).scalar()
+            conn.execute(text("INSERT OR REPLACE INTO busca_estado (chave, valor) VALUES ('max_codigo', :v)"), {"v": str(max_codigo or 0)})
+        log(f"{'completa' if completo else 'incremental'}: {len(df)} clientes lidos, {len(gravar)} gravados, {len(removidos)} removidos")
+        return len(gravar), len(removidos)
+
+    # ---------- consulta ----------
+    def buscar(self, termo, cod_vendedor=None, limite=500):
+        """Uma linha por cliente x vendedor (vendedor None se não tiver), código exato primeiro; limite=-1 traz todos."""
+        palavras = normalizar(termo).split()
+        if not palavras and cod_vendedor is None: return pd.DataFrame(columns=['codigo', 'razao_social', 'cgc_cpf', 'cod_vendedor', 'vendedor'])
+        where, p = ["1=1"], {"q": normalizar(termo), "lim": int(limite)}
+        longas = [w for w in palavras if len(w) >= 3]
+        if longas:
+            where.append("c.rowid IN (SELECT rowid FROM clientes_fts WHERE clientes_fts MATCH :m)")
+            p["m"] = ' AND '.join(f'"{w}"' for w in longas)
+        for i, w in enumerate(w for w in palavras if len(w) < 3):
+            where.append(f"c.texto LIKE :c{i}")
+            p[f"c{i}"] = f"%{w}%"
+        if cod_vendedor is not None: where.append("v.cod_vendedor = :cv"); p["cv"] = cod_vendedor
+        with self.engine.connect() as conn:
+            return pd.read_sql(text(f"""
+                SELECT c.codigo, c.razao_social, c.cgc_cpf, v.cod_vendedor, v.vendedor
+                FROM clientes c LEFT JOIN vendedores_cliente v ON v.codigo = c.codigo
+                WHERE {' AND '.join(where)}
+                ORDER BY CAST(c.codigo AS TEXT) = :q DESC, c.razao_social LIMIT :lim"""), conn, params=p)
+
+    def autocompletar(self, termo, cod_vendedor=None, limite=10):
+        df = self.buscar(termo, cod_vendedor, limite=limite * 5)
+        if df.empty: return []
+        vendedores = df.dropna(subset=['vendedor']).groupby('codigo', sort=False)['vendedor'].agg(', '.join)
+        df = df.drop_duplicates('codigo').head(limite)
+        return [{'codigo': r.codigo, 'razao_social': r.razao_social, 'cgc_cpf': r.cgc_cpf, 'vendedores': vendedores.get(r.codigo, '')}
+                for r in df.itertuples(index=False)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Índice local de busca de clientes')
+    sub = parser.add_subparsers(dest='comando', required=True)
+    at = sub.add_parser('atualizar', help='Sincroniza o índice com clien/enxes')
+    at.add_argument('--completo', action='store_true', help='Compara todos os clientes (padrão: só códigos novos)')
+    args = parser.parse_args()
+
+    import app as bi
+    app = bi.create_app()
+    indice_clientes = bi.indice_clientes
+    with app.app_context():
+        erp = bi.get_sql_engine()
+        if erp is None: raise SystemExit('Banco do ERP não configurado (/config-db).')
+        indice_clientes.atualizar(erp, completo=args.completo)
+    print('Índice de clientes:', indice_clientes.estado())
+
+
+if __name__ == '__main__':
+    main()
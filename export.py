@@ -0,0 +1,137 @@
+# export.py
+"""Exportação de relatórios em CSV, Parquet ou XLSX sem montar o arquivo em memória.
+
+Os geradores recebem um iterável de DataFrames (blocos do cursor, p.ex.
+pd.read_sql(..., chunksize=N)) e devolvem bytes à medida que cada bloco é escrito,
+para irem direto para uma resposta HTTP em partes. Memória ~ tamanho de um bloco.
+"""
+import io
+import zlib
+import tempfile
+
+import pandas as pd
+
+FORMATOS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+}
+TAMANHO_BLOCO = 64 * 1024
+
+
+def _csv(blocos):
+    primeiro = True
+    for df in blocos:
+        # ';' e vírgula decimal: abre direto no Excel em pt-BR
+        texto = df.to_csv(index=False, header=primeiro, sep=';', decimal=',', date_format='%d/%m/%Y')
+        yield (('\ufeff' if primeiro else '') + texto).encode('utf-8')
+        primeiro = False
+    if primeiro: yield '\ufeff'.encode('utf-8')
+
+
+class _Saida(io.RawIOBase):
+    """Arquivo só-escrita que acumula bytes até serem drenados para a resposta."""
+
+    def __init__(self):
+        self._partes, self._pos = [], 0
+
+    def writable(self): return True
+
+    def write(self, b):
+        self._partes.append(bytes(b))
+        self._pos += len(b)
+        return len(b)
+
+    def tell(self): return self._pos
+
+    def drenar(self):
+        dados, self._partes = b''.join(self._partes), []
+        return dados
+
+
+def _tipo_arrow(s):
+    """Tipo Parquet da coluna a partir do primeiro bloco, já tolerante aos blocos seguintes:
+    inteiros viram int64 anulável (NULL num bloco posterior transforma a coluna em float no
+    pandas) e coluna toda NULL vira texto (o tipo real não aparece no bloco)."""
+    import pyarrow as pa
+    if pd.api.types.is_bool_dtype(s): return pa.bool_()
+    if pd.api.types.is_integer_dtype(s): return pa.int64()
+    if pd.api.types.is_float_dtype(s): return pa.float64()
+    if pd.api.types.is_datetime64_any_dtype(s): return pa.timestamp('us')
+    tipo = pa.infer_type(s.dropna(), from_pandas=True)
+    return pa.string() if pa.types.is_null(tipo) else tipo
+
+
+def _tabela_arrow(df, schema):
+    import pyarrow as pa
+    colunas = []
+    for campo in schema:
+        s = df[campo.name]
+        try: colunas.append(pa.array(s, type=campo.type, from_pandas=True))
+        except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError):
+            if campo.type != pa.string(): raise
+            colunas.append(pa.array(s.where(s.isna(), s.astype(str)), type=pa.string(), from_pandas=True))
+    return pa.Table.from_arrays(colunas, schema=schema)
+
+
+def _parquet(blocos):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    saida, writer = _Saida(), None
+    try:
+        for df in blocos:
+            if writer is None:
+                schema = pa.schema([pa.field(str(c), _tipo_arrow(df[c])) for c in df.columns])
+                writer = pq.ParquetWriter(saida, schema, compression='snappy')
+            writer.write_table(_tabela_arrow(df.set_axis([str(c) for c in df.columns], axis=1), writer.schema))
+            yield saida.drenar()
+    finally:
+        if writer is not None: writer.close()
+    yield saida.drenar()
+
+
+def _xlsx(blocos, titulo='Relatorio'):
+    # O XLSX é um zip e só fecha no fim: as linhas vão para um arquivo temporário
+    # (write_only não guarda as células em memória) e o arquivo é enviado em blocos.
+    from openpyxl import Workbook
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(titulo[:31])
+    cabecalho = False
+    for df in blocos:
+        if not cabecalho:
+            ws.append([str(c) for c in df.columns])
+            cabecalho = True
+        for linha in df.itertuples(index=False, name=None):
+            ws.append([None if v != v else v for v in linha])  # NaN -> célula vazia
+    with tempfile.TemporaryFile() as tmp:
+        wb.save(tmp)
+        tmp.seek(0)
+        while True:
+            dados = tmp.read(TAMANHO_BLOCO)
+            if not dados: break
+            yield dados
+
+
+def _gzip(partes):
+    comp = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31: cabeçalho gzip
+    for parte in partes:
+        dados = comp.compress(parte)
+        if dados: yield dados
+    yield comp.flush()
+
+
+def gerar(blocos, formato, gzip=False, titulo='Relatorio'):
+    """Bytes do arquivo no formato pedido, bloco a bloco."""
+    if formato == 'csv': partes = _csv(blocos)
+    elif formato == 'parquet': partes = _parquet(blocos)
+    elif formato == 'xlsx': partes = _xlsx(blocos, titulo)
+    else: raise ValueError(f'Formato de exportação desconhecido: {formato}')
+    return _gzip(partes) if gzip else partes
+
+
+def cabecalhos(nome, formato, gzip=False):
+    """(mimetype, headers) da resposta de download."""
+    mimetype, ext = FORMATOS[formato]
+    arquivo = f'{nome}.{ext}' + ('.gz' if gzip else '')
+    if gzip: mimetype = 'application/gzip'
+    return mimetype, {'Content-Disposition': f'attachment; filename="{arquivo}"', 'X-Accel-Buffering': 'no'}
@@ -0,0 +1,91 @@
+# graficos.py
+"""Gráficos em formato compacto: o servidor manda só os dados, o navegador monta a figura.
+
+Em vez do JSON completo de uma figura Plotly (traços, template e layout repetidos em
+cada página), cada gráfico vira um dicionário pequeno com o tipo, o título e as
+colunas de dados; o layout comum e a montagem dos traços ficam em
+static/js/graficos.js (desenharGrafico). Séries numéricas longas vão como array
+binário (float64 em base64, formato {dtype, bdata} que o plotly.js lê direto).
+
+O JSON gerado é memorizado pelo hash do DataFrame de entrada e dos parâmetros, então
+a mesma série (p.ex. vinda do cache de consultas) não é serializada de novo. Nada
+aqui importa plotly: o servidor sobe sem carregar a biblioteca.
+"""
+import json
+import base64
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import metrics
+
+MAX_ITENS = 256
+LIMITE_BINARIO = 500  # a partir de quantos pontos a série numérica vai em binário
+
+_memo = OrderedDict()
+_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0}
+
+
+def _coluna(s, binario=True):
+    if pd.api.types.is_numeric_dtype(s) and not pd.api.types.is_bool_dtype(s):
+        if binario and len(s) >= LIMITE_BINARIO:
+            return {'dtype': 'f8', 'bdata': base64.b64encode(s.to_numpy(dtype='<f8', na_value=np.nan).tobytes()).decode('ascii')}
+        if pd.api.types.is_integer_dtype(s): return s.tolist()
+        return [None if v != v else round(v, 2) for v in s.astype(float).tolist()]
+    return [None if v is None or v != v else str(v) for v in s.tolist()]
+
+
+def _chave(df, colunas, meta):
+    h = hashlib.sha1(json.dumps(meta, sort_keys=True, default=str).encode('utf-8'))
+    h.update(pd.util.hash_pandas_object(df[colunas], index=False).values.tobytes())
+    return h.hexdigest()
+
+
+def _serializar(df, colunas, meta, binario=True):
+    """JSON do gráfico {**meta, campo: coluna}; colunas = {campo: nome da coluna no df}."""
+    nomes = list(colunas.values())
+    chave = _chave(df, nomes, meta)
+    with _lock:
+        if chave in _memo:
+            _memo.move_to_end(chave)
+            _stats['hits'] += 1
+            return _memo[chave]
+    with metrics.cronometro('grafico'):
+        spec = dict(meta, **{campo: _coluna(df[col], binario) for campo, col in colunas.items()})
+        # '<' escapado: o JSON vai dentro de <script> no template
+        saida = json.dumps(spec, ensure_ascii=False, separators=(',', ':')).replace('<', '\\u003c')
+    with _lock:
+        _stats['misses'] += 1
+        _memo[chave] = saida
+        while len(_memo) > MAX_ITENS: _memo.popitem(last=False)
+    return saida
+
+
+def linha(df, x, y, titulo, marcadores=True):
+    return _serializar(df, {'x': x, 'y': y}, {'tipo': 'linha', 'titulo': titulo, 'x_titulo': x, 'y_titulo': y,
+                                              'marcadores': marcadores})
+
+
+def barras(df, x, y, titulo, cor=None, texto=None):
+    """texto: texttemplate dos rótulos nas barras (p.ex. 'R$ %{y:,.2f}'), None sem rótulo."""
+    return _serializar(df, {'x': x, 'y': y}, {'tipo': 'barras', 'titulo': titulo, 'x_titulo': x, 'y_titulo': y,
+                                              'cor': cor, 'texto': texto})
+
+
+def pizza(df, valores, nomes, titulo, buraco=0):
+    return _serializar(df, {'valores': valores, 'nomes': nomes}, {'tipo': 'pizza', 'titulo': titulo, 'valores_titulo': valores,
+                                                                  'nomes_titulo': nomes, 'buraco': buraco})
+
+
+def mapa_calor(df, x, y, z, titulo, texto=None):
+    """Formato longo (uma linha por célula); o navegador monta a matriz."""
+    return _serializar(df, {'x': x, 'y': y, 'z': z}, {'tipo': 'mapa', 'titulo': titulo, 'x_titulo': x, 'y_titulo': y, 'z_titulo': z,
+                                                      'texto': texto}, binario=False)
+
+
+def stats():
+    with _lock: return dict(_stats, itens=len(_memo))
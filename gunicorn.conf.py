@@ -0,0 +1,51 @@
+# gunicorn.conf.py
+"""Servidor de produção (Linux): gunicorn -c gunicorn.conf.py wsgi:app
+
+Antes da primeira subida: flask --app app init-db
+
+Com preload_app o app é criado (app.create_app) e aquecido (app.aquecer) uma vez no
+processo mestre, antes de abrir a porta; os workers nascem por fork e compartilham
+copy-on-write os módulos pesados (pandas, pyarrow, pyodbc), os templates
+compilados, o índice de recomendação e o cache de consultas em memória. Cada worker
+abre suas próprias conexões (post_fork -> app.apos_fork).
+
+Workers, threads, endereço e timeout vêm de config.Config (WEB_*).
+
+As métricas (/metrics, /query-stats) usam o prometheus_client em modo
+multiprocesso: cada worker grava em arquivos próprios em METRICS_DIR e a leitura
+soma todos. A variável precisa existir antes do app ser importado (preload), por
+isso é definida aqui, com o diretório zerado a cada subida.
+"""
+import os
+import shutil
+
+from config import Config
+
+os.environ['PROMETHEUS_MULTIPROC_DIR'] = Config.METRICS_DIR
+shutil.rmtree(Config.METRICS_DIR, ignore_errors=True)
+os.makedirs(Config.METRICS_DIR, exist_ok=True)
+
+bind = Config.WEB_BIND
+workers = Config.WEB_WORKERS
+threads = Config.WEB_THREADS
+# gthread: as páginas passam a maior parte do tempo esperando o ERP, não a CPU
+worker_class = 'gthread' if threads > 1 else 'sync'
+timeout = Config.WEB_TIMEOUT
+graceful_timeout = 30
+keepalive = 5
+preload_app = True
+# reciclagem opcional de workers (o novo worker é um fork do mestre já aquecido)
+max_requests = Config.WEB_MAX_REQUESTS
+max_requests_jitter = Config.WEB_MAX_REQUESTS // 10
+accesslog = '-'
+
+
+def post_fork(server, worker):
+    from app import apos_fork
+    from wsgi import app
+    apos_fork(app)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,247 @@
+# jobs.py
+"""Fila local para relatórios pesados: o pedido vira um job que roda em background.
+
+Os jobs ficam numa tabela SQLite (instance/jobs.db), então qualquer processo do
+servidor consulta o andamento; o trabalho roda num pool de threads do processo que
+recebeu o pedido (as consultas esperam o ERP, não a CPU). O resultado (DataFrame)
+é gravado em Parquet e servido depois em páginas ou para download.
+
+Pedidos iguais (mesmo tipo e parâmetros) compartilham o job: `chave_ativa` é UNIQUE
+enquanto o job está na fila ou rodando, e um job concluído há menos de `ttl`
+segundos é devolvido direto, sem rodar de novo.
+
+Cada processo grava seu pid nos jobs que enfileira e, enquanto eles estão na fila
+ou rodando, uma thread de batimento renova `atualizado_em` a cada `batimento`
+segundos. O job só é dado como abandonado (liberando a chave) quando o processo
+dono não existe mais ou parou de bater por `abandono` segundos; fila longa ou
+etapa demorada sem progresso não contam.
+
+Jobs encerrados há mais de `retencao` dias (e seus arquivos) são apagados no
+aquecimento e, no máximo uma vez por hora, ao enfileirar um job novo.
+"""
+import os
+import json
+import time
+import uuid
+import hashlib
+import logging
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+from sqlalchemy import text, create_engine, bindparam
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DDL = [
+    """CREATE TABLE IF NOT EXISTS jobs (
+        id TEXT PRIMARY KEY, tipo TEXT NOT NULL, params TEXT, chave TEXT NOT NULL, chave_ativa TEXT UNIQUE,
+        status TEXT NOT NULL, progresso REAL DEFAULT 0, mensagem TEXT, erro TEXT, linhas INTEGER, pid INTEGER,
+        criado_em TEXT, iniciado_em TEXT, atualizado_em TEXT, concluido_em TEXT)""",
+    "CREATE INDEX IF NOT EXISTS ix_jobs_chave ON jobs (chave, concluido_em)",
+]
+
+
+def _agora():
+    return datetime.now().isoformat(timespec='seconds')
+
+
+def _processo_vivo(pid):
+    """False só quando o processo certamente não existe (no Windows não há como checar)."""
+    if not pid or os.name == 'nt': return True
+    try: os.kill(pid, 0)
+    except ProcessLookupError: return False
+    except PermissionError: return True
+    return True
+
+
+class JobRunner:
+    def __init__(self, caminho, dir_resultados, max_workers=2, ttl=600, abandono=900, batimento=30, retencao=7):
+        self.dir_resultados = dir_resultados
+        self.ttl = ttl
+        self.abandono = abandono
+        self.batimento = batimento
+        self.retencao = retencao
+        self.engine = create_engine(f'sqlite:///{caminho}', connect_args={'timeout': 30})
+        self._tarefas = {}
+        self.max_workers = max_workers
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self._pronto = False
+        self._ativos = set()  # jobs deste processo na fila ou rodando
+        self._lock = threading.Lock()
+        self._batedor = None
+        self._limpo_em = None
+
+    def criar_tabelas(self):
+        if self._pronto: return
+        os.makedirs(self.dir_resultados, exist_ok=True)
+        with self.engine.begin() as conn:
+            for ddl in DDL: conn.execute(text(ddl))
+        self._pronto = True
+
+    def registrar(self, tipo, funcao):
+        """funcao(params, progresso) -> DataFrame | None; progresso(fração 0..1, mensagem)."""
+        self._tarefas[tipo] = funcao
+
+    @staticmethod
+    def chave(tipo, params):
+        return hashlib.sha1(json.dumps([tipo, params], sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    def caminho_resultado(self, job_id):
+        return os.path.join(self.dir_resultados, f'{job_id}.parquet')
+
+    # ---------- submissão ----------
+    def submeter(self, tipo, params):
+        """Enfileira o job (ou devolve o job igual em andamento / concluído recente) e retorna seu estado."""
+        if tipo not in self._tarefas: raise KeyError(f'Tipo de job desconhecido: {tipo}')
+        self.criar_tabelas()
+        chave, agora = self.chave(tipo, params), datetime.now()
+        novo = uuid.uuid4().hex
+        with self._lock: self._ativos.add(novo)
+        with self.engine.begin() as conn:
+            # job cujo processo dono morreu libera a chave
+            ativo = conn.execute(text("SELECT id, pid, atualizado_em FROM jobs WHERE chave_ativa = :c"), {"c": chave}).fetchone()
+            if ativo is not None and self._abandonado(*ativo, agora):
+                conn.execute(text("UPDATE jobs SET status = 'erro', erro = 'Job abandonado', mensagem = 'Falhou', chave_ativa = NULL, "
+                                  "concluido_em = :ag WHERE id = :id"), {"id": ativo[0], "ag": agora.isoformat(timespec='seconds')})
+            feito = conn.execute(text("SELECT id, linhas FROM jobs WHERE chave = :c AND status = 'concluido' AND concluido_em >= :lim "
+                                      "ORDER BY concluido_em DESC LIMIT 1"),
+                                 {"c": chave, "lim": (agora - timedelta(seconds=self.ttl)).isoformat(timespec='seconds')}).fetchone()
+            reusar = feito is not None and (feito[1] is None or os.path.exists(self.caminho_resultado(feito[0])))
+            if not reusar:
+                conn.execute(text("INSERT OR IGNORE INTO jobs (id, tipo, params, chave, chave_ativa, status, mensagem, pid, criado_em, atualizado_em) "
+                                  "VALUES (:id, :t, :p, :c, :c, 'fila', 'Na fila', :pid, :ag, :ag)"),
+                             {"id": novo, "t": tipo, "p": json.dumps(params, default=str), "c": chave, "pid": os.getpid(), "ag": agora.isoformat(timespec='seconds')})
+            job_id = feito[0] if reusar else conn.execute(text("SELECT id FROM jobs WHERE chave_ativa = :c"), {"c": chave}).scalar()
+        if job_id == novo:
+            self._iniciar_batimento()
+            self._pool.submit(self._executar, novo, tipo, params)
+            if self._limpo_em is None or time.monotonic() - self._limpo_em > 3600:
+                try: self.limpar()
+                except Exception as e: logger.warning(f'Falha ao apagar jobs antigos: {e}')
+        else:
+            with self._lock: self._ativos.discard(novo)
+        return self.estado(job_id)
+
+    def procurar(self, tipo, params):
+        """Estado do job igual em andamento ou concluído recente, sem enfileirar nada (None se não há)."""
+        self.criar_tabelas()
+        chave, agora = self.chave(tipo, params), datetime.now()
+        with self.engine.connect() as conn:
+            job_id = conn.execute(text("SELECT id FROM jobs WHERE chave_ativa = :c"), {"c": chave}).scalar()
+            if job_id is None:
+                feito = conn.execute(text("SELECT id, linhas FROM jobs WHERE chave = :c AND status = 'concluido' AND concluido_em >= :lim "
+                                          "ORDER BY concluido_em DESC LIMIT 1"),
+                                     {"c": chave, "lim": (agora - timedelta(seconds=self.ttl)).isoformat(timespec='seconds')}).fetchone()
+                if feito is not None and (feito[1] is None or os.path.exists(self.caminho_resultado(feito[0]))): job_id = feito[0]
+        return None if job_id is None else self.estado(job_id)
+
+    def _abandonado(self, job_id, pid, atualizado_em, agora):
+        if pid == os.getpid():
+            with self._lock: return job_id not in self._ativos
+        if not _processo_vivo(pid): return True
+        # pid vivo mas sem batimento: foi reaproveitado por outro processo (ou está travado)
+        return (atualizado_em or '') < (agora - timedelta(seconds=self.abandono)).isoformat(timespec='seconds')
+
+    # ---------- batimento ----------
+    def _iniciar_batimento(self):
+        with self._lock:
+            if self._batedor is None or not self._batedor.is_alive():
+                self._batedor = threading.Thread(target=self._bater, name='job-batimento', daemon=True)
+                self._batedor.start()
+
+    def _bater(self):
+        """Renova atualizado_em dos jobs deste processo enquanto houver algum ativo."""
+        sql = text("UPDATE jobs SET atualizado_em = :ag WHERE id IN :ids AND chave_ativa IS NOT NULL").bindparams(bindparam('ids', expanding=True))
+        while True:
+            time.sleep(self.batimento)
+            with self._lock: ids = list(self._ativos)
+            if not ids: continue
+            try:
+                with self.engine.begin() as conn: conn.execute(sql, {"ag": _agora(), "ids": ids})
+            except Exception:
+                logger.warning('batimento dos jobs falhou', exc_info=True)
+
+    # ---------- execução ----------
+    def _atualizar(self, job_id, **campos):
+        campos['atualizado_em'] = _agora()
+        with self.engine.begin() as conn:
+            conn.execute(text(f"UPDATE jobs SET {', '.join(f'{c} = :{c}' for c in campos)} WHERE id = :id"), dict(campos, id=job_id))
+
+    def _progresso(self, job_id, frac, mensagem=None):
+        campos = {'progresso': round(min(max(float(frac), 0.0), 1.0), 3)}
+        if mensagem: campos['mensagem'] = mensagem
+        self._atualizar(job_id, **campos)
+
+    def _executar(self, job_id, tipo, params):
+        self._atualizar(job_id, status='rodando', iniciado_em=_agora(), mensagem='Executando')
+        try:
+            with metrics.com_rota(f'job:{tipo}'):
+                df = self._tarefas[tipo](params, lambda frac, msg=None: self._progresso(job_id, frac, msg))
+            linhas = None
+            if df is not None:
+                tmp = self.caminho_resultado(job_id) + '.tmp'
+                df.to_parquet(tmp, index=False)
+                os.replace(tmp, self.caminho_resultado(job_id))
+                linhas = len(df)
+            self._atualizar(job_id, status='concluido', progresso=1.0, mensagem='Concluído', linhas=linhas, chave_ativa=None, concluido_em=_agora())
+        except Exception as e:
+            logger.exception('job %s (%s) falhou', job_id, tipo)
+            self._atualizar(job_id, status='erro', erro=str(e), mensagem='Falhou', chave_ativa=None, concluido_em=_agora())
+        finally:
+            with self._lock: self._ativos.discard(job_id)
+
+    # ---------- consulta ----------
+    def estado(self, job_id):
+        self.criar_tabelas()
+        with self.engine.connect() as conn:
+            row = conn.execute(text("SELECT id, tipo, params, status, progresso, mensagem, erro, linhas, criado_em, iniciado_em, concluido_em "
+                                    "FROM jobs WHERE id = :id"), {"id": job_id}).mappings().fetchone()
+        if row is None: return None
+        return dict(row, params=json.loads(row['params'] or '{}'))
+
+    def resultado(self, job_id, colunas=None):
+        """DataFrame gravado pelo job (None se não concluiu ou não gerou tabela)."""
+        caminho = self.caminho_resultado(job_id)
+        return pd.read_parquet(caminho, columns=colunas) if os.path.exists(caminho) else None
+
+    def blocos(self, job_id, linhas=5000):
+        """Resultado em DataFrames de até `linhas` linhas, lido do Parquet aos poucos."""
+        import pyarrow.parquet as pq
+        arquivo = pq.ParquetFile(self.caminho_resultado(job_id))
+        if arquivo.metadata.num_rows == 0:
+            yield arquivo.schema_arrow.empty_table().to_pandas()
+            return
+        for lote in arquivo.iter_batches(batch_size=linhas):
+            yield lote.to_pandas()
+
+    def limpar(self, dias=None):
+        """Apaga jobs encerrados (e seus arquivos) com mais de `dias` dias (padrão: retencao)."""
+        self.criar_tabelas()
+        self._limpo_em, dias = time.monotonic(), self.retencao if dias is None else dias
+        limite = (datetime.now() - timedelta(days=dias)).isoformat(timespec='seconds')
+        with self.engine.begin() as conn:
+            ids = [r[0] for r in conn.execute(text("SELECT id FROM jobs WHERE chave_ativa IS NULL AND criado_em < :lim"), {"lim": limite})]
+            conn.execute(text("DELETE FROM jobs WHERE chave_ativa IS NULL AND criado_em < :lim"), {"lim": limite})
+        for job_id in ids:
+            try: os.remove(self.caminho_resultado(job_id))
+            except OSError: pass
+        return len(ids)
+
+    def stats(self):
+        self.criar_tabelas()
+        with self.engine.connect() as conn:
+            return dict(conn.execute(text("SELECT status, COUNT(*) FROM jobs GROUP BY status")).fetchall())
+
+    def apos_fork(self):
+        """Pool, batimento e conexões novos no processo filho (servidor com preload)."""
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='job')
+        self._lock = threading.Lock()
+        self._ativos, self._batedor = set(), None
+        self.engine.dispose(close=False)
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,232 @@
+# metrics.py
+"""Instrumentação de requisições e consultas, exposta em formato Prometheus (/metrics).
+
+Cada SQL executado num engine instrumentado vira uma impressão digital (texto
+normalizado, sem literais) e alimenta os histogramas de duração e de linhas por
+rota e consulta; as que passam do limite vão para o log de consultas lentas.
+A rota vem da requisição Flask ou, em threads de fundo (executor de consultas,
+jobs), do rótulo definido com `com_rota`.
+
+Os histogramas são do prometheus_client. Com PROMETHEUS_MULTIPROC_DIR definido
+(gunicorn.conf.py) cada worker grava os seus valores em arquivos próprios nesse
+diretório e /metrics e /query-stats somam todos os processos; sem ele (servidor de
+desenvolvimento, CLIs) ficam só na memória do processo. O texto de cada impressão
+digital vai, nesse modo, para um arquivo em PROMETHEUS_MULTIPROC_DIR/consultas, para
+o /query-stats de qualquer worker mostrar o SQL de consultas que só outro executou.
+"""
+import os
+import re
+import time
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+
+from prometheus_client import CollectorRegistry, Histogram, generate_latest, multiprocess
+from sqlalchemy import event
+
+log = logging.getLogger(__name__)
+log_lentas = logging.getLogger('consultas_lentas')
+
+BUCKETS_TEMPO = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+BUCKETS_LINHAS = (1, 10, 100, 1000, 10000, 100000, 1000000)
+
+_REGISTRO = CollectorRegistry()
+
+
+def _coletor():
+    """Registro lido por /metrics: o do processo ou, em modo multiprocesso, a soma dos arquivos de todos os workers."""
+    if not os.environ.get('PROMETHEUS_MULTIPROC_DIR'): return _REGISTRO
+    registro = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registro)
+    return registro
+
+
+class Histograma:
+    def __init__(self, nome, ajuda, rotulos, buckets=BUCKETS_TEMPO):
+        self.nome, self.rotulos = nome, tuple(rotulos)
+        self._h = Histogram(nome, ajuda, self.rotulos, buckets=buckets, registry=_REGISTRO)
+
+    def observar(self, valor, **rotulos):
+        self._h.labels(*(str(rotulos.get(r, '')) for r in self.rotulos)).observe(valor)
+
+    def resumo(self):
+        """{rótulos: n, soma, média} de todas as séries (somando os workers em modo multiprocesso)."""
+        series = {}
+        for familia in _coletor().collect():
+            if familia.name != self.nome: continue
+            for amostra in familia.samples:
+                campo = {f'{self.nome}_sum': 'soma', f'{self.nome}_count': 'n'}.get(amostra.name)
+                if campo is None: continue
+                chave = tuple(amostra.labels.get(r, '') for r in self.rotulos)
+                series.setdefault(chave, {'n': 0, 'soma': 0.0})[campo] += amostra.value
+        return {k: dict(v, n=int(v['n']), media=v['soma'] / v['n']) for k, v in series.items() if v['n']}
+
+    def zerar(self):
+        self._h.clear()
+
+
+REQUISICAO = Histograma('bi_requisicao_segundos', 'Duração das requisições por rota.', ['rota', 'metodo', 'status'])
+ETAPA = Histograma('bi_etapa_segundos', 'Tempo de etapas da página (consultas, template, gráficos) por rota.', ['rota', 'etapa'])
+CONSULTA = Histograma('bi_consulta_segundos', 'Duração das consultas SQL por rota e impressão digital.', ['banco', 'rota', 'consulta'])
+LINHAS = Histograma('bi_consulta_linhas', 'Linhas retornadas por consulta SQL.', ['banco', 'rota', 'consulta'], BUCKETS_LINHAS)
+HISTOGRAMAS = [REQUISICAO, ETAPA, CONSULTA, LINHAS]
+
+# impressão digital -> texto normalizado (para achar a consulta a partir do rótulo); ver texto_consulta
+CONSULTAS = {}
+
+_RE_COMENTARIO = re.compile(r'--[^\n]*|/\*.*?\*/', re.S)
+_RE_STRING = re.compile(r"N?'(?:[^']|'')*'")
+_RE_NUMERO = re.compile(r'(?<![\w@:])-?\d+(?:\.\d+)?\b')
+_RE_LISTA = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_RE_ESPACO = re.compile(r'\s+')
+
+_local = threading.local()
+config = {'lenta_ms': 1000.0}
+
+
+def normalizar(sql):
+    s = _RE_COMENTARIO.sub(' ', sql)
+    s = _RE_STRING.sub('?', s)
+    s = _RE_NUMERO.sub('?', s)
+    s = _RE_LISTA.sub('(?)', s)
+    return _RE_ESPACO.sub(' ', s).strip()
+
+
+def _pasta_consultas():
+    pasta = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    return os.path.join(pasta, 'consultas') if pasta else None
+
+
+def _guardar_texto(fp, texto):
+    """Texto da impressão digital na memória e, em modo multiprocesso, num arquivo (gravado uma vez) que todos os workers leem."""
+    CONSULTAS[fp] = texto
+    pasta = _pasta_consultas()
+    if pasta is None: return
+    caminho = os.path.join(pasta, f'{fp}.sql')
+    try:
+        if os.path.exists(caminho): return
+        os.makedirs(pasta, exist_ok=True)
+        with open(f'{caminho}.{os.getpid()}.tmp', 'w', encoding='utf-8') as f: f.write(texto)
+        os.replace(f'{caminho}.{os.getpid()}.tmp', caminho)
+    except OSError as e: log.warning(f'Falha ao gravar o texto da consulta {fp}: {e}')
+
+
+def texto_consulta(fp):
+    """SQL normalizado da impressão digital, vista neste processo ou (modo multiprocesso) em outro worker."""
+    if fp in CONSULTAS: return CONSULTAS[fp]
+    pasta = _pasta_consultas()
+    if pasta is None: return ''
+    try:
+        with open(os.path.join(pasta, f'{fp}.sql'), encoding='utf-8') as f: texto = f.read()
+    except OSError: return ''
+    CONSULTAS[fp] = texto
+    return texto
+
+
+def impressao_digital(sql):
+    texto = normalizar(sql)
+    fp = hashlib.sha1(texto.encode('utf-8')).hexdigest()[:10]
+    if fp not in CONSULTAS: _guardar_texto(fp, texto)
+    return fp
+
+
+def rota_atual():
+    from flask import has_request_context, request
+    if has_request_context(): return request.endpoint or request.path
+    return getattr(_local, 'rota', None) or threading.current_thread().name
+
+
+@contextmanager
+def com_rota(rota):
+    """Atribui as consultas desta thread à rota dada (threads de fundo não têm requisição)."""
+    anterior, _local.rota = getattr(_local, 'rota', None), rota
+    try: yield
+    finally: _local.rota = anterior
+
+
+@contextmanager
+def cronometro(etapa, rota=None):
+    t0 = time.perf_counter()
+    try: yield
+    finally: ETAPA.observar(time.perf_counter() - t0, rota=rota or rota_atual(), etapa=etapa)
+
+
+def linhas(n):
+    """Linhas devolvidas pela última consulta desta thread (contadas onde o DataFrame é montado)."""
+    ultima = getattr(_local, 'ultima', None)
+    if ultima: LINHAS.observar(n, **ultima)
+
+
+def instrumentar(engine, banco):
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _antes(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_t0', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _depois(conn, cursor, statement, parameters, context, executemany):
+        duracao = time.perf_counter() - conn.info['metrics_t0'].pop()
+        rotulos = {'banco': banco, 'rota': rota_atual(), 'consulta': impressao_digital(statement)}
+        CONSULTA.observar(duracao, **rotulos)
+        _local.ultima = rotulos
+        if cursor.rowcount is not None and cursor.rowcount >= 0 and not statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+            LINHAS.observar(cursor.rowcount, **rotulos)
+        if duracao * 1000 >= config['lenta_ms']:
+            log_lentas.warning('%.0f ms [%s] rota=%s consulta=%s params=%r :: %s', duracao * 1000, banco, rotulos['rota'],
+                               rotulos['consulta'], parameters, CONSULTAS[rotulos['consulta']][:2000])
+
+    @event.listens_for(engine, 'handle_error')
+    def _erro(ctx):
+        pilha = ctx.connection.info.get('metrics_t0') if ctx.connection is not None else None
+        if pilha: pilha.pop()
+
+
+def instrumentar_app(app):
+    """Tempo por requisição e por renderização de template (sinais do Flask)."""
+    from flask import g, request, template_rendered, before_render_template
+
+    @app.before_request
+    def _inicio_requisicao():
+        g.metrics_t0 = time.perf_counter()
+
+    @app.after_request
+    def _fim_requisicao(resposta):
+        t0 = g.pop('metrics_t0', None)
+        if t0 is not None and request.endpoint != 'static':
+            REQUISICAO.observar(time.perf_counter() - t0, rota=request.endpoint or 'desconhecida', metodo=request.method, status=resposta.status_code)
+        return resposta
+
+    def _antes_template(sender, template, context, **extra):
+        g.metrics_template_t0 = time.perf_counter()
+
+    def _depois_template(sender, template, context, **extra):
+        t0 = g.pop('metrics_template_t0', None)
+        if t0 is not None: ETAPA.observar(time.perf_counter() - t0, rota=rota_atual(), etapa='template')
+
+    before_render_template.connect(_antes_template, app, weak=False)
+    template_rendered.connect(_depois_template, app, weak=False)
+
+
+def zerar():
+    """Descarta as observações herdadas (worker recém-criado não reporta o aquecimento do processo pai).
+    Em modo multiprocesso não faz nada: o worker já começa em arquivos próprios (o aquecimento fica nos do
+    mestre) e o prometheus_client não implementa clear() nesse modo."""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'): return
+    for h in HISTOGRAMAS: h.zerar()
+
+
+def exportar():
+    return generate_latest(_coletor()).decode('utf-8')
+
+
+def consultas_resumo(limite=50):
+    """Consultas ordenadas pelo tempo total, com o texto normalizado."""
+    por_fp = {}
+    for (banco, rota, fp), r in CONSULTA.resumo().items():
+        item = por_fp.setdefault(fp, {'consulta': fp, 'banco': banco, 'n': 0, 'total_s': 0.0, 'rotas': [], 'sql': texto_consulta(fp)})
+        item['n'] += r['n']
+        item['total_s'] += r['soma']
+        item['rotas'].append(rota)
+    resumo = sorted(por_fp.values(), key=lambda i: i['total_s'], reverse=True)[:limite]
+    for item in resumo: item['media_ms'] = item['total_s'] / item['n'] * 1000
+    return resumo
@@ -0,0 +1,121 @@
+# pagination.py
+"""Paginação, ordenação e filtro no servidor para os relatórios tabulares.
+
+O SQL do relatório (sem ORDER BY) vira tabela derivada `r`; a página sai com
+ORDER BY + OFFSET/FETCH. Com cursor (`apos`) a paginação é por keyset: a coluna de
+ordenação mais a chave do relatório formam uma comparação lexicográfica, então a
+página N custa o mesmo que a primeira. `pagina_df` aplica as mesmas regras a um
+DataFrame (caminho dos rollups).
+
+NULL vale menos que qualquer valor (a ordem do SQL Server: primeiro no ASC, por
+último no DESC); o keyset compara com IS NULL / IS NOT NULL para não perder essas linhas.
+"""
+import json
+import base64
+
+import pandas as pd
+
+LIMITE_PADRAO, LIMITE_MAX = 100, 1000
+
+
+def _cursor(valores):
+    return base64.urlsafe_b64encode(json.dumps(valores, default=str).encode('utf-8')).decode('ascii')
+
+
+def _valor(v):
+    """Valor da linha para o cursor, sem arredondar: escalar numpy vira o tipo Python, NaN/NaT vira None."""
+    if v is None or (not isinstance(v, str) and pd.isna(v)): return None
+    return v.item() if hasattr(v, 'item') else v
+
+
+def _ler_cursor(cursor):
+    try: return json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, TypeError): return None
+
+
+def ler_pedido(args, colunas, ordem_padrao):
+    """Lê ordem/dir/limite/pagina/apos/filtro da query string, aceitando só colunas conhecidas."""
+    ordem = args.get('ordem', ordem_padrao)
+    if ordem not in colunas: ordem = ordem_padrao
+    try: limite = min(max(int(args.get('limite', LIMITE_PADRAO)), 1), LIMITE_MAX)
+    except ValueError: limite = LIMITE_PADRAO
+    try: pagina = max(int(args.get('pagina', 1)), 1)
+    except ValueError: pagina = 1
+    apos = _ler_cursor(args['apos']) if args.get('apos') else None
+    return {'ordem': ordem, 'desc': args.get('dir', 'asc').lower() == 'desc', 'limite': limite, 'pagina': pagina,
+            'apos': apos, 'filtro': args.get('filtro', '').strip()}
+
+
+def _colunas_ordem(pedido, chave):
+    return [pedido['ordem']] + [c for c in chave if c != pedido['ordem']]
+
+
+def sql_pagina(sql_base, params, pedido, chave, colunas_filtro=()):
+    """SQL da página pedida (uma linha a mais para saber se há próxima)."""
+    p, where = dict(params), []
+    ordem = _colunas_ordem(pedido, chave)
+    if pedido['filtro'] and colunas_filtro:
+        where.append('(' + ' OR '.join(f'r.[{c}] LIKE :_filtro' for c in colunas_filtro) + ')')
+        p['_filtro'] = f"%{pedido['filtro']}%"
+    apos = pedido['apos'] if pedido['apos'] and len(pedido['apos']) == len(ordem) else None
+    if apos:
+        def igual(j, c): return f'r.[{c}] IS NULL' if apos[j] is None else f'r.[{c}] = :_k{j}'
+        def depois(i, c):
+            if i == 0 and pedido['desc']: return '1 = 0' if apos[i] is None else f'(r.[{c}] < :_k{i} OR r.[{c}] IS NULL)'
+            return f'r.[{c}] IS NOT NULL' if apos[i] is None else f'r.[{c}] > :_k{i}'
+        termos = ['(' + ' AND '.join([igual(j, c) for j, c in enumerate(ordem[:i])] + [depois(i, col)]) + ')' for i, col in enumerate(ordem)]
+        where.append('(' + ' OR '.join(termos) + ')')
+        p.update({f'_k{i}': v for i, v in enumerate(apos) if v is not None})
+    order_by = ', '.join(f'r.[{c}]' + (' DESC' if i == 0 and pedido['desc'] else '') for i, c in enumerate(ordem))
+    p['_offset'] = 0 if apos else (pedido['pagina'] - 1) * pedido['limite']
+    p['_limite'] = pedido['limite'] + 1
+    sql = f"SELECT r.* FROM ({sql_base}) r"
+    if where: sql += ' WHERE ' + ' AND '.join(where)
+    return sql + f" ORDER BY {order_by} OFFSET :_offset ROWS FETCH NEXT :_limite ROWS ONLY", p
+
+
+def sql_totais(sql_base, agregados):
+    """Agregados do relatório inteiro numa única linha, sem trazer as linhas para o Python."""
+    return "SELECT " + ', '.join(f'{expr} AS [{nome}]' for nome, expr in agregados.items()) + f" FROM ({sql_base}) r"
+
+
+def sql_ordenado(sql_base, colunas):
+    """Relatório inteiro ordenado (exportação). O ORDER BY vai na tabela derivada `r`:
+    direto no SQL agrupado os nomes de coluna ficam ambíguos entre os joins."""
+    return f"SELECT r.* FROM ({sql_base}) r ORDER BY " + ', '.join(f'r.[{c}]' for c in colunas)
+
+
+def pagina_df(df, pedido, chave, colunas_filtro=()):
+    """Mesma semântica de sql_pagina sobre um DataFrame já calculado."""
+    ordem = _colunas_ordem(pedido, chave)
+    if pedido['filtro'] and colunas_filtro:
+        mask = pd.Series(False, index=df.index)
+        for c in colunas_filtro: mask |= df[c].astype(str).str.contains(pedido['filtro'], case=False, regex=False)
+        df = df[mask]
+    # NULL antes dos valores em cada coluna (depois, na primeira coluna em DESC), como no SQL
+    presentes = {f'_n{i}': df[c].notna() for i, c in enumerate(ordem)}
+    asc = [not pedido['desc']] + [True] * (len(ordem) - 1)
+    chaves = [k for i, c in enumerate(ordem) for k in (f'_n{i}', c)]
+    df = df.assign(**presentes).sort_values(chaves, ascending=[a for a in asc for _ in (0, 1)])[df.columns]
+    apos = pedido['apos'] if pedido['apos'] and len(pedido['apos']) == len(ordem) else None
+    if apos:
+        depois, iguais = pd.Series(False, index=df.index), pd.Series(True, index=df.index)
+        for i, (col, v) in enumerate(zip(ordem, apos)):
+            s = df[col]
+            if i == 0 and pedido['desc']: passou = pd.Series(False, index=df.index) if v is None else (s < v) | s.isna()
+            else: passou = s.notna() if v is None else s > v
+            depois |= iguais & passou
+            iguais &= s.isna() if v is None else s == v
+        df = df[depois]
+    else:
+        df = df.iloc[(pedido['pagina'] - 1) * pedido['limite']:]
+    return df.head(pedido['limite'] + 1)
+
+
+def resposta_pagina(df, pedido, chave):
+    """JSON da página: linhas, cursor da próxima página (ou None) e a ordenação aplicada."""
+    ordem = _colunas_ordem(pedido, chave)
+    linhas = json.loads(df.head(pedido['limite']).to_json(orient='records', date_format='iso'))
+    # o cursor sai da linha original: o to_json arredonda floats e a comparação do keyset repetiria linhas
+    proximo = _cursor([_valor(df[c].iloc[pedido['limite'] - 1]) for c in ordem]) if len(df) > pedido['limite'] else None
+    return {'linhas': linhas, 'proximo': proximo, 'ordem': pedido['ordem'], 'dir': 'desc' if pedido['desc'] else 'asc'}
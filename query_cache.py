@@ -0,0 +1,195 @@
+# query_cache.py
+"""Cache de resultados das consultas somente-leitura do ERP.
+
+Chave = texto SQL + parâmetros + versão da configuração do ERP; cada classe de
+consulta tem seu TTL. Quando a conexão do ERP muda, a versão nova faz as entradas
+antigas (em qualquer processo ou backend) deixarem de ser lidas e expirarem sozinhas.
+O DataFrame devolvido carrega em df.attrs['as_of'] o momento em que foi lido do banco.
+"""
+import os
+import glob
+import time
+import pickle
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+import pandas as pd
+
+import metrics
+
+# TTL (segundos) por classe de consulta
+TTL_PADRAO = {
+    'vendedores': 600,   # listas de VENDE, mudam raramente
+    'kpi': 120,          # totais do mês corrente
+    'evolucao': 3600,    # séries de 12 meses: meses fechados não mudam
+    'relatorio': 300,
+    'padrao': 60,
+}
+
+
+def _tamanho(df):
+    try: return int(df.memory_usage(deep=True).sum())
+    except Exception: return len(pickle.dumps(df))
+
+
+class MemoryBackend:
+    """LRU em processo com limite de memória (bytes)."""
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._dados = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, chave):
+        with self._lock:
+            item = self._dados.get(chave)
+            if item is None: return None
+            if item[0] < time.time():
+                self._remover(chave)
+                return None
+            self._dados.move_to_end(chave)
+            return item[1]
+
+    def set(self, chave, valor, ttl):
+        tam = _tamanho(valor)
+        if tam > self.max_bytes: return
+        with self._lock:
+            if chave in self._dados: self._remover(chave)
+            self._dados[chave] = (time.time() + ttl, valor, tam)
+            self._bytes += tam
+            while self._bytes > self.max_bytes and self._dados:
+                self._remover(next(iter(self._dados)))
+
+    def delete_prefix(self, prefixo=''):
+        with self._lock:
+            for chave in [c for c in self._dados if c.startswith(prefixo)]: self._remover(chave)
+
+    def _remover(self, chave):
+        self._bytes -= self._dados.pop(chave)[2]
+
+    def stats(self):
+        return {'backend': 'memory', 'itens': len(self._dados), 'bytes': self._bytes, 'max_bytes': self.max_bytes}
+
+
+class FileBackend:
+    """Backend compartilhado entre processos: um pickle por chave num diretório local."""
+
+    def __init__(self, diretorio, max_bytes=256 * 1024 * 1024):
+        self.diretorio = diretorio
+        self.max_bytes = max_bytes
+        os.makedirs(diretorio, exist_ok=True)
+
+    def _caminho(self, chave):
+        return os.path.join(self.diretorio, chave.replace(':', '-') + '.pkl')
+
+    def get(self, chave):
+        caminho = self._caminho(chave)
+        try:
+            with open(caminho, 'rb') as f: expira, valor = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError): return None
+        if expira < time.time():
+            try: os.remove(caminho)
+            except OSError: pass
+            return None
+        os.utime(caminho)  # mtime = último acesso, usado na evicção LRU
+        return valor
+
+    def set(self, chave, valor, ttl):
+        caminho = self._caminho(chave)
+        tmp = f'{caminho}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f: pickle.dump((time.time() + ttl, valor), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, caminho)
+        self._evict()
+
+    def delete_prefix(self, prefixo=''):
+        for caminho in glob.glob(os.path.join(self.diretorio, prefixo.replace(':', '-') + '*.pkl')):
+            try: os.remove(caminho)
+            except OSError: pass
+
+    def _arquivos(self):
+        arquivos = []
+        for caminho in glob.glob(os.path.join(self.diretorio, '*.pkl')):
+            try: st = os.stat(caminho)
+            except OSError: continue
+            arquivos.append((st.st_mtime, st.st_size, caminho))
+        return arquivos
+
+    def _evict(self):
+        arquivos = self._arquivos()
+        total = sum(a[1] for a in arquivos)
+        for _, tam, caminho in sorted(arquivos):
+            if total <= self.max_bytes: break
+            try: os.remove(caminho); total -= tam
+            except OSError: pass
+
+    def stats(self):
+        arquivos = self._arquivos()
+        return {'backend': 'file', 'itens': len(arquivos), 'bytes': sum(a[1] for a in arquivos), 'max_bytes': self.max_bytes}
+
+
+class RedisBackend:
+    """Backend compartilhado via Redis local; a expiração fica a cargo do próprio Redis."""
+
+    def __init__(self, url='redis://localhost:6379/0', namespace='vfbi:'):
+        import redis
+        self._r = redis.Redis.from_url(url)
+        self.namespace = namespace
+
+    def get(self, chave):
+        bruto = self._r.get(self.namespace + chave)
+        return pickle.loads(bruto) if bruto is not None else None
+
+    def set(self, chave, valor, ttl):
+        self._r.setex(self.namespace + chave, int(ttl), pickle.dumps(valor, protocol=pickle.HIGHEST_PROTOCOL))
+
+    def delete_prefix(self, prefixo=''):
+        for chave in self._r.scan_iter(f'{self.namespace}{prefixo}*'): self._r.delete(chave)
+
+    def stats(self):
+        return {'backend': 'redis', 'itens': sum(1 for _ in self._r.scan_iter(f'{self.namespace}*'))}
+
+
+class QueryCache:
+    def __init__(self, backend=None, ttls=None):
+        self.backend = backend or MemoryBackend()
+        self.ttls = dict(TTL_PADRAO, **(ttls or {}))
+        self.hits = self.misses = 0
+        self.versao = ''
+
+    @classmethod
+    def from_config(cls, config):
+        tipo = config.get('QUERY_CACHE_BACKEND', 'memory')
+        max_bytes = int(config.get('QUERY_CACHE_MAX_MB', 64)) * 1024 * 1024
+        if tipo == 'file': backend = FileBackend(config.get('QUERY_CACHE_DIR', 'instance/query_cache'), max_bytes)
+        elif tipo == 'redis': backend = RedisBackend(config.get('QUERY_CACHE_URL', 'redis://localhost:6379/0'))
+        else: backend = MemoryBackend(max_bytes)
+        return cls(backend)
+
+    @staticmethod
+    def chave(sql, params=None, classe='padrao', versao=''):
+        bruto = f'{versao}|' + str(sql) + '|' + repr(sorted((params or {}).items()))
+        return f"{classe}:{hashlib.sha1(bruto.encode('utf-8')).hexdigest()}"
+
+    def read_sql(self, sql, con, params=None, classe='padrao'):
+        """pd.read_sql com cache; df.attrs['as_of'] indica quando o dado saiu do ERP."""
+        chave = self.chave(sql, params, classe, self.versao)
+        df = self.backend.get(chave)
+        if df is not None:
+            self.hits += 1
+            return df.copy()
+        self.misses += 1
+        df = pd.read_sql(sql, con, params=params)
+        metrics.linhas(len(df))
+        df.attrs['as_of'] = datetime.now()
+        # o backend em memória guarda o próprio objeto: a view recebe uma cópia para poder alterá-la
+        self.backend.set(chave, df, self.ttls.get(classe, self.ttls['padrao']))
+        return df.copy()
+
+    def invalidate(self, classe=None):
+        self.backend.delete_prefix(f'{classe}:' if classe else '')
+
+    def stats(self):
+        return dict(self.backend.stats(), hits=self.hits, misses=self.misses)
@@ -0,0 +1,69 @@
+# query_executor.py
+"""Execução concorrente de consultas independentes de uma mesma página.
+
+Cada consulta roda numa thread do pool com sua própria conexão do engine; a página
+espera no máximo `deadline` segundos e segue com o que já chegou (as consultas que
+estouraram o prazo ou falharam ficam de fora do resultado e são logadas). O tempo de
+cada consulta e a espera da página vão para bi_etapa_segundos (etapa 'consulta:<nome>'
+e 'consultas') e para o log em nível INFO.
+"""
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import pandas as pd
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class QueryExecutor:
+    def __init__(self, max_workers=6, deadline=20.0):
+        self.deadline = deadline
+        self.max_workers = max_workers
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='erp-query')
+
+    def _executar(self, engine, nome, consulta, rota):
+        t0 = time.perf_counter()
+        try:
+            with metrics.com_rota(rota):
+                if callable(consulta): return consulta()
+                sql, params = consulta if isinstance(consulta, tuple) else (consulta, None)
+                with engine.connect() as conn:
+                    df = pd.read_sql(sql, conn, params=params)
+                metrics.linhas(len(df))
+                return df
+        finally:
+            dt = time.perf_counter() - t0
+            metrics.ETAPA.observar(dt, rota=rota, etapa=f'consulta:{nome}')
+            logger.info('consulta %s: %.1f ms', nome, dt * 1000)
+
+    def run(self, engine, consultas, deadline=None):
+        """consultas: {nome: sql | (sql, params) | callable()} -> ({nome: resultado}, [nomes sem resultado])."""
+        t0 = time.perf_counter()
+        rota = metrics.rota_atual()
+        futuros = {self._pool.submit(self._executar, engine, nome, c, rota): nome for nome, c in consultas.items()}
+        prontos, atrasados = wait(futuros, timeout=self.deadline if deadline is None else deadline)
+        resultados, faltando = {}, []
+        for fut in prontos:
+            nome = futuros[fut]
+            try: resultados[nome] = fut.result()
+            except Exception as e:
+                logger.error('consulta %s falhou: %s', nome, e)
+                faltando.append(nome)
+        for fut in atrasados:
+            fut.cancel()
+            faltando.append(futuros[fut])
+        if atrasados: logger.warning('prazo da página estourado; sem resultado para: %s', ', '.join(futuros[f] for f in atrasados))
+        dt = time.perf_counter() - t0
+        metrics.ETAPA.observar(dt, rota=rota, etapa='consultas')
+        logger.info('%d consultas em %.1f ms', len(consultas), dt * 1000)
+        return resultados, faltando
+
+    def apos_fork(self):
+        """Pool novo no processo filho: threads do processo pai não sobrevivem ao fork."""
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='erp-query')
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,181 @@
+# recebiveis.py
+"""Carteira de contas a receber (CTREC) de todos os clientes, calculada de uma vez.
+
+Os títulos em aberto são lidos em blocos de colunas (cliente, vencimento, saldo) e
+cada bloco é agregado com numpy: o atraso vira uma faixa de aging (searchsorted) e
+os saldos são somados por cliente x faixa num único bincount. As somas parciais dos
+blocos se juntam no fim, e a tabela por cliente ganha limite de crédito, uso do
+limite e inadimplência (vencido / em aberto).
+
+O resultado vale para o dia de referência (o aging muda com a data): fica num
+pickle, recarregado quando outro processo o regera, e é refeito uma vez por dia
+(job 'recebiveis' ou cron). Uso:
+
+    python recebiveis.py build
+"""
+import os
+import pickle
+import argparse
+import threading
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+SQL_TITULOS = "SELECT Cod_Cliente, Dat_Vencimento, Vlr_Saldo FROM CTREC WHERE Status IN ('A','P') AND Vlr_Saldo > 0"
+SQL_CLIENTES = "SELECT Codigo, Razao_Social, Limite_Credito FROM clien"
+
+# faixas de aging por dias de atraso: <= 0, 1-30, 31-60, 61-90, > 90
+LIMITES_FAIXAS = np.array([0, 30, 60, 90])
+FAIXAS = ['a_vencer', 'vencido_1_30', 'vencido_31_60', 'vencido_61_90', 'vencido_90']
+NOMES_FAIXAS = {'a_vencer': 'A vencer', 'vencido_1_30': '1-30 dias', 'vencido_31_60': '31-60 dias',
+                'vencido_61_90': '61-90 dias', 'vencido_90': '+90 dias'}
+
+
+def _agregar(bloco, referencia):
+    """Somas de um bloco de títulos por cliente: saldo por faixa, quantidades e maior atraso."""
+    cods, pos = np.unique(bloco['Cod_Cliente'].astype(str).str.strip().to_numpy(), return_inverse=True)
+    saldo = bloco['Vlr_Saldo'].to_numpy(dtype=np.float64)
+    venc = pd.to_datetime(bloco['Dat_Vencimento']).to_numpy(dtype='datetime64[D]')
+    atraso = np.where(np.isnat(venc), 0, (referencia - venc).astype(np.int64))
+    faixa = np.searchsorted(LIMITES_FAIXAS, atraso)
+    n, k = len(cods), len(FAIXAS)
+    parte = pd.DataFrame(np.bincount(pos * k + faixa, weights=saldo, minlength=n * k).reshape(n, k), index=cods, columns=FAIXAS)
+    parte['qtd_titulos'] = np.bincount(pos, minlength=n)
+    parte['qtd_vencidos'] = np.bincount(pos, weights=atraso > 0, minlength=n)
+    maior = np.zeros(n, dtype=np.int64)
+    np.maximum.at(maior, pos, atraso)
+    parte['maior_atraso'] = maior
+    return parte
+
+
+def calcular(blocos, df_clientes, referencia):
+    """Tabela por cliente com títulos em aberto (índice = código do cliente como texto)."""
+    ref = np.datetime64(referencia, 'D')
+    partes = [_agregar(b, ref) for b in blocos if not b.empty]
+    if partes:
+        somas = dict.fromkeys(FAIXAS + ['qtd_titulos', 'qtd_vencidos'], 'sum')
+        df = pd.concat(partes).groupby(level=0).agg(dict(somas, maior_atraso='max'))
+    else:
+        df = pd.DataFrame(columns=FAIXAS + ['qtd_titulos', 'qtd_vencidos', 'maior_atraso'], dtype=np.float64)
+    df[['qtd_titulos', 'qtd_vencidos', 'maior_atraso']] = df[['qtd_titulos', 'qtd_vencidos', 'maior_atraso']].astype(np.int64)
+    df['total_aberto'] = df[FAIXAS].sum(axis=1)
+    df['total_vencido'] = df[FAIXAS[1:]].sum(axis=1)
+    df['inadimplencia'] = (df['total_vencido'] / df['total_aberto'].where(df['total_aberto'] > 0) * 100).fillna(0.0)
+
+    cli = df_clientes.assign(Codigo=df_clientes['Codigo'].astype(str).str.strip()).drop_duplicates('Codigo').set_index('Codigo')
+    df['razao_social'] = cli['Razao_Social'].reindex(df.index).fillna('').astype(str).str.strip()
+    df['limite'] = pd.to_numeric(cli['Limite_Credito'].reindex(df.index), errors='coerce').fillna(0.0)
+    df['saldo_disponivel'] = df['limite'] - df['total_aberto']
+    df['uso_limite'] = (df['total_aberto'] / df['limite'].where(df['limite'] > 0) * 100).astype(np.float64)
+    df.index.name = 'codigo'
+    return df
+
+
+class CarteiraRecebiveis:
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self._estado = None
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    # ---------- construção ----------
+    def construir(self, erp, referencia=None, bloco=50000, progresso=None):
+        referencia = referencia or date.today()
+        with erp.connect() as conn:
+            if progresso: progresso(0.05, 'Lendo clientes')
+            df_clientes = pd.read_sql(text(SQL_CLIENTES), conn)
+            if progresso: progresso(0.2, 'Lendo títulos em aberto')
+            df = calcular(pd.read_sql(text(SQL_TITULOS), conn, chunksize=bloco), df_clientes, referencia)
+        self._estado = {'clientes': df, 'total_clientes': len(df_clientes), 'referencia': referencia, 'gerado_em': datetime.now()}
+        self._estado['resumo'] = self._resumir()
+
+    def _resumir(self):
+        est = self._estado
+        df = est['clientes']
+        aberto, vencido = float(df['total_aberto'].sum()), float(df['total_vencido'].sum())
+        return {
+            'total_aberto': aberto, 'total_vencido': vencido, 'inadimplencia': vencido / aberto * 100 if aberto else 0.0,
+            'faixas': {f: float(df[f].sum()) for f in FAIXAS},
+            'clientes_com_titulos': len(df), 'clientes_inadimplentes': int((df['total_vencido'] > 0).sum()),
+            'clientes_acima_limite': int((df['uso_limite'] > 100).sum()), 'total_clientes': est['total_clientes'],
+            'referencia': est['referencia'], 'gerado_em': est['gerado_em'],
+        }
+
+    # ---------- persistência ----------
+    def salvar(self):
+        tmp = f'{self.caminho}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f: pickle.dump(self._estado, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self.caminho)
+        self._mtime = os.path.getmtime(self.caminho)
+
+    def _carregar(self):
+        """Recarrega do disco quando o arquivo foi regerado por outro processo (job ou CLI)."""
+        try: mtime = os.path.getmtime(self.caminho)
+        except OSError: return self._estado
+        if mtime != self._mtime:
+            with self._lock:
+                if mtime != self._mtime:
+                    with open(self.caminho, 'rb') as f: self._estado = pickle.load(f)
+                    self._mtime = mtime
+        return self._estado
+
+    def pronto(self):
+        return self._carregar() is not None
+
+    def vencida(self, hoje=None):
+        """True quando não há carteira ou ela é de um dia anterior (aging desatualizado)."""
+        est = self._carregar()
+        return est is None or est['referencia'] < (hoje or date.today())
+
+    def info(self):
+        est = self._carregar()
+        return {} if est is None else {k: v for k, v in est['resumo'].items() if k != 'faixas'}
+
+    # ---------- consulta ----------
+    def resumo(self):
+        est = self._carregar()
+        return est['resumo'] if est is not None else {}
+
+    def cliente(self, cod_cliente):
+        """Situação de um cliente; None se ele não tem títulos em aberto."""
+        est = self._carregar()
+        if est is None: return None
+        df = est['clientes']
+        cod = str(cod_cliente).strip()
+        return None if cod not in df.index else dict(df.loc[cod].to_dict(), codigo=cod)
+
+    def faixas(self):
+        """Saldo por faixa de aging (Faixa, Valor) para o gráfico."""
+        faixas = self.resumo().get('faixas', {})
+        return pd.DataFrame({'Faixa': [NOMES_FAIXAS[f] for f in faixas], 'Valor': list(faixas.values())})
+
+    def ranking(self, coluna='total_vencido', n=10):
+        """Top n clientes pela coluna (p.ex. total_vencido, uso_limite, maior_atraso), só os com valor > 0."""
+        est = self._carregar()
+        if est is None: return []
+        df = est['clientes']
+        return df[df[coluna] > 0].nlargest(n, coluna).reset_index().to_dict('records')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Carteira de contas a receber (CTREC)')
+    sub = parser.add_subparsers(dest='comando', required=True)
+    sub.add_parser('build', help='Recalcula a carteira de todos os clientes com a data de hoje')
+    args = parser.parse_args()
+
+    import app as bi
+    app = bi.create_app()
+    recebiveis = bi.recebiveis
+    with app.app_context():
+        erp = bi.get_sql_engine()
+        if erp is None: raise SystemExit('Banco do ERP não configurado (/config-db).')
+        if args.comando == 'build':
+            recebiveis.construir(erp, bloco=app.config['RECEBIVEIS_CHUNK_ROWS'])
+            recebiveis.salvar()
+    print('Carteira a receber:', recebiveis.info())
+
+
+if __name__ == '__main__':
+    main()
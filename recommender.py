@@ -0,0 +1,189 @@
+# recommender.py
+"""Sugestões de venda por co-compra (item-item), pré-calculadas fora da requisição.
+
+Monta a matriz esparsa cliente x produto (CSR) das compras da janela, calcula por
+fabricante a similaridade de cosseno entre produtos comprados pelos mesmos clientes
+e guarda os top-K vizinhos de cada produto. Servir as sugestões de um cliente é só
+somar os vizinhos dos produtos que ele já compra. Uso:
+
+    python recommender.py build [--meses 12]   # reconstrução completa (noturna)
+    python recommender.py refresh              # soma as compras dos dias desde o último build/refresh
+"""
+import os
+import pickle
+import argparse
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sqlalchemy import text
+
+SQL_COMPRAS = """
+    SELECT cb.Cod_Cliente AS cod_cliente, it.Cod_Produto AS cod_produto, pr.Cod_Fabricante AS cod_fabricante, SUM(ISNULL(it.Qtd_Produto, 0)) AS qtd
+    FROM NFSIT it
+    INNER JOIN NFSCB cb ON it.Num_Nota = cb.Num_Nota AND it.Ser_Nota = cb.Ser_Nota AND it.Cod_Estabe = cb.Cod_Estabe
+    INNER JOIN PRODU pr ON it.Cod_Produto = pr.Codigo
+    WHERE cb.Status = 'F' AND cb.Dat_Emissao >= :d1 AND cb.Dat_Emissao < :d2
+    GROUP BY cb.Cod_Cliente, it.Cod_Produto, pr.Cod_Fabricante
+"""
+
+
+def carregar_compras(erp, d1, d2, rollups=None):
+    """Compras cliente x produto em [d1, d2) e nomes dos produtos; usa os rollups quando cobrem a janela."""
+    if rollups is not None and rollups.cobre(d1, d2 - timedelta(days=1)):
+        return rollups.compras_cliente_produto(d1, d2 - timedelta(days=1)), rollups.produtos()
+    with erp.connect() as conn:
+        df = pd.read_sql(text(SQL_COMPRAS), conn, params={"d1": d1, "d2": d2})
+        nomes = pd.read_sql(text("SELECT Codigo AS codigo, Descricao AS descricao FROM PRODU"), conn)
+    return df, nomes
+
+
+class Recommender:
+    def __init__(self, caminho, top_k=20):
+        self.caminho = caminho
+        self.top_k = top_k
+        self._estado = None
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    # ---------- construção ----------
+    def construir(self, df_compras, df_nomes, inicio, watermark):
+        df = df_compras.assign(cod_cliente=df_compras['cod_cliente'].astype(str).str.strip())
+        self._estado = {
+            'clientes': pd.Index([], dtype=object), 'produtos': pd.Index([], dtype=object), 'fabricante': np.array([], dtype=object),
+            'X': sparse.csr_matrix((0, 0), dtype=np.float64), 'vizinhos': {}, 'nomes': {},
+            'inicio': inicio, 'watermark': watermark,
+        }
+        self._somar(df, df_nomes)
+        self._calcular_vizinhos(set(self._estado['fabricante']))
+        self._estado['gerado_em'] = datetime.now()
+
+    def atualizar(self, df_novas, df_nomes, watermark):
+        """Soma compras novas à matriz e recalcula só os fabricantes afetados."""
+        if self._carregar() is None: raise RuntimeError('Índice de recomendação vazio: rode o build primeiro.')
+        df = df_novas.assign(cod_cliente=df_novas['cod_cliente'].astype(str).str.strip())
+        self._somar(df, df_nomes)
+        self._calcular_vizinhos(set(df['cod_fabricante']))
+        self._estado['watermark'] = watermark
+        self._estado['gerado_em'] = datetime.now()
+
+    def _somar(self, df, df_nomes):
+        est = self._estado
+        df = df.groupby(['cod_cliente', 'cod_produto', 'cod_fabricante'], as_index=False)['qtd'].sum()
+        novos_cli = pd.Index(df['cod_cliente'].unique()).difference(est['clientes'])
+        novos_prod = df.drop_duplicates('cod_produto').set_index('cod_produto')['cod_fabricante']
+        novos_prod = novos_prod[~novos_prod.index.isin(est['produtos'])]
+        # no primeiro build o índice nasce direto dos novos (append num Index vazio gera FutureWarning no pandas)
+        clientes = est['clientes'].append(novos_cli) if len(est['clientes']) else pd.Index(novos_cli)
+        produtos = est['produtos'].append(novos_prod.index) if len(est['produtos']) else pd.Index(novos_prod.index)
+        fabricante = np.concatenate([est['fabricante'], novos_prod.to_numpy(dtype=object)])
+
+        antigo = est['X'].tocoo()
+        linhas = np.concatenate([antigo.row, clientes.get_indexer(df['cod_cliente'])])
+        colunas = np.concatenate([antigo.col, produtos.get_indexer(df['cod_produto'])])
+        valores = np.concatenate([antigo.data, df['qtd'].to_numpy(dtype=np.float64)])
+        est['X'] = sparse.csr_matrix((valores, (linhas, colunas)), shape=(len(clientes), len(produtos)))
+        est.update(clientes=clientes, produtos=produtos, fabricante=fabricante)
+        est['nomes'].update(dict(zip(df_nomes['codigo'], df_nomes['descricao'].astype(str).str.strip())))
+
+    def _calcular_vizinhos(self, fabricantes):
+        est = self._estado
+        B = (est['X'] > 0).astype(np.float32).tocsc()
+        produtos, vizinhos = est['produtos'], est['vizinhos']
+        for fab in fabricantes:
+            idx = np.flatnonzero(est['fabricante'] == fab)
+            C = (B[:, idx].T @ B[:, idx]).tocsr()  # co-ocorrência entre produtos do fabricante
+            freq = C.diagonal()
+            C.setdiag(0)
+            C.eliminate_zeros()
+            for i in range(C.shape[0]):
+                ini, fim = C.indptr[i], C.indptr[i + 1]
+                if ini == fim:
+                    vizinhos.pop(produtos[idx[i]], None)
+                    continue
+                cols = C.indices[ini:fim]
+                score = C.data[ini:fim] / np.sqrt(freq[i] * freq[cols])
+                top = np.argsort(-score)[:self.top_k]
+                vizinhos[produtos[idx[i]]] = [(produtos[idx[cols[t]]], float(score[t])) for t in top]
+
+    # ---------- persistência ----------
+    def salvar(self):
+        tmp = f'{self.caminho}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f: pickle.dump(self._estado, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self.caminho)
+        self._mtime = os.path.getmtime(self.caminho)
+
+    def _carregar(self):
+        """Recarrega do disco quando o arquivo foi regerado por outro processo (CLI)."""
+        try: mtime = os.path.getmtime(self.caminho)
+        except OSError: return self._estado
+        if mtime != self._mtime:
+            with self._lock:
+                if mtime != self._mtime:
+                    with open(self.caminho, 'rb') as f: self._estado = pickle.load(f)
+                    self._mtime = mtime
+        return self._estado
+
+    def pronto(self):
+        return self._carregar() is not None
+
+    def info(self):
+        est = self._carregar()
+        if est is None: return {}
+        return {'clientes': len(est['clientes']), 'produtos': len(est['produtos']), 'com_vizinhos': len(est['vizinhos']),
+                'inicio': est['inicio'], 'watermark': est['watermark'], 'gerado_em': est['gerado_em']}
+
+    # ---------- consulta ----------
+    def sugeridos(self, cod_cliente, n=5):
+        """Top-n produtos que o cliente ainda não compra, no formato 'Produto (Base: Produto comprado)'."""
+        est = self._carregar()
+        if est is None: return []
+        pos = est['clientes'].get_indexer([str(cod_cliente).strip()])[0]
+        if pos < 0: return []
+        linha = est['X'].getrow(pos)
+        comprados = set(est['produtos'][linha.indices])
+        score, base = defaultdict(float), {}
+        for p in est['produtos'][linha.indices[np.argsort(-linha.data)]]:
+            for viz, s in est['vizinhos'].get(p, []):
+                if viz in comprados: continue
+                score[viz] += s
+                if viz not in base or s > base[viz][1]: base[viz] = (p, s)
+        nomes = est['nomes']
+        melhores = sorted(score, key=score.get, reverse=True)[:n]
+        return [f"{nomes.get(v, v)} (Base: {nomes.get(base[v][0], base[v][0])})" for v in melhores]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Índice de recomendação por co-compra')
+    sub = parser.add_subparsers(dest='comando', required=True)
+    bd = sub.add_parser('build', help='Reconstrói o índice com a janela completa')
+    bd.add_argument('--meses', type=int, help='Janela de compras em meses (padrão: RECOMENDACAO_MESES)')
+    sub.add_parser('refresh', help='Soma as compras desde o último build/refresh')
+    args = parser.parse_args()
+
+    import app as bi
+    app = bi.create_app()
+    rollups, recommender = bi.rollups, bi.recommender
+    with app.app_context():
+        erp = bi.get_sql_engine()
+        if erp is None: raise SystemExit('Banco do ERP não configurado (/config-db).')
+        hoje = datetime.combine(datetime.now().date(), datetime.min.time())
+        if args.comando == 'build':
+            inicio = (hoje - pd.DateOffset(months=args.meses or app.config['RECOMENDACAO_MESES'])).to_pydatetime()
+            df, nomes = carregar_compras(erp, inicio, hoje, rollups)
+            recommender.construir(df, nomes, inicio, hoje)
+        else:
+            info = recommender.info()
+            if not info: raise SystemExit('Índice vazio: rode o build primeiro.')
+            if info['watermark'] >= hoje: raise SystemExit('Índice já está atualizado.')
+            df, nomes = carregar_compras(erp, info['watermark'], hoje, rollups)
+            recommender.atualizar(df, nomes, hoje)
+        recommender.salvar()
+    print('Índice de recomendação:', recommender.info())
+
+
+if __name__ == '__main__':
+    main()
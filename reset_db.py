@@ -1,5 +1,7 @@
 # reset_db.py
-from app import app, db, DatabaseConfig, User
+from app import create_app, db, DatabaseConfig, User
+
+app = create_app()
 
 def reset_database():
     with app.app_context():
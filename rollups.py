@@ -0,0 +1,500 @@
+# rollups.py
+"""Agregados diários de NFSCB/NFSIT materializados num SQLite local.
+
+As colunas de código não têm tipo declarado: o SQLite guarda o valor como veio do
+ERP, e os merges com VECPR/VECOT comparam tipos iguais.
+
+Grãos:
+  notas_dia      -> dia x estabelecimento x vendedor x cliente (valor das notas)
+  vendas_dia     -> dia x estabelecimento x vendedor x cliente x produto x fabricante (itens)
+  clientes_ciclo -> estabelecimento x cliente (primeira/última compra, valor e notas da vida
+                    toda, janelas móveis de 90 dias e 12 meses, segmento RFM)
+
+O ciclo de vida soma clientes_historico (tudo antes do início do rollup, lido do ERP
+uma vez) com notas_dia; a cada carga só os clientes dos dias recarregados são
+recalculados. As janelas móveis e os segmentos são refeitos localmente no fim de
+cada backfill/refresh (precisam de pelo menos 12 meses de notas_dia).
+
+Carga incremental: a cada refresh os últimos dias (lookback) são recarregados por
+inteiro, junto com qualquer dia que tenha recebido nota com Num_Nota acima do
+último watermark. Só entram dias fechados: o watermark é no máximo hoje, então o
+dia corrente (ainda recebendo notas) nunca vai para notas_dia/vendas_dia.
+
+Dia aberto: quando o período pedido chega a hoje, `atualizar_aberto` lê do ERP só as
+notas de hoje (as mesmas consultas da carga, limitadas a um dia) para notas_aberto e
+vendas_aberto, no máximo uma vez a cada `ttl` segundos. As views `notas` e `vendas`
+juntam os dias fechados com o dia aberto (só linhas a partir do watermark, então uma
+cópia de um dia já fechado nunca conta duas vezes) e são elas que as rotas consultam. Uso:
+
+    python rollups.py backfill --desde 2023-01-01
+    python rollups.py refresh [--lookback 3]
+"""
+import argparse
+import threading
+from datetime import datetime, timedelta, date
+
+import pandas as pd
+from sqlalchemy import text, create_engine, bindparam
+
+SQL_NOTAS = """
+    SELECT CAST(cb.Dat_Emissao AS DATE) AS data, cb.Cod_Estabe AS cod_estabe, cb.Cod_Vendedor AS cod_vendedor, cb.Cod_Cliente AS cod_cliente,
+           COUNT(*) AS qtd_notas, SUM(ISNULL(cb.Vlr_TotalNota, 0)) AS vlr_total
+    FROM NFSCB cb
+    WHERE cb.Status = 'F' AND cb.Dat_Emissao >= :d1 AND cb.Dat_Emissao < :d2
+    GROUP BY CAST(cb.Dat_Emissao AS DATE), cb.Cod_Estabe, cb.Cod_Vendedor, cb.Cod_Cliente
+"""
+
+SQL_ITENS = """
+    SELECT CAST(cb.Dat_Emissao AS DATE) AS data, cb.Cod_Estabe AS cod_estabe, cb.Cod_Vendedor AS cod_vendedor, cb.Cod_Cliente AS cod_cliente,
+           it.Cod_Produto AS cod_produto, pr.Cod_Fabricante AS cod_fabricante,
+           SUM(ISNULL(it.Qtd_Produto, 0)) AS qtd_produto, SUM(ISNULL(it.Qtd_Bonificacao, 0)) AS qtd_bonificacao,
+           SUM(ISNULL(it.Vlr_LiqItem, 0) - ISNULL(it.Vlr_SubsTrib, 0) - ISNULL(it.Vlr_SbtRes, 0)) AS vlr_liquido,
+           COUNT(DISTINCT cb.Num_Nota) AS qtd_notas
+    FROM NFSCB cb
+    INNER JOIN NFSIT it ON cb.Num_Nota = it.Num_Nota AND cb.Ser_Nota = it.Ser_Nota AND cb.Cod_Estabe = it.Cod_Estabe
+    INNER JOIN PRODU pr ON it.Cod_Produto = pr.Codigo
+    WHERE cb.Status = 'F' AND cb.Dat_Emissao >= :d1 AND cb.Dat_Emissao < :d2
+    GROUP BY CAST(cb.Dat_Emissao AS DATE), cb.Cod_Estabe, cb.Cod_Vendedor, cb.Cod_Cliente, it.Cod_Produto, pr.Cod_Fabricante
+"""
+
+SQL_HISTORICO = """
+    SELECT cb.Cod_Estabe AS cod_estabe, cb.Cod_Cliente AS cod_cliente,
+           CAST(MIN(cb.Dat_Emissao) AS DATE) AS primeira_compra, CAST(MAX(cb.Dat_Emissao) AS DATE) AS ultima_compra,
+           COUNT(*) AS qtd_notas, SUM(ISNULL(cb.Vlr_TotalNota, 0)) AS vlr_total
+    FROM NFSCB cb
+    WHERE cb.Status = 'F' AND cb.Dat_Emissao < :d1
+    GROUP BY cb.Cod_Estabe, cb.Cod_Cliente
+"""
+
+SQL_DIMENSOES = {
+    'produtos': "SELECT Codigo AS codigo, Descricao AS descricao, Cod_Fabricante AS cod_fabricante FROM PRODU",
+    'fabricantes': "SELECT Codigo AS codigo, Fantasia AS fantasia FROM FABRI",
+    'vendedores': "SELECT Codigo AS codigo, Nome_Guerra AS nome_guerra FROM VENDE",
+}
+
+DDL = [
+    """CREATE TABLE IF NOT EXISTS notas_dia (
+        data TEXT NOT NULL, cod_estabe, cod_vendedor, cod_cliente,
+        qtd_notas INTEGER, vlr_total REAL)""",
+    "CREATE INDEX IF NOT EXISTS ix_notas_dia_data ON notas_dia (data, cod_estabe)",
+    "CREATE INDEX IF NOT EXISTS ix_notas_dia_cliente ON notas_dia (cod_cliente, data)",
+    """CREATE TABLE IF NOT EXISTS vendas_dia (
+        data TEXT NOT NULL, cod_estabe, cod_vendedor, cod_cliente, cod_produto, cod_fabricante,
+        qtd_produto REAL, qtd_bonificacao REAL, vlr_liquido REAL, qtd_notas INTEGER)""",
+    "CREATE INDEX IF NOT EXISTS ix_vendas_dia_data ON vendas_dia (data, cod_vendedor)",
+    "CREATE INDEX IF NOT EXISTS ix_vendas_dia_cliente ON vendas_dia (cod_cliente, data)",
+    """CREATE TABLE IF NOT EXISTS clientes_historico (
+        cod_estabe, cod_cliente, primeira_compra TEXT, ultima_compra TEXT, qtd_notas INTEGER, vlr_total REAL,
+        PRIMARY KEY (cod_estabe, cod_cliente))""",
+    """CREATE TABLE IF NOT EXISTS clientes_ciclo (
+        cod_estabe, cod_cliente, primeira_compra TEXT, ultima_compra TEXT, qtd_notas INTEGER, vlr_total REAL,
+        notas_90d INTEGER DEFAULT 0, vlr_90d REAL DEFAULT 0, notas_12m INTEGER DEFAULT 0, vlr_12m REAL DEFAULT 0, segmento TEXT,
+        PRIMARY KEY (cod_estabe, cod_cliente))""",
+    "CREATE INDEX IF NOT EXISTS ix_ciclo_primeira ON clientes_ciclo (cod_estabe, primeira_compra)",
+    "CREATE INDEX IF NOT EXISTS ix_ciclo_ultima ON clientes_ciclo (cod_estabe, ultima_compra)",
+    "CREATE INDEX IF NOT EXISTS ix_ciclo_segmento ON clientes_ciclo (cod_estabe, segmento)",
+    "CREATE TABLE IF NOT EXISTS rollup_estado (chave TEXT PRIMARY KEY, valor TEXT)",
+    # dia corrente, relido do ERP a cada poucos segundos (atualizar_aberto)
+    """CREATE TABLE IF NOT EXISTS notas_aberto (
+        data TEXT NOT NULL, cod_estabe, cod_vendedor, cod_cliente,
+        qtd_notas INTEGER, vlr_total REAL)""",
+    """CREATE TABLE IF NOT EXISTS vendas_aberto (
+        data TEXT NOT NULL, cod_estabe, cod_vendedor, cod_cliente, cod_produto, cod_fabricante,
+        qtd_produto REAL, qtd_bonificacao REAL, vlr_liquido REAL, qtd_notas INTEGER)""",
+    """CREATE VIEW IF NOT EXISTS notas AS
+        SELECT * FROM notas_dia UNION ALL
+        SELECT * FROM notas_aberto WHERE data >= (SELECT valor FROM rollup_estado WHERE chave = 'watermark')""",
+    """CREATE VIEW IF NOT EXISTS vendas AS
+        SELECT * FROM vendas_dia UNION ALL
+        SELECT * FROM vendas_aberto WHERE data >= (SELECT valor FROM rollup_estado WHERE chave = 'watermark')""",
+]
+
+# ordem de exibição; 'Perdidos' = sem compra em 12 meses
+SEGMENTOS = ['Campeões', 'Fiéis', 'Novos', 'Regulares', 'Em risco', 'Hibernando', 'Perdidos']
+
+# quintis de recência (última compra), frequência (notas em 12m) e valor (12m) entre quem comprou no último ano
+SQL_SEGMENTOS = """
+    UPDATE clientes_ciclo AS c SET segmento = s.segmento FROM (
+        SELECT cod_estabe, cod_cliente, CASE
+                 WHEN primeira_compra > :d90 THEN 'Novos'
+                 WHEN r >= 4 AND f >= 4 AND m >= 4 THEN 'Campeões'
+                 WHEN r >= 3 AND f >= 3 THEN 'Fiéis'
+                 WHEN r <= 2 AND (f >= 4 OR m >= 4) THEN 'Em risco'
+                 WHEN r <= 2 THEN 'Hibernando'
+                 ELSE 'Regulares' END AS segmento
+        FROM (SELECT cod_estabe, cod_cliente, primeira_compra,
+                     NTILE(5) OVER (PARTITION BY cod_estabe ORDER BY ultima_compra) AS r,
+                     NTILE(5) OVER (PARTITION BY cod_estabe ORDER BY notas_12m) AS f,
+                     NTILE(5) OVER (PARTITION BY cod_estabe ORDER BY vlr_12m) AS m
+              FROM clientes_ciclo WHERE notas_12m > 0)
+    ) AS s
+    WHERE c.cod_estabe = s.cod_estabe AND c.cod_cliente = s.cod_cliente
+"""
+
+
+def _dia(d):
+    return d.date() if isinstance(d, datetime) else d
+
+
+class RollupStore:
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self.engine = create_engine(f'sqlite:///{caminho}')
+        self._lock_aberto = threading.Lock()
+
+    def criar_tabelas(self):
+        with self.engine.begin() as conn:
+            for ddl in DDL: conn.execute(text(ddl))
+
+    # ---------- estado / watermark ----------
+    def _set_estado(self, conn, chave, valor):
+        conn.execute(text("INSERT OR REPLACE INTO rollup_estado (chave, valor) VALUES (:c, :v)"), {"c": chave, "v": str(valor)})
+
+    def estado(self):
+        try:
+            with self.engine.connect() as conn:
+                return dict(conn.execute(text("SELECT chave, valor FROM rollup_estado")).fetchall())
+        except Exception: return {}
+
+    def cobertura(self):
+        """(primeiro_dia, ultimo_dia) carregados, ou None se o rollup ainda não existe."""
+        est = self.estado()
+        if 'inicio' not in est or 'watermark' not in est: return None
+        return (date.fromisoformat(est['inicio']), date.fromisoformat(est['watermark']) - timedelta(days=1))
+
+    def cobre(self, d1, d2, com_aberto=False):
+        """Dias [d1, d2] carregados. Com `com_aberto`, um período até hoje (ou depois) é coberto quando os
+        dias fechados vão até ontem: o resto vem do dia aberto (atualizar_aberto)."""
+        cob = self.cobertura()
+        if not cob or _dia(d1) < cob[0]: return False
+        hoje = _dia(datetime.now())
+        if com_aberto and _dia(d2) >= hoje: return cob[1] >= hoje - timedelta(days=1)
+        return _dia(d2) <= cob[1]
+
+    def ciclo_cobre(self, ate):
+        """Ciclo de vida dos clientes montado e atualizado até `ate`."""
+        cob = self.cobertura()
+        return bool(cob) and 'ciclo_referencia' in self.estado() and _dia(ate) <= cob[1]
+
+    # ---------- carga ----------
+    def _carregar_dias(self, erp, d1, d2, ciclo=True):
+        """Substitui no rollup os dias [d1, d2) pelo que está hoje no ERP (e recalcula o ciclo dos clientes afetados)."""
+        p = {"d1": datetime.combine(d1, datetime.min.time()), "d2": datetime.combine(d2, datetime.min.time())}
+        with erp.connect() as conn:
+            df_notas = pd.read_sql(text(SQL_NOTAS), conn, params=p)
+            df_itens = pd.read_sql(text(SQL_ITENS), conn, params=p)
+        for df in (df_notas, df_itens):
+            df['data'] = pd.to_datetime(df['data']).dt.strftime('%Y-%m-%d')
+        faixa = {"d1": d1.isoformat(), "d2": d2.isoformat()}
+        tocados = "INSERT INTO _tocados SELECT DISTINCT cod_estabe, cod_cliente FROM notas_dia WHERE data >= :d1 AND data < :d2"
+        with self.engine.begin() as conn:
+            if ciclo:
+                # clientes com nota antes ou depois da recarga (nota cancelada também muda o ciclo)
+                conn.execute(text("CREATE TEMP TABLE IF NOT EXISTS _tocados (cod_estabe, cod_cliente)"))
+                conn.execute(text("DELETE FROM _tocados"))
+                conn.execute(text(tocados), faixa)
+            for tabela in ('notas_dia', 'vendas_dia'):
+                conn.execute(text(f"DELETE FROM {tabela} WHERE data >= :d1 AND data < :d2"), faixa)
+            df_notas.to_sql('notas_dia', conn, if_exists='append', index=False)
+            df_itens.to_sql('vendas_dia', conn, if_exists='append', index=False)
+            if ciclo:
+                conn.execute(text(tocados), faixa)
+                self._recalcular_ciclo(conn, so_tocados=True)
+        return len(df_notas), len(df_itens)
+
+    def atualizar_aberto(self, erp, ttl=60):
+        """Relê do ERP as notas de hoje para notas_aberto/vendas_aberto se a cópia é de outro dia ou
+        tem mais de `ttl` segundos. Devolve o momento da leitura em uso."""
+        hoje = _dia(datetime.now())
+        with self._lock_aberto:
+            est = self.estado()
+            lido_em = datetime.fromisoformat(est['aberto_em']) if est.get('aberto_dia') == hoje.isoformat() else None
+            if lido_em is not None and (datetime.now() - lido_em).total_seconds() < ttl: return lido_em
+            p = {"d1": datetime.combine(hoje, datetime.min.time()), "d2": datetime.combine(hoje + timedelta(days=1), datetime.min.time())}
+            self.criar_tabelas()
+            lido_em = datetime.now()
+            with erp.connect() as conn:
+                df_notas = pd.read_sql(text(SQL_NOTAS), conn, params=p)
+                df_itens = pd.read_sql(text(SQL_ITENS), conn, params=p)
+            for df in (df_notas, df_itens):
+                df['data'] = pd.to_datetime(df['data']).dt.strftime('%Y-%m-%d')
+            with self.engine.begin() as conn:
+                for tabela, df in (('notas_aberto', df_notas), ('vendas_aberto', df_itens)):
+                    conn.execute(text(f"DELETE FROM {tabela}"))
+                    df.to_sql(tabela, conn, if_exists='append', index=False)
+                self._set_estado(conn, 'aberto_dia', hoje.isoformat())
+                self._set_estado(conn, 'aberto_em', lido_em.isoformat(timespec='seconds'))
+            return lido_em
+
+    def _descartar_desde(self, conn, dia):
+        """Remove as linhas de `dia` em diante e recalcula o ciclo dos clientes que as tinham."""
+        faixa = {"d": dia.isoformat()}
+        conn.execute(text("CREATE TEMP TABLE IF NOT EXISTS _tocados (cod_estabe, cod_cliente)"))
+        conn.execute(text("DELETE FROM _tocados"))
+        conn.execute(text("INSERT INTO _tocados SELECT DISTINCT cod_estabe, cod_cliente FROM notas_dia WHERE data >= :d"), faixa)
+        for tabela in ('notas_dia', 'vendas_dia'):
+            conn.execute(text(f"DELETE FROM {tabela} WHERE data >= :d"), faixa)
+        self._recalcular_ciclo(conn, so_tocados=True)
+
+    def _carregar_historico(self, erp, inicio):
+        """Resumo por cliente de tudo antes do início do rollup: a única leitura do histórico inteiro no ERP."""
+        with erp.connect() as conn:
+            df = pd.read_sql(text(SQL_HISTORICO), conn, params={"d1": datetime.combine(inicio, datetime.min.time())})
+        for col in ('primeira_compra', 'ultima_compra'):
+            df[col] = pd.to_datetime(df[col]).dt.strftime('%Y-%m-%d')
+        with self.engine.begin() as conn:
+            conn.execute(text("DELETE FROM clientes_historico"))
+            df.to_sql('clientes_historico', conn, if_exists='append', index=False)
+        return len(df)
+
+    def _recalcular_ciclo(self, conn, so_tocados=False):
+        """clientes_ciclo = clientes_historico + notas_dia, para todos ou só para os clientes em _tocados."""
+        junta = "INNER JOIN (SELECT DISTINCT cod_estabe, cod_cliente FROM _tocados) t USING (cod_estabe, cod_cliente)" if so_tocados else ""
+        if so_tocados: conn.execute(text("DELETE FROM clientes_ciclo WHERE (cod_estabe, cod_cliente) IN (SELECT cod_estabe, cod_cliente FROM _tocados)"))
+        else: conn.execute(text("DELETE FROM clientes_ciclo"))
+        conn.execute(text(f"""
+            INSERT INTO clientes_ciclo (cod_estabe, cod_cliente, primeira_compra, ultima_compra, qtd_notas, vlr_total)
+            SELECT cod_estabe, cod_cliente, MIN(p), MAX(u), SUM(n), SUM(v) FROM (
+                SELECT cod_estabe, cod_cliente, primeira_compra AS p, ultima_compra AS u, qtd_notas AS n, vlr_total AS v
+                FROM clientes_historico {junta}
+                UNION ALL
+                SELECT cod_estabe, cod_cliente, MIN(data), MAX(data), SUM(qtd_notas), SUM(vlr_total)
+                FROM notas_dia {junta} GROUP BY cod_estabe, cod_cliente)
+            GROUP BY cod_estabe, cod_cliente"""))
+
+    def _atualizar_janelas(self, conn, ref):
+        """Totais de 90 dias / 12 meses até `ref` e segmentos RFM de todos os clientes."""
+        d90, d12 = (ref - timedelta(days=90)).isoformat(), (ref - timedelta(days=365)).isoformat()
+        conn.execute(text("UPDATE clientes_ciclo SET notas_90d = 0, vlr_90d = 0, notas_12m = 0, vlr_12m = 0, "
+                          "segmento = CASE WHEN ultima_compra > :d12 THEN 'Regulares' ELSE 'Perdidos' END"), {"d12": d12})
+        conn.execute(text("""
+            UPDATE clientes_ciclo AS c SET notas_90d = j.n90, vlr_90d = j.v90, notas_12m = j.n12, vlr_12m = j.v12
+            FROM (SELECT cod_estabe, cod_cliente,
+                         SUM(CASE WHEN data > :d90 THEN qtd_notas ELSE 0 END) AS n90, SUM(CASE WHEN data > :d90 THEN vlr_total ELSE 0 END) AS v90,
+                         SUM(qtd_notas) AS n12, SUM(vlr_total) AS v12
+                  FROM notas_dia WHERE data > :d12 AND data <= :ref GROUP BY cod_estabe, cod_cliente) AS j
+            WHERE c.cod_estabe = j.cod_estabe AND c.cod_cliente = j.cod_cliente"""), {"d90": d90, "d12": d12, "ref": ref.isoformat()})
+        conn.execute(text(SQL_SEGMENTOS), {"d90": d90})
+        self._set_estado(conn, 'ciclo_referencia', ref.isoformat())
+
+    def _carregar_dimensoes(self, erp):
+        with erp.connect() as conn:
+            dims = {nome: pd.read_sql(text(sql), conn) for nome, sql in SQL_DIMENSOES.items()}
+        with self.engine.begin() as conn:
+            for nome, df in dims.items(): df.to_sql(nome, conn, if_exists='replace', index=False)
+
+    def _max_num_nota(self, erp):
+        with erp.connect() as conn:
+            return conn.execute(text("SELECT MAX(Num_Nota) FROM NFSCB")).scalar() or 0
+
+    def backfill(self, erp, desde, ate=None, log=print):
+        """Carga completa mês a mês de `desde` até `ate` (padrão e limite: ontem, o último dia fechado)."""
+        self.criar_tabelas()
+        hoje = _dia(datetime.now())
+        desde, ate = _dia(desde), min(_dia(ate) + timedelta(days=1), hoje) if ate else hoje
+        max_nota = self._max_num_nota(erp)
+        log(f'antes de {desde}: {self._carregar_historico(erp, desde)} clientes em clientes_historico')
+        ini = desde
+        while ini < ate:
+            fim = min((ini.replace(day=1) + timedelta(days=32)).replace(day=1), ate)
+            n, i = self._carregar_dias(erp, ini, fim, ciclo=False)
+            log(f'{ini:%Y-%m}: {n} linhas em notas_dia, {i} em vendas_dia')
+            ini = fim
+        self._carregar_dimensoes(erp)
+        with self.engine.begin() as conn:
+            self._recalcular_ciclo(conn)
+            self._atualizar_janelas(conn, ate - timedelta(days=1))
+            self._set_estado(conn, 'inicio', desde.isoformat())
+            self._set_estado(conn, 'watermark', ate.isoformat())
+            self._set_estado(conn, 'max_num_nota', max_nota)
+            self._set_estado(conn, 'atualizado_em', datetime.now().isoformat(timespec='seconds'))
+
+    def refresh(self, erp, lookback_dias=3, log=print):
+        """Recarrega os últimos `lookback_dias` e os dias que receberam notas novas."""
+        est = self.estado()
+        if 'watermark' not in est: raise RuntimeError('Rollup vazio: rode o backfill primeiro.')
+        self.criar_tabelas()
+        hoje = _dia(datetime.now())  # limite exclusivo: o dia corrente fica fora até fechar
+        recarga = min(date.fromisoformat(est['watermark']), hoje) - timedelta(days=lookback_dias)
+        max_nota_ant = int(float(est.get('max_num_nota') or 0))
+        max_nota = self._max_num_nota(erp)
+        if 'ciclo_referencia' not in est:
+            # rollup criado antes do ciclo de vida: monta uma vez a partir do histórico
+            log(f"antes de {est['inicio']}: {self._carregar_historico(erp, date.fromisoformat(est['inicio']))} clientes em clientes_historico")
+            with self.engine.begin() as conn: self._recalcular_ciclo(conn)
+
+        # notas emitidas com data anterior à janela de recarga (lançamentos atrasados)
+        with erp.connect() as conn:
+            atrasados = conn.execute(text("SELECT DISTINCT CAST(Dat_Emissao AS DATE) FROM NFSCB WHERE Num_Nota > :n AND Dat_Emissao < :d"),
+                                     {"n": max_nota_ant, "d": datetime.combine(recarga, datetime.min.time())}).fetchall()
+        inicio = date.fromisoformat(est['inicio'])
+        for (dia,) in atrasados:
+            dia = pd.Timestamp(dia).date()
+            if dia >= inicio:
+                self._carregar_dias(erp, dia, dia + timedelta(days=1))
+                log(f'{dia}: recarregado (nota atrasada)')
+
+        n, i = self._carregar_dias(erp, recarga, hoje)
+        log(f'{recarga} a {hoje - timedelta(days=1)}: {n} linhas em notas_dia, {i} em vendas_dia')
+        self._carregar_dimensoes(erp)
+        with self.engine.begin() as conn:
+            # rollup gravado com o dia corrente (watermark antigo, amanhã): descarta as linhas do dia ainda aberto
+            if date.fromisoformat(est['watermark']) > hoje: self._descartar_desde(conn, hoje)
+            self._atualizar_janelas(conn, hoje - timedelta(days=1))
+            self._set_estado(conn, 'watermark', hoje.isoformat())
+            self._set_estado(conn, 'max_num_nota', max_nota)
+            self._set_estado(conn, 'atualizado_em', datetime.now().isoformat(timespec='seconds'))
+
+    # ---------- consultas usadas pelas rotas ----------
+    def read_sql(self, sql, params=None):
+        with self.engine.connect() as conn:
+            return pd.read_sql(text(sql), conn, params=params)
+
+    def evolucao_faturamento(self, meses=12, cod_estabe=0):
+        df = self.read_sql("""
+            SELECT substr(data, 1, 4) || '/' || substr(data, 6, 2) AS Periodo, SUM(vlr_total) AS Total
+            FROM notas WHERE cod_estabe = :e GROUP BY 1 ORDER BY 1 DESC LIMIT :n""", {"e": cod_estabe, "n": meses})
+        return df.sort_values('Periodo')
+
+    def evolucao_clientes(self, d1, d2):
+        return self.read_sql("""
+            SELECT substr(data, 1, 4) || '/' || substr(data, 6, 2) AS Periodo, COUNT(DISTINCT cod_cliente) AS Total_Clientes
+            FROM notas WHERE data BETWEEN :d1 AND :d2 GROUP BY 1 ORDER BY 1""",
+            {"d1": _dia(d1).isoformat(), "d2": _dia(d2).isoformat()})
+
+    def vendas_vendedor_produto(self, d1, d2, cod_vendedor=None):
+        sql = """
+            SELECT cod_vendedor AS Cod_Vendedor, cod_produto AS Cod_Produto,
+                   SUM(qtd_produto + qtd_bonificacao) AS Unidades_Vendidas, SUM(vlr_liquido) AS VlrLiq
+            FROM vendas WHERE data BETWEEN :d1 AND :d2"""
+        p = {"d1": _dia(d1).isoformat(), "d2": _dia(d2).isoformat()}
+        if cod_vendedor is not None: sql += " AND cod_vendedor = :cv"; p["cv"] = cod_vendedor
+        return self.read_sql(sql + " GROUP BY cod_vendedor, cod_produto", p)
+
+    def vendas_vendedor_fabricante(self, d1, d2, cod_vendedor=None):
+        sql = """
+            SELECT CAST(substr(v.data, 1, 4) AS INTEGER) AS Ano, CAST(substr(v.data, 6, 2) AS INTEGER) AS Mes,
+                   v.cod_fabricante AS Cod_Fabricante, fb.fantasia AS Fantasia, v.cod_vendedor AS CodVen, ve.nome_guerra AS Nome_Guerra,
+                   SUM(v.qtd_produto + v.qtd_bonificacao) AS Unidades_Vendidas
+            FROM vendas v
+            INNER JOIN fabricantes fb ON fb.codigo = v.cod_fabricante
+            INNER JOIN vendedores ve ON ve.codigo = v.cod_vendedor
+            WHERE v.data BETWEEN :d1 AND :d2"""
+        p = {"d1": _dia(d1).isoformat(), "d2": _dia(d2).isoformat()}
+        if cod_vendedor is not None: sql += " AND v.cod_vendedor = :cv"; p["cv"] = cod_vendedor
+        return self.read_sql(sql + " GROUP BY 1, 2, v.cod_fabricante, fb.fantasia, v.cod_vendedor, ve.nome_guerra", p)
+
+    def kpis_mes(self, ref, cod_estabe=0):
+        """Faturamento, notas e clientes do mês de `ref` até hoje e faturamento do mês anterior (cards do dashboard)."""
+        mes = _dia(ref).replace(day=1)
+        anterior = (mes - timedelta(days=1)).replace(day=1)
+        return self.read_sql("""
+            SELECT SUM(CASE WHEN data >= :m THEN vlr_total ELSE 0 END) AS atual,
+                   SUM(CASE WHEN data < :m THEN vlr_total ELSE 0 END) AS anterior,
+                   SUM(CASE WHEN data >= :m THEN qtd_notas ELSE 0 END) AS qtd_pedidos,
+                   COUNT(DISTINCT CASE WHEN data >= :m THEN cod_cliente END) AS clientes_ativos
+            FROM notas WHERE data >= :a AND cod_estabe = :e""", {"m": mes.isoformat(), "a": anterior.isoformat(), "e": cod_estabe})
+
+    def top_vendedores(self, desde, n=5):
+        return self.read_sql("""
+            SELECT ve.nome_guerra AS Nome_Guerra, SUM(n.vlr_total) AS Total
+            FROM notas n INNER JOIN vendedores ve ON ve.codigo = n.cod_vendedor
+            WHERE n.data >= :d GROUP BY ve.nome_guerra ORDER BY Total DESC LIMIT :n""", {"d": _dia(desde).isoformat(), "n": n})
+
+    def compras_cliente_produto(self, d1, d2):
+        return self.read_sql("""
+            SELECT cod_cliente, cod_produto, cod_fabricante, SUM(qtd_produto) AS qtd
+            FROM vendas_dia WHERE data BETWEEN :d1 AND :d2 GROUP BY cod_cliente, cod_produto, cod_fabricante""",
+            {"d1": _dia(d1).isoformat(), "d2": _dia(d2).isoformat()})
+
+    def produtos(self):
+        return self.read_sql("SELECT codigo, descricao FROM produtos")
+
+    # ---------- clientes (visão geral de analise_cliente) ----------
+    def clientes_ativos(self, d1, d2, cod_estabe=0):
+        return self.read_sql("SELECT COUNT(DISTINCT cod_cliente) AS total FROM notas WHERE data BETWEEN :d1 AND :d2 AND cod_estabe = :e",
+                             {"d1": _dia(d1).isoformat(), "d2": _dia(d2).isoformat(), "e": cod_estabe})
+
+    def ticket_medio(self, d1, d2, cod_estabe=0):
+        return self.read_sql("SELECT SUM(vlr_total) / SUM(qtd_notas) AS t FROM notas WHERE data BETWEEN :d1 AND :d2 AND cod_estabe = :e",
+                             {"d1": _dia(d1).isoformat(), "d2": _dia(d2).isoformat(), "e": cod_estabe})
+
+    def novos_clientes(self, d1, d2, cod_estabe=0):
+        """Primeira compra em [d1, d2]: o ciclo de vida (dias fechados) mais quem comprou pela primeira vez no dia aberto."""
+        return self.read_sql("""
+            SELECT (SELECT COUNT(*) FROM clientes_ciclo WHERE cod_estabe = :e AND primeira_compra BETWEEN :d1 AND :d2)
+                 + (SELECT COUNT(DISTINCT a.cod_cliente) FROM notas_aberto a
+                    WHERE a.cod_estabe = :e AND a.data BETWEEN :d1 AND :d2
+                      AND a.data >= (SELECT valor FROM rollup_estado WHERE chave = 'watermark')
+                      AND NOT EXISTS (SELECT 1 FROM clientes_ciclo c WHERE c.cod_estabe = a.cod_estabe AND c.cod_cliente = a.cod_cliente)) AS novos""",
+                             {"d1": _dia(d1).isoformat(), "d2": _dia(d2).isoformat(), "e": cod_estabe})
+
+    def clientes_inativos(self, ref, dias=90, cod_estabe=0):
+        return self.read_sql("SELECT COUNT(*) AS inat FROM clientes_ciclo WHERE cod_estabe = :e AND ultima_compra < :lim",
+                             {"lim": (_dia(ref) - timedelta(days=dias)).isoformat(), "e": cod_estabe})
+
+    def segmentos(self, cod_estabe=0):
+        df = self.read_sql("""
+            SELECT segmento AS Segmento, COUNT(*) AS Clientes, SUM(vlr_12m) AS Valor_12m
+            FROM clientes_ciclo WHERE cod_estabe = :e GROUP BY segmento""", {"e": cod_estabe})
+        ordem = {s: i for i, s in enumerate(SEGMENTOS)}
+        return df.sort_values('Segmento', key=lambda s: s.map(ordem)).reset_index(drop=True)
+
+    def coortes(self, desde, cod_estabe=0):
+        """Retenção mensal (%) das coortes de primeira compra a partir de `desde` (formato longo: Coorte, Mes, Clientes, Retencao)."""
+        df = self.read_sql("""
+            SELECT substr(c.primeira_compra, 1, 4) || '/' || substr(c.primeira_compra, 6, 2) AS Coorte,
+                   (CAST(substr(n.data, 1, 4) AS INTEGER) - CAST(substr(c.primeira_compra, 1, 4) AS INTEGER)) * 12
+                   + CAST(substr(n.data, 6, 2) AS INTEGER) - CAST(substr(c.primeira_compra, 6, 2) AS INTEGER) AS Mes,
+                   COUNT(DISTINCT c.cod_cliente) AS Clientes
+            FROM clientes_ciclo c
+            INNER JOIN notas_dia n ON n.cod_cliente = c.cod_cliente AND n.cod_estabe = c.cod_estabe
+            WHERE c.cod_estabe = :e AND c.primeira_compra >= :d1
+            GROUP BY 1, 2 ORDER BY 1, 2""", {"d1": max(_dia(desde), self.cobertura()[0]).isoformat(), "e": cod_estabe})
+        tamanho = df[df['Mes'] == 0].set_index('Coorte')['Clientes']
+        df['Retencao'] = (df['Clientes'] / df['Coorte'].map(tamanho) * 100).round(1)
+        return df
+
+    def total_clientes(self, codigos, d1, d2):
+        """Faturamento no período só dos clientes pedidos (codigo, total)."""
+        if not codigos: return pd.DataFrame(columns=['codigo', 'total'])
+        sql = text("SELECT cod_cliente AS codigo, SUM(vlr_total) AS total FROM notas WHERE cod_cliente IN :c AND data BETWEEN :d1 AND :d2 GROUP BY cod_cliente")
+        sql = sql.bindparams(bindparam('c', expanding=True))
+        p = {"d1": _dia(d1).isoformat(), "d2": _dia(d2).isoformat()}
+        # em blocos: a busca pode achar a base inteira e o SQLite limita os parâmetros por comando
+        with self.engine.connect() as conn:
+            return pd.concat([pd.read_sql(sql, conn, params=dict(p, c=codigos[i:i + 5000])) for i in range(0, len(codigos), 5000)], ignore_index=True)
+
+    def ciclo_cliente(self, cod_cliente, cod_estabe=0):
+        with self.engine.connect() as conn:
+            row = conn.execute(text("SELECT * FROM clientes_ciclo WHERE cod_estabe = :e AND cod_cliente = :c"),
+                               {"e": cod_estabe, "c": cod_cliente}).mappings().fetchone()
+        return dict(row) if row else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rollups de vendas (NFSCB/NFSIT) em SQLite local')
+    sub = parser.add_subparsers(dest='comando', required=True)
+    bf = sub.add_parser('backfill', help='Carga completa a partir de uma data')
+    bf.add_argument('--desde', required=True, help='AAAA-MM-DD')
+    bf.add_argument('--ate', help='AAAA-MM-DD (padrão e limite: ontem)')
+    rf = sub.add_parser('refresh', help='Carga incremental a partir do watermark')
+    rf.add_argument('--lookback', type=int, default=3, help='Dias recarregados antes do watermark')
+    args = parser.parse_args()
+
+    import app as bi
+    app = bi.create_app()
+    rollups = bi.rollups
+    with app.app_context():
+        erp = bi.get_sql_engine()
+        if erp is None: raise SystemExit('Banco do ERP não configurado (/config-db).')
+        if args.comando == 'backfill':
+            rollups.backfill(erp, datetime.strptime(args.desde, '%Y-%m-%d'),
+                             datetime.strptime(args.ate, '%Y-%m-%d') if args.ate else None)
+        else:
+            rollups.refresh(erp, args.lookback)
+    print('Rollups atualizados:', rollups.estado())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+// static/js/busca_clientes.js
+// Autocompletar da busca de clientes: sugestões do índice local (/api/clientes/busca) enquanto digita.
+function BuscaClientes(opcoes) {
+    const campo = document.getElementById(opcoes.campo);
+    const vendedor = opcoes.vendedor ? document.getElementById(opcoes.vendedor) : null;
+    const lista = document.createElement('div');
+    lista.className = 'dropdown-menu w-100';
+    campo.parentNode.classList.add('position-relative');
+    campo.setAttribute('autocomplete', 'off');
+    campo.after(lista);
+    let espera, pedido = 0;
+
+    function fechar() { lista.classList.remove('show'); }
+
+    function item(c) {
+        const destino = new URL(opcoes.destino, window.location.origin);
+        destino.searchParams.set('cliente_id', c.codigo);
+        const a = document.createElement('a');
+        a.className = 'dropdown-item';
+        a.href = destino;
+        const nome = document.createElement('div');
+        nome.textContent = `${c.codigo} - ${c.razao_social}`;
+        const extra = document.createElement('small');
+        extra.className = 'text-muted';
+        extra.textContent = [c.cgc_cpf, c.vendedores].filter(Boolean).join(' · ');
+        a.append(nome, extra);
+        return a;
+    }
+
+    campo.addEventListener('input', () => {
+        clearTimeout(espera);
+        const termo = campo.value.trim();
+        if (termo.length < 2) { fechar(); return; }
+        espera = setTimeout(() => {
+            const atual = ++pedido;
+            const u = new URL(opcoes.url, window.location.origin);
+            u.searchParams.set('q', termo);
+            if (vendedor && vendedor.value) u.searchParams.set('vendedor_id', vendedor.value);
+            fetch(u)
+                .then(r => r.json())
+                .then(dados => {
+                    if (atual !== pedido) return;  // resposta de uma digitação já substituída
+                    lista.replaceChildren(...dados.clientes.map(item));
+                    lista.classList.toggle('show', dados.clientes.length > 0);
+                })
+                .catch(fechar);
+        }, opcoes.espera || 200);
+    });
+    campo.addEventListener('keydown', e => { if (e.key === 'Escape') fechar(); });
+    document.addEventListener('click', e => { if (e.target !== campo && !lista.contains(e.target)) fechar(); });
+}
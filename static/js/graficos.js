@@ -0,0 +1,48 @@
+// static/js/graficos.js
+// Monta as figuras Plotly a partir do formato compacto de graficos.py: dados em colunas + layout comum.
+const LAYOUT_GRAFICO = {
+    font: {color: '#2a3f5f'},
+    paper_bgcolor: 'white',
+    plot_bgcolor: 'white',
+    colorway: ['#636efa', '#EF553B', '#00cc96', '#ab63fa', '#FFA15A', '#19d3f3', '#FF6692', '#B6E880', '#FF97FF', '#FECB52'],
+    hovermode: 'closest',
+    margin: {t: 60, r: 30, b: 50, l: 70},
+    eixo: {gridcolor: '#EBF0F8', linecolor: '#EBF0F8', zerolinecolor: '#EBF0F8', zerolinewidth: 2, ticks: '', automargin: true},
+};
+
+const TRACOS_GRAFICO = {
+    linha: g => [{
+        type: 'scatter', mode: g.marcadores ? 'lines+markers' : 'lines', x: g.x, y: g.y,
+        hovertemplate: `${g.x_titulo}=%{x}<br>${g.y_titulo}=%{y}<extra></extra>`,
+    }],
+    barras: g => [{
+        type: 'bar', x: g.x, y: g.y, marker: g.cor ? {color: g.cor} : {},
+        texttemplate: g.texto || '', textposition: g.texto ? 'inside' : 'none',
+        hovertemplate: `${g.x_titulo}=%{x}<br>${g.y_titulo}=%{y}<extra></extra>`,
+    }],
+    mapa: g => {
+        // células em formato longo -> matriz z[y][x]
+        const xs = [...new Set(g.x)].sort((a, b) => a - b), ys = [...new Set(g.y)];
+        const z = ys.map(() => xs.map(() => null));
+        g.z.forEach((v, i) => { z[ys.indexOf(g.y[i])][xs.indexOf(g.x[i])] = v; });
+        return [{
+            type: 'heatmap', x: xs, y: ys, z: z, colorscale: 'Blues', texttemplate: g.texto || '',
+            hovertemplate: `${g.y_titulo}=%{y}<br>${g.x_titulo}=%{x}<br>${g.z_titulo}=%{z}<extra></extra>`,
+        }];
+    },
+    pizza: g => [{
+        type: 'pie', values: g.valores, labels: g.nomes, hole: g.buraco || 0,
+        hovertemplate: `${g.nomes_titulo}=%{label}<br>${g.valores_titulo}=%{value}<extra></extra>`,
+    }],
+};
+
+function desenharGrafico(div, g) {
+    const {eixo, ...base} = LAYOUT_GRAFICO;
+    const layout = {...base, title: {text: g.titulo}};
+    if (g.tipo !== 'pizza') {
+        layout.xaxis = {...eixo, title: {text: g.x_titulo}};
+        layout.yaxis = {...eixo, title: {text: g.y_titulo}};
+    }
+    if (g.tipo === 'mapa') Object.assign(layout.yaxis, {type: 'category', autorange: 'reversed'});
+    Plotly.newPlot(div, TRACOS_GRAFICO[g.tipo](g), layout, {responsive: true, displaylogo: false});
+}
@@ -0,0 +1,72 @@
+// static/js/tabela_paginada.js
+// Tabela que busca as linhas em páginas no endpoint /api/<relatorio> (ordenação, filtro e cursor no servidor).
+function escHtml(v) {
+    return String(v ?? '').replace(/[&<>"']/g, c => ({'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;'}[c]));
+}
+
+function TabelaPaginada(opcoes) {
+    const tbody = document.getElementById(opcoes.tbody);
+    const tabela = tbody.closest('table');
+    const botaoMais = document.getElementById(opcoes.botaoMais);
+    const filtro = opcoes.filtro ? document.getElementById(opcoes.filtro) : null;
+    const estado = {ordem: opcoes.ordem, dir: 'asc', proximo: null, pedido: 0, aguardandoJob: !!opcoes.jobConcluido};
+
+    function montarUrl(apos) {
+        const u = new URL(opcoes.url, window.location.origin);
+        u.searchParams.set('ordem', estado.ordem);
+        u.searchParams.set('dir', estado.dir);
+        u.searchParams.set('limite', opcoes.limite || 100);
+        if (filtro && filtro.value.trim()) u.searchParams.set('filtro', filtro.value.trim());
+        if (apos) u.searchParams.set('apos', apos);
+        return u;
+    }
+
+    function mensagem(texto, classe) {
+        tbody.insertAdjacentHTML('beforeend', `<tr><td colspan="${opcoes.colunas}" class="text-center ${classe || ''}">${escHtml(texto)}</td></tr>`);
+    }
+
+    function carregar(reiniciar) {
+        const pedido = ++estado.pedido;
+        botaoMais.disabled = true;
+        fetch(montarUrl(reiniciar ? null : estado.proximo))
+            .then(r => r.json())
+            .then(dados => {
+                if (pedido !== estado.pedido) return;  // resposta de um pedido já substituído
+                if (dados.job && !dados.erro) {
+                    // período longo: o relatório roda como job no servidor; consulta de novo até concluir
+                    tbody.innerHTML = '';
+                    mensagem(`${dados.job.mensagem || 'Processando'}... ${Math.round((dados.job.progresso || 0) * 100)}%`, 'text-muted');
+                    estado.aguardandoJob = true;
+                    setTimeout(() => { if (pedido === estado.pedido) carregar(true); }, opcoes.intervaloJob || 2000);
+                    return;
+                }
+                if (estado.aguardandoJob && opcoes.jobConcluido) { opcoes.jobConcluido(); return; }
+                estado.aguardandoJob = false;
+                if (reiniciar) tbody.innerHTML = '';
+                if (dados.erro) { mensagem(dados.erro, 'text-danger'); dados.linhas = []; }
+                else if (reiniciar && !dados.linhas.length) mensagem(opcoes.vazio);
+                tbody.insertAdjacentHTML('beforeend', dados.linhas.map(opcoes.linha).join(''));
+                estado.proximo = dados.proximo || null;
+                botaoMais.classList.toggle('d-none', !estado.proximo);
+            })
+            .catch(e => mensagem('Erro ao carregar dados: ' + e.message, 'text-danger'))
+            .finally(() => { botaoMais.disabled = false; });
+    }
+
+    tabela.querySelectorAll('th[data-ordem]').forEach(th => {
+        th.style.cursor = 'pointer';
+        th.addEventListener('click', () => {
+            estado.dir = (estado.ordem === th.dataset.ordem && estado.dir === 'asc') ? 'desc' : 'asc';
+            estado.ordem = th.dataset.ordem;
+            tabela.querySelectorAll('th[data-ordem] .seta').forEach(s => s.remove());
+            th.insertAdjacentHTML('beforeend', `<i class="bi bi-caret-${estado.dir === 'asc' ? 'up' : 'down'}-fill seta ms-1"></i>`);
+            carregar(true);
+        });
+    });
+    botaoMais.addEventListener('click', () => carregar(false));
+    if (filtro) {
+        let espera;
+        filtro.addEventListener('input', () => { clearTimeout(espera); espera = setTimeout(() => carregar(true), 300); });
+    }
+    carregar(true);
+}
@@ -0,0 +1,70 @@
+# tests/conftest.py
+"""App apontado para um ERP sintético (benchmark.gerar) num SQLite temporário.
+
+O estado local do app (instance, rollups, jobs, cache) vai para um diretório
+temporário definido antes do primeiro import de `app`.
+"""
+import os
+import sys
+import tempfile
+from datetime import datetime
+
+import pytest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+TRABALHO = tempfile.mkdtemp(prefix='bi-testes-')
+os.environ.update({'INSTANCE_DIR': TRABALHO, 'QUERY_CACHE_BACKEND': 'memory', 'LOG_LEVEL': 'WARNING', 'WARMUP': '0'})
+
+
+@pytest.fixture(scope='session')
+def erp():
+    import benchmark
+    caminho = os.path.join(TRABALHO, 'erp.db')
+    benchmark.gerar(caminho, notas=6000, meses=14)
+    return benchmark.criar_engine(caminho)
+
+
+@pytest.fixture(scope='session')
+def bi():
+    import app as bi
+    return bi
+
+
+@pytest.fixture(scope='session')
+def aplicacao(bi, erp):
+    from flask_login import UserMixin
+    from sqlalchemy import text
+
+    class _Usuario(UserMixin):
+        id, nome, username = 1, 'Teste', 'teste'
+
+    app = bi.create_app()
+    with app.app_context(): bi.init_db()
+    bi.login_manager.user_loader(lambda user_id: _Usuario())
+    bi._erp_engine = erp
+    with erp.connect() as conn: desde = datetime.fromisoformat(conn.execute(text("SELECT MIN(Dat_Emissao) FROM NFSCB")).scalar())
+    bi.rollups.backfill(erp, desde, log=lambda *a: None)
+    yield app
+    bi.jobs.shutdown()
+    bi.query_executor.shutdown()
+
+
+@pytest.fixture
+def cliente(bi, aplicacao):
+    bi.query_cache.invalidate()
+    c = aplicacao.test_client()
+    with c.session_transaction() as sessao: sessao['_user_id'] = '1'
+    return c
+
+
+@pytest.fixture
+def consultas_erp(erp):
+    """Lista com o SQL de cada comando executado no ERP durante o teste."""
+    from sqlalchemy import event
+    executados = []
+    ouvinte = lambda conn, cursor, statement, *a: executados.append(statement)
+    event.listen(erp, 'after_cursor_execute', ouvinte)
+    yield executados
+    event.remove(erp, 'after_cursor_execute', ouvinte)
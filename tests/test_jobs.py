@@ -0,0 +1,46 @@
+# tests/test_jobs.py
+"""Limpeza dos jobs antigos e a página de cliente enquanto o índice de recomendação não existe."""
+import time
+from datetime import datetime, timedelta
+
+import pandas as pd
+from sqlalchemy import text
+
+from jobs import JobRunner
+
+
+def _esperar(runner, job_id):
+    for _ in range(100):
+        if runner.estado(job_id)['status'] in ('concluido', 'erro'): return
+        time.sleep(0.05)
+
+
+def test_submeter_apaga_jobs_antigos(tmp_path):
+    runner = JobRunner(str(tmp_path / 'jobs.db'), str(tmp_path / 'jobs'), retencao=7)
+    runner.registrar('eco', lambda params, progresso: pd.DataFrame({'n': [params['n']]}))
+    antigo = runner.submeter('eco', {'n': 1})['id']
+    _esperar(runner, antigo)
+    with runner.engine.begin() as conn:
+        conn.execute(text("UPDATE jobs SET criado_em = :d WHERE id = :id"), {"d": (datetime.now() - timedelta(days=8)).isoformat(), "id": antigo})
+
+    runner._limpo_em = time.monotonic()  # limpeza recente: a próxima submissão não repete
+    _esperar(runner, runner.submeter('eco', {'n': 2})['id'])
+    assert runner.estado(antigo) is not None
+
+    runner._limpo_em -= 3601
+    _esperar(runner, runner.submeter('eco', {'n': 3})['id'])
+    assert runner.estado(antigo) is None
+    assert not (tmp_path / 'jobs' / f'{antigo}.parquet').exists()
+    runner.shutdown()
+
+
+def test_cliente_sem_indice_nao_roda_self_join(bi, cliente, erp, monkeypatch, consultas_erp):
+    submetidos = []
+    monkeypatch.setattr(bi.recommender, 'pronto', lambda: False)
+    monkeypatch.setattr(bi.jobs, 'submeter', lambda tipo, params: submetidos.append(tipo))
+    with erp.connect() as conn: cod = conn.execute(text("SELECT Cod_Cliente FROM NFSCB GROUP BY Cod_Cliente ORDER BY COUNT(*) DESC LIMIT 1")).scalar()
+    resposta = cliente.get(f'/analise_cliente?cliente_id={cod}')
+    assert resposta.status_code == 200
+    assert 'Recomendações em preparo' in resposta.get_data(as_text=True)
+    assert 'recomendacao' in submetidos
+    assert not [sql for sql in consultas_erp if 'cp2.Cod_Cliente' in sql or 'ProdutosRelacionados' in sql]
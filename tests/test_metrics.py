@@ -0,0 +1,21 @@
+# tests/test_metrics.py
+"""Em modo multiprocesso o texto de cada impressão digital é visto por todos os workers."""
+import metrics
+
+
+def test_texto_da_consulta_visto_por_outro_processo(tmp_path, monkeypatch):
+    monkeypatch.setenv('PROMETHEUS_MULTIPROC_DIR', str(tmp_path))
+    monkeypatch.setattr(metrics, 'CONSULTAS', {})
+    fp = metrics.impressao_digital("SELECT * FROM NFSCB WHERE Cod_Cliente = 42 AND Status = 'F'")
+    assert (tmp_path / 'consultas' / f'{fp}.sql').exists()
+
+    monkeypatch.setattr(metrics, 'CONSULTAS', {})  # outro worker: nada na memória
+    assert metrics.texto_consulta(fp) == 'SELECT * FROM NFSCB WHERE Cod_Cliente = ? AND Status = ?'
+    assert metrics.texto_consulta('0000000000') == ''
+
+
+def test_sem_multiprocesso_fica_na_memoria(monkeypatch):
+    monkeypatch.delenv('PROMETHEUS_MULTIPROC_DIR', raising=False)
+    monkeypatch.setattr(metrics, 'CONSULTAS', {})
+    fp = metrics.impressao_digital('SELECT 1')
+    assert metrics.texto_consulta(fp) == 'SELECT ?'
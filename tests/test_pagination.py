@@ -0,0 +1,74 @@
+# tests/test_pagination.py
+"""Percorrer todas as páginas pelo cursor devolve cada linha uma única vez, no SQL e no DataFrame."""
+import pandas as pd
+import pytest
+from sqlalchemy import text
+
+import benchmark
+from pagination import ler_pedido, sql_pagina, pagina_df, resposta_pagina
+
+# floats que o to_json arredonda para o mesmo valor, empates e NULL na coluna de ordenação
+VALORES = [0.1 + 0.2, 0.3, 0.30000000000000004, 1 / 3, 0.3333333333333333, None, 2.5, 2.5, None, 10.0, 1e-17, 0.0]
+
+
+@pytest.fixture(scope='module')
+def tabela(tmp_path_factory):
+    df = pd.DataFrame({'id': range(1, 4 * len(VALORES) + 1), 'valor': VALORES * 4,
+                       'nome': [None if i % 5 == 0 else f'n{i % 7}' for i in range(4 * len(VALORES))]})
+    engine = benchmark.criar_engine(str(tmp_path_factory.mktemp('paginacao') / 'p.db'))
+    df.to_sql('T', engine, index=False)
+    return df, engine
+
+
+def _percorrer(pagina, args):
+    ids, apos = [], None
+    while True:
+        pedido = ler_pedido({**args, **({'apos': apos} if apos else {})}, ['valor', 'nome', 'id'], 'id')
+        resposta = resposta_pagina(pagina(pedido), pedido, ['id'])
+        ids += [l['id'] for l in resposta['linhas']]
+        apos = resposta['proximo']
+        if apos is None or len(ids) > 1000: return ids
+
+
+@pytest.mark.parametrize('ordem', ['valor', 'nome', 'id'])
+@pytest.mark.parametrize('direcao', ['asc', 'desc'])
+@pytest.mark.parametrize('limite', [1, 5, 7])
+def test_cursor_percorre_todas_as_linhas(tabela, ordem, direcao, limite):
+    df, engine = tabela
+    args = {'ordem': ordem, 'dir': direcao, 'limite': str(limite)}
+
+    def pagina_sql(pedido):
+        sql, p = sql_pagina('SELECT id, valor, nome FROM T', {}, pedido, ['id'])
+        with engine.connect() as conn: return pd.read_sql(text(sql), conn, params=p)
+
+    for pagina in (pagina_sql, lambda pedido: pagina_df(df, pedido, ['id'])):
+        ids = _percorrer(pagina, args)
+        assert sorted(ids) == list(df['id'])
+
+
+def test_sql_e_dataframe_na_mesma_ordem(tabela):
+    df, engine = tabela
+    for direcao in ('asc', 'desc'):
+        pedido = ler_pedido({'ordem': 'valor', 'dir': direcao, 'limite': '1000'}, ['valor', 'id'], 'id')
+        sql, p = sql_pagina('SELECT id, valor FROM T', {}, pedido, ['id'])
+        with engine.connect() as conn: via_sql = pd.read_sql(text(sql), conn, params=p)
+        assert list(via_sql['id']) == list(pagina_df(df, pedido, ['id'])['id'])
+
+
+@pytest.mark.parametrize('relatorio, ordem', [('vendas_produto', 'VlrLiq'), ('vendas_produto', 'Qtd_Cota_Mensal'), ('vendas_fabricante', 'Nome_Guerra')])
+@pytest.mark.parametrize('rollups_ligados', [True, False])
+def test_api_relatorio_percorre_todas_as_paginas(bi, aplicacao, cliente, monkeypatch, relatorio, ordem, rollups_ligados):
+    monkeypatch.setitem(aplicacao.config, 'ROLLUPS_ENABLED', rollups_ligados)
+    chave = bi.RELATORIOS[relatorio]['chave']
+    completo = cliente.get(f'/api/{relatorio}?limite=1000').get_json()
+    assert completo['proximo'] is None and completo['linhas']
+    esperado = sorted(tuple(l[c] for c in chave) for l in completo['linhas'])
+
+    for direcao in ('asc', 'desc'):
+        chaves, url = [], f'/api/{relatorio}?ordem={ordem}&dir={direcao}&limite=13'
+        while url:
+            resposta = cliente.get(url).get_json()
+            chaves += [tuple(l[c] for c in chave) for l in resposta['linhas']]
+            url = f"/api/{relatorio}?ordem={ordem}&dir={direcao}&limite=13&apos={resposta['proximo']}" if resposta['proximo'] else None
+        assert len(chaves) == len(set(chaves))
+        assert sorted(chaves) == esperado
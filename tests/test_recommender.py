@@ -0,0 +1,20 @@
+# tests/test_recommender.py
+"""Construção e atualização do índice de recomendação."""
+import warnings
+
+import pandas as pd
+
+from recommender import Recommender
+
+
+def test_build_e_atualizacao_sem_avisos_do_pandas(tmp_path):
+    compras = pd.DataFrame({'cod_cliente': [1, 2, 2, 3], 'cod_produto': [10, 10, 11, 11], 'cod_fabricante': [5, 5, 5, 5], 'qtd': [1.0, 2.0, 3.0, 1.0]})
+    nomes = pd.DataFrame({'codigo': [10, 11, 12], 'descricao': ['A', 'B', 'C']})
+    indice = Recommender(str(tmp_path / 'rec.pkl'))
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', FutureWarning)
+        indice.construir(compras, nomes, None, None)
+        indice.atualizar(pd.DataFrame({'cod_cliente': [4], 'cod_produto': [12], 'cod_fabricante': [5], 'qtd': [1.0]}), nomes, None)
+    assert list(indice._estado['produtos']) == [10, 11, 12]
+    assert list(indice._estado['clientes']) == ['1', '2', '3', '4']
+    assert indice.sugeridos('1') == ['B (Base: A)']
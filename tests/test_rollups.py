@@ -0,0 +1,98 @@
+# tests/test_rollups.py
+"""As visões padrão (mês corrente, até hoje) saem dos rollups + dia aberto, com os mesmos números do ERP."""
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+
+def _espiar(monkeypatch, alvo, nome):
+    chamadas = []
+    original = getattr(alvo, nome)
+    monkeypatch.setattr(alvo, nome, lambda *a, **k: chamadas.append(a) or original(*a, **k))
+    return chamadas
+
+
+def _dados_dashboard(bi, aplicacao, rollups_ligados, monkeypatch):
+    monkeypatch.setitem(aplicacao.config, 'ROLLUPS_ENABLED', rollups_ligados)
+    bi.query_cache.invalidate()
+    with aplicacao.test_request_context('/dashboard'):
+        return bi._dados_dashboard(bi.get_sql_engine())
+
+
+def test_dashboard_padrao_sem_consultas_no_erp(cliente, consultas_erp):
+    assert cliente.get('/dashboard').status_code == 200  # primeira leitura do dia aberto
+    consultas_erp.clear()
+    assert cliente.get('/dashboard').status_code == 200
+    assert consultas_erp == []
+
+
+def test_dashboard_rollups_iguais_ao_erp(bi, aplicacao, monkeypatch):
+    kpis_erp, top_erp, _, _ = _dados_dashboard(bi, aplicacao, False, monkeypatch)
+    kpis_rollup, top_rollup, _, _ = _dados_dashboard(bi, aplicacao, True, monkeypatch)
+    assert kpis_erp['faturamento_mes'] > 0
+    for chave in kpis_erp: assert kpis_rollup[chave] == pytest.approx(kpis_erp[chave])
+    assert [v['Nome_Guerra'] for v in top_rollup] == [v['Nome_Guerra'] for v in top_erp]
+
+
+def test_dia_aberto_entra_no_mes_corrente(bi, aplicacao, erp):
+    from sqlalchemy import text
+    hoje = datetime.now().strftime('%Y-%m-%d')
+    with erp.connect() as conn:
+        esperado = conn.execute(text("SELECT COUNT(*) FROM NFSCB WHERE Status = 'F' AND Cod_Estabe = 0 AND Dat_Emissao >= :h"), {"h": hoje}).scalar()
+    assert esperado > 0
+    with aplicacao.test_request_context():
+        assert bi._usa_rollups(datetime.now().replace(day=1), datetime.now())
+    notas_hoje = bi.rollups.read_sql("SELECT SUM(qtd_notas) AS n FROM notas WHERE data = :h AND cod_estabe = 0", {"h": hoje})
+    assert notas_hoje.iloc[0]['n'] == esperado
+
+
+@pytest.mark.parametrize('relatorio, funcao', [('vendas_produto', 'vendas_vendedor_produto'), ('vendas_fabricante', 'vendas_vendedor_fabricante')])
+def test_relatorio_mes_corrente_usa_rollups(bi, aplicacao, cliente, monkeypatch, relatorio, funcao):
+    chamadas = _espiar(monkeypatch, bi.rollups, funcao)
+    assert cliente.get(f'/api/{relatorio}').status_code == 200
+    assert cliente.get(f'/{relatorio}').status_code == 200
+    assert cliente.get(f'/exportar/{relatorio}?formato=csv').status_code == 200
+    assert len(chamadas) == 3
+
+    hoje = datetime.now()
+    filtros = (hoje.replace(day=1).strftime('%Y-%m-%d'), hoje.strftime('%Y-%m-%d'), '')
+    with aplicacao.test_request_context(), bi.get_sql_engine().connect() as conn:
+        totais_rollup = bi._totais_relatorio(relatorio, conn, *filtros)
+        monkeypatch.setitem(aplicacao.config, 'ROLLUPS_ENABLED', False)
+        bi.query_cache.invalidate()
+        totais_erp = bi._totais_relatorio(relatorio, conn, *filtros)
+    assert totais_rollup == pytest.approx(totais_erp)
+
+
+def test_analise_cliente_padrao_usa_rollups(bi, cliente, monkeypatch, consultas_erp):
+    ativos, ticket = _espiar(monkeypatch, bi.rollups, 'clientes_ativos'), _espiar(monkeypatch, bi.rollups, 'ticket_medio')
+    assert cliente.get('/analise_cliente').status_code == 200
+    assert ativos and ticket
+    assert not [sql for sql in consultas_erp if 'AVG(Vlr_TotalNota)' in sql or 'COUNT(DISTINCT Cod_Cliente) as total' in sql]
+
+
+def test_novos_clientes_inclui_primeiras_compras_de_hoje(bi, erp, cliente, monkeypatch, consultas_erp):
+    from sqlalchemy import text
+    agora, novo = datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 999999
+    with erp.begin() as conn:
+        conn.execute(text("INSERT INTO clien (Codigo, Razao_Social) VALUES (:c, 'CLIENTE NOVO DE HOJE')"), {"c": novo})
+        conn.execute(text("INSERT INTO NFSCB VALUES (999999, '1', 0, :c, 1, :d, 'F', 100.0)"), {"c": novo, "d": agora})
+    try:
+        bi.rollups.atualizar_aberto(erp, ttl=0)
+        novos = _espiar(monkeypatch, bi.rollups, 'novos_clientes')
+        assert cliente.get('/analise_cliente').status_code == 200
+        assert novos and not [sql for sql in consultas_erp if 'HAVING MIN(Dat_Emissao)' in sql]
+
+        hoje = datetime.now()
+        d1, d2 = hoje.replace(day=1, hour=0, minute=0, second=0), hoje.replace(hour=23, minute=59)
+        with erp.connect() as conn:
+            esperado = conn.execute(text("SELECT COUNT(*) FROM (SELECT Cod_Cliente FROM NFSCB WHERE Status='F' AND Cod_Estabe=0 "
+                                         "GROUP BY Cod_Cliente HAVING MIN(Dat_Emissao) BETWEEN :i AND :f) N"), {"i": d1, "f": d2}).scalar()
+        assert bi.rollups.novos_clientes(d1, d2).iloc[0]['novos'] == esperado
+        assert bi.rollups.novos_clientes(d1, d2 - pd.Timedelta(days=1)).iloc[0]['novos'] == esperado - 1
+    finally:
+        with erp.begin() as conn:
+            conn.execute(text("DELETE FROM NFSCB WHERE Num_Nota = 999999"))
+            conn.execute(text("DELETE FROM clien WHERE Codigo = :c"), {"c": novo})
+        bi.rollups.atualizar_aberto(erp, ttl=0)
@@ -0,0 +1,8 @@
+# wsgi.py
+"""Ponto de entrada WSGI: gunicorn -c gunicorn.conf.py wsgi:app"""
+from app import create_app, aquecer
+
+app = create_app()
+# com preload roda uma vez no processo mestre, antes do fork (WARMUP=0 desliga)
+if app.config['WARMUP']:
+    with app.app_context(): aquecer()